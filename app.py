@@ -3,28 +3,48 @@ from invoice_form_routes import add_invoice_form_routes
 from draft_invoice_routes import add_draft_invoice_routes
 from flask import Flask, render_template, request, jsonify, send_file
 from flask import render_template
-from flask import session, redirect, url_for
+from flask import session, redirect, url_for, copy_current_request_context
 from collections import OrderedDict
-import pandas as pd
+import copy
 import json
+import logging
 import os
 import datetime
 import requests
 import qrcode
 import tempfile
-from weasyprint import HTML
+import threading
+import time
 import math
 import base64
-import psycopg2
 from flask_cors import CORS
 from dotenv import load_dotenv
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+import db_pool
+import pdf_jobs
+import invoice_pdf
+import pdf_renderer
+import excel_parser
+import fbr_client
+import invoice_reporting
+import data_versions
+import pagination
+import workspace_store
+import app_logging
+import request_timing
+import metrics
+from pdf_job_routes import add_pdf_job_routes
 
 load_dotenv()
 import datetime
 
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app_logging.init_app(app)
+request_timing.init_app(app)
+metrics.init_app(app, db_pool.pool_stats)
 CORS(
     app,
     supports_credentials=True,
@@ -36,7 +56,6 @@ os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
 # Update session configuration
 app.secret_key = os.getenv("SECRET_KEY", "myfallbacksecret")
-print(app.secret_key)  # Debugging line to check secret key
 
 app.config.update(
     SESSION_COOKIE_SECURE=os.getenv("SESSION_COOKIE_SECURE", "false").lower() == "true",
@@ -51,10 +70,10 @@ app.config.update(
 @app.route("/create-invoice.html")
 def create_invoice_html():
     if "user_id" not in session:
-        print("No user_id in session, redirecting to login")
+        logger.info("No user_id in session, redirecting to login")
         return redirect(url_for("index"))
 
-    print("Access granted to create invoice page")
+    logger.debug("Access granted to create invoice page")
     return render_template("create-invoice.html")
 
 
@@ -69,7 +88,7 @@ def generate_form_invoice():
 
     try:
         # IMPORTANT FIX: Always fetch fresh data for the current client
-        # instead of relying on possibly stale data in last_json_data
+        # instead of relying on possibly stale data in the session workspace
         data = None
         conn = get_db_connection()
         cur = conn.cursor()
@@ -88,12 +107,12 @@ def generate_form_invoice():
         user_row = cur.fetchone()
         username = str(user_row[0]).strip() if user_row and user_row[0] is not None else None
 
-        print(f"Current username: {username}, client_id: {client_id}")  # Debugging log
+        logger.debug("Form invoice PDF requested", extra={"username": username, "client_id": client_id})
 
         # Get the most recent invoice for this client and environment
         cur.execute(
             """
-            SELECT invoice_data 
+            SELECT id, invoice_data 
             FROM invoices 
             WHERE client_id = %s AND env = %s AND status = 'Success'
             ORDER BY created_at DESC
@@ -103,31 +122,33 @@ def generate_form_invoice():
         )
 
         row = cur.fetchone()
+        invoice_id = None
 
         if row:
             # Convert stored JSON string to dictionary
             try:
-                data = json.loads(row[0]) if isinstance(row[0], str) else row[0]
-                print(f"Using database invoice data for client_id: {client_id}")
+                data = json.loads(row[1]) if isinstance(row[1], str) else row[1]
+                invoice_id = row[0]
+                logger.debug("Using database invoice data for client_id %s", client_id)
             except Exception as e:
-                print(f"Error parsing invoice data from database: {str(e)}")
+                logger.warning("Error parsing invoice data from database: %s", e)
 
         # If no data from database, try using the session-specific data
-        if not data and env in last_json_data:
+        cached = workspace_store.load(env, workspace_store.INVOICE_SLOT) if not data else None
+        if cached is not None:
             # IMPORTANT: Only use cached data if it belongs to current client
-            if (
-                "client_id" in last_json_data[env]
-                and last_json_data[env]["client_id"] == client_id
-            ):
-                data = last_json_data[env].copy()
-                print("Using in-memory invoice data for current client")
+            if cached.get("client_id") == client_id:
+                data = cached
+                logger.debug("Using workspace invoice data for current client")
             else:
-                print("Rejected stale in-memory data from different client")
+                logger.warning("Rejected stale workspace data from different client")
                 # Don't use data from a different client
                 data = None
 
         # Step 3: If we still don't have data, return error
         if not data:
+            cur.close()
+            conn.close()
             return (
                 jsonify(
                     {
@@ -137,325 +158,81 @@ def generate_form_invoice():
                 400,
             )
 
-        # Ensure we store the client_id with the data for future reference
-        data["client_id"] = client_id
-
-        # Get client's STRN directly from clients table
-        # First check if STRN is in the invoice_data directly
-        if "sellerSTRN" in data and data["sellerSTRN"]:
-            print(f"Using STRN from invoice data: {data['sellerSTRN']}")
-        # Next check if it's in the nested sellerData structure (from form)
-        elif "sellerData" in data and "sellerSTRN" in data["sellerData"]:
-            data["sellerSTRN"] = data["sellerData"]["sellerSTRN"]
-            print(f"Using STRN from form input: {data['sellerSTRN']}")
-        # Fall back to client's database record only as a last resort
-        else:
-            cur.execute(
-                "SELECT strn, logo_url FROM clients WHERE id = %s", (client_id,)
-            )
-            client_row = cur.fetchone()
-            if client_row and client_row[0]:
-                data["sellerSTRN"] = client_row[0]
-                print(f"Using STRN from clients table: {data['sellerSTRN']}")
-            else:
-                # Try business_profiles as final fallback
-                cur.execute(
-                    """
-                    SELECT strn FROM business_profiles 
-                    WHERE client_id = %s AND is_default = true
-                    LIMIT 1
-                    """,
-                    (client_id,),
-                )
-                bp_row = cur.fetchone()
-                if bp_row and bp_row[0]:
-                    data["sellerSTRN"] = bp_row[0]
-                    print(f"Using STRN from business_profiles: {data['sellerSTRN']}")
-                else:
-                    data["sellerSTRN"] = ""
-
-        client_logo_url = client_row[1] if client_row else None
-
-        # Get FBR logo URL
-        cur.execute("SELECT fbr_logo FROM fbr LIMIT 1;")
-        fbr_row = cur.fetchone()
-        fbr_logo_url = fbr_row[0] if fbr_row else None
-
-                # Make sure PO# is available
-        # Make sure PO# is available - replace the existing code block with this
-        if "PO" not in data or not data["PO"]:
-            print(f"Debug - Trying to find PO number in data structure")
-            # First check if poNumber exists in the root of the data
-            if "poNumber" in data:
-                print(f"Debug - Found poNumber in root: {data['poNumber']}")
-                data["PO"] = data["poNumber"]
-            # Next check if it's in the invoiceData structure
-            elif "invoiceData" in data and "poNumber" in data["invoiceData"]:
-                print(f"Debug - Found poNumber in invoiceData: {data['invoiceData']['poNumber']}")
-                data["PO"] = data["invoiceData"]["poNumber"]
-            # Check if it's in complete_invoice_data if available
-            elif "complete_invoice_data" in data:
-                invoice_data = data["complete_invoice_data"]
-                if isinstance(invoice_data, str):
-                    try:
-                        invoice_data = json.loads(invoice_data)
-                    except:
-                        invoice_data = {}
-                if "poNumber" in invoice_data:
-                    data["PO"] = invoice_data["poNumber"]
-                    print(f"Debug - Found poNumber in complete_invoice_data: {invoice_data['poNumber']}")
-            
-            print(f"Debug - Final PO value: {data.get('PO', 'Not set')}")
-
-        # Ensure DC (delivery challan) value is present in data for downstream templates
-        if not data.get("DC"):
-            dc_value = data.get("dcNumber")
-
-            invoice_data = data.get("invoiceData")
-            if not dc_value and invoice_data:
-                if isinstance(invoice_data, str):
-                    try:
-                        invoice_data = json.loads(invoice_data)
-                    except Exception:
-                        invoice_data = {}
-                if isinstance(invoice_data, dict):
-                    dc_value = (
-                        invoice_data.get("DC")
-                        or invoice_data.get("dcNumber")
-                        or dc_value
-                    )
-
-            complete_invoice_data = data.get("complete_invoice_data")
-            if not dc_value and complete_invoice_data:
-                if isinstance(complete_invoice_data, str):
-                    try:
-                        complete_invoice_data = json.loads(complete_invoice_data)
-                    except Exception:
-                        complete_invoice_data = {}
-                if isinstance(complete_invoice_data, dict):
-                    dc_value = (
-                        complete_invoice_data.get("DC")
-                        or complete_invoice_data.get("dcNumber")
-                        or dc_value
-                    )
-
-            data["DC"] = dc_value or ""
-        else:
-            data["DC"] = data.get("DC", "")
-
-        # For client 8974121 (Computer Gold), set the delivery challan number
-        # Make sure the CNIC field is properly set regardless of how it came in
-        if username == "8974121":
-            # If the form was submitted (check if CNIC is in the data)
-            if "CNIC" in data and data["CNIC"]:
-                # It's already set correctly, nothing to do
-                pass
-            # Check if it's nested in invoiceData
-            elif "invoiceData" in data and "CNIC" in data["invoiceData"]:
-                data["CNIC"] = data["invoiceData"]["CNIC"]
-            # Check if it's in sellerData (as it is in the form)
-            elif "sellerData" in data and "CNIC" in data["sellerData"]:
-                data["CNIC"] = data["sellerData"]["CNIC"]
-            # Check if there's a special field for delivery challan in the data
-            elif "deliveryChallan" in data:
-                data["CNIC"] = data["deliveryChallan"]
-        else:
-            # For other clients, ensure CNIC is available (even if empty)
-            if "CNIC" not in data:
-                data["CNIC"] = ""
-
-        # Calculate totals
-        items = data.get("items", [])
-        total_excl = 0
-        total_tax = 0
-        total_further_tax = 0
-
-        buyer_reg = (
-            str(
-                data.get("buyerRegistrationType")
-                or (data.get("buyerData") or {}).get("buyerRegistrationType")
-                or (data.get("buyerData") or {}).get("registration_type")
-                or ""
-            )
-            .strip()
-            .lower()
-        )
-        apply_further_tax = username == "0946915" and buyer_reg == "unregistered"
-
-        # Add unit rate for each item if not present
-        for item in items:
-            try:
-                excl = float(str(item.get("valueSalesExcludingST", 0)).replace(",", ""))
-                tax = float(str(item.get("salesTaxApplicable", 0)).replace(",", ""))
-                qty = float(str(item.get("quantity", 1)).replace(",", ""))
-
-                total_excl += excl
-                total_tax += tax
-
-                further_tax_amount = 0
-                if apply_further_tax:
-                    raw_ft_amount = item.get("furtherTaxAmount")
-                    raw_ft_pct = item.get("furtherTaxPercent")
-                    raw_ft = item.get("furtherTax")
-
-                    # Priority 1: explicit amount field
-                    if raw_ft_amount is not None:
-                        try:
-                            further_tax_amount = float(str(raw_ft_amount).replace(",", ""))
-                        except Exception:
-                            further_tax_amount = 0
-                    else:
-                        # Priority 2: percent field -> compute from excl
-                        if raw_ft_pct is not None:
-                            try:
-                                further_pct = float(str(raw_ft_pct).replace("%", ""))
-                            except Exception:
-                                further_pct = 0
-                            if further_pct > 0 and excl > 0:
-                                further_tax_amount = round((excl * further_pct) / 100, 2)
-                        else:
-                            # Priority 3: raw furtherTax treated as AMOUNT (not percent)
-                            # Frontend sends furtherTax as amount in JSON; honor that here
-                            try:
-                                further_tax_amount = float(str(raw_ft).replace(",", "")) if raw_ft is not None else 0
-                            except Exception:
-                                further_tax_amount = 0
-
-                    item["furtherTaxAmount"] = further_tax_amount
-                    total_further_tax += further_tax_amount
-                else:
-                    item["furtherTaxAmount"] = 0
-
-                # Calculate unit rate if not present
-                if "unitrate" not in item and qty > 0:
-                    item["unitrate"] = excl / qty
-            except:
-                # Handle any conversion errors
-                pass
-
-        # Add totals to data
-        data["totalExcl"] = round(total_excl, 2)
-        if apply_further_tax:
-            data["totalFurtherTax"] = round(total_further_tax, 2)
-            data["totalTax"] = round(total_tax + total_further_tax, 2)
-            data["totalInclusive"] = round(total_excl + total_tax + total_further_tax, 2)
-            data["showFurtherTax"] = data["totalFurtherTax"] > 0
-        else:
-            data["totalFurtherTax"] = 0
-            data["totalTax"] = round(total_tax, 2)
-            data["totalInclusive"] = round(total_excl + total_tax, 2)
-            data["showFurtherTax"] = False
-
-        # Convert to words with PKR style
-        from num2words import num2words
-
-        total = round(data["totalInclusive"], 2)
-        amount_in_words = num2words(total, to="currency", lang="en", currency="USD")
-        amount_in_words = amount_in_words.replace("dollars", "rupees").replace(
-            "cents", "paisa"
-        )
-        amount_in_words += " only"
-        data["amountInWords"] = amount_in_words
+        template_name, context = _prepare_form_invoice_render(cur, client_id, username, data)
 
-        # Generate QR Code as base64
-        qr_base64 = ""
-        fbr_invoice = data.get("fbrInvoiceNumber", "")
-        if fbr_invoice:
-            try:
-                qr = qrcode.make(fbr_invoice)
-                with BytesIO() as buffer:
-                    qr.save(buffer)
-                    buffer.seek(0)
-                    qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-            except Exception as e:
-                print(f"Error generating QR code: {str(e)}")
-
-        # Select the appropriate template based on username - expand with all your clients
-        print(f"Selecting template for username: {username}")
-        if username in {"H075895", "F667833", "infinityeng"}:
-            template_name = "invoice_innovative.html"
-            print(f"Selected template: {template_name} for username {username}")
-        elif username == "8974121":
-            template_name = "invoice_template.html"
-            print(f"Selected template: {template_name} for Computer Gold")
-        elif username == "7542425":
-            template_name = "invoice_template3.html"
-            print(f"Selected template: {template_name} for username 7542425")
-        elif username in ["3075270", "0946915", "7542425", "2853653", "B690329", "3520271603355", "3556084"]:
-            template_name = "invoice_template3.html"  # Shared template for these users
-            print(f"Selected template: {template_name} for username: {username}")
-        else:
-            template_name = "invoice_template2.html"
-            print(
-                f"Selected default template: {template_name} for username: {username}"
-            )
-
-        # Store the current data in last_json_data with client_id for future reference
+        # Store the current data in the workspace with client_id for future reference
         clean_payload = json.loads(json.dumps(data))
         for item in clean_payload.get("items", []):
             item.pop("furtherTaxAmount", None)
             item.pop("furtherTaxPercent", None)
         clean_payload.pop("totalFurtherTax", None)
         clean_payload.pop("showFurtherTax", None)
-        last_json_data[env] = clean_payload
+        workspace_store.save(env, workspace_store.INVOICE_SLOT, clean_payload)
 
-        print(
-            f"Final template: {template_name}, Client: {client_id}, STRN: {data.get('sellerSTRN', 'Not set')}"
+        logger.debug(
+            "Final template: %s", template_name, extra={"client_id": client_id}
         )
 
         # Render HTML invoice with the selected template
-        rendered_html = render_template(
-            template_name,
-            data=data,
-            qr_base64=qr_base64,
-            client_logo_url=client_logo_url,
-            fbr_logo_url=fbr_logo_url,
-            username=username,
-        )
+        rendered_html = render_template(template_name, **context)
+        source_hash = invoice_pdf.html_content_hash(rendered_html)
 
-        # Generate PDF directly to a stream
-        pdf_stream = BytesIO()
-        HTML(string=rendered_html).write_pdf(pdf_stream)
-        pdf_binary = pdf_stream.getvalue()
-        pdf_stream.seek(0)
-
-        # Store PDF in database if this invoice was successfully submitted
-        try:
-            # Find the most recent invoice for this client/env to update with PDF
-            cur.execute(
-                """UPDATE invoices 
-                   SET pdf_data = %s 
-                   WHERE id = (
-                       SELECT id FROM invoices
-                       WHERE client_id = %s AND env = %s AND status = 'Success' 
-                       AND pdf_data IS NULL
-                       ORDER BY created_at DESC 
-                       LIMIT 1
-                   )""",
-                (pdf_binary, client_id, env)
+        # Serve the stored PDF when it was rendered from identical HTML
+        pdf_binary = None
+        if invoice_id is not None:
+            pdf_binary = invoice_pdf.load_cached_pdf(cur, invoice_id, source_hash)
+
+        # ?async=1: render in the background job queue and let the UI poll;
+        # a job already queued or running for this invoice is reused
+        if (
+            pdf_binary is None
+            and request.args.get("async") in ("1", "true")
+            and invoice_id is not None
+        ):
+            job_id = invoice_pdf.pending_render_job(cur, invoice_id)
+            cur.close()
+            conn.close()
+            if job_id is None:
+                job_id = pdf_jobs.get_queue().enqueue(invoice_id, client_id, env, rendered_html)
+            return (
+                jsonify(
+                    {
+                        "jobId": job_id,
+                        "status": pdf_jobs.JOB_QUEUED,
+                        "statusUrl": url_for("get_pdf_job_status", job_id=job_id),
+                        "downloadUrl": url_for("download_pdf_job", job_id=job_id),
+                    }
+                ),
+                202,
             )
-            conn.commit()
-        except Exception as update_error:
-            print(f"Error updating PDF data: {update_error}")
-            import traceback
-            traceback.print_exc()
-            # Continue even if PDF storage fails
+
+        if pdf_binary is None:
+            pdf_binary = pdf_renderer.render_pdf(rendered_html)
+
+            # Store PDF in database so later downloads reuse it
+            if invoice_id is not None:
+                try:
+                    invoice_pdf.store_invoice_pdf(cur, invoice_id, pdf_binary, source_hash)
+                    conn.commit()
+                except Exception as update_error:
+                    conn.rollback()
+                    logger.exception("Error updating PDF data: %s", update_error)
+                    # Continue even if PDF storage fails
+        else:
+            logger.debug("Serving stored PDF for invoice %s", invoice_id)
 
         cur.close()
         conn.close()
 
         return send_file(
-            pdf_stream,
+            BytesIO(pdf_binary),
             mimetype="application/pdf",
             as_attachment=True,
             download_name="invoice.pdf",
         )
 
     except Exception as e:
-        print(f"Error generating PDF from form: {str(e)}")
-        import traceback
-
-        traceback.print_exc()
+        logger.exception("Error generating PDF from form: %s", e)
         return jsonify({"error": f"Failed to generate PDF: {str(e)}"}), 500
 
 
@@ -480,8 +257,6 @@ def get_client_config(client_id, env):
         conn = get_db_connection()
         cur = conn.cursor()
 
-        print(f"Getting client config for client_id: {client_id}, env: {env}")
-
         cur.execute(
             """
             SELECT sandbox_api_url, sandbox_api_token, production_api_url, production_api_token
@@ -496,7 +271,7 @@ def get_client_config(client_id, env):
         conn.close()
 
         if not row:
-            print(f"No client configuration found for client_id: {client_id}")
+            logger.warning("No client configuration found for client_id %s", client_id)
             raise Exception("Client configuration not found")
 
         (
@@ -506,25 +281,18 @@ def get_client_config(client_id, env):
             production_api_token,
         ) = row
 
-        print(f"Retrieved client config successfully for env: {env}")
-
         if env == "sandbox":
             return {"api_url": sandbox_api_url, "api_token": sandbox_api_token}
         else:
             return {"api_url": production_api_url, "api_token": production_api_token}
     except Exception as e:
-        print(f"Error in get_client_config: {str(e)}")
+        logger.error("Error in get_client_config: %s", e)
         raise
 
 
 def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        database=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        port=os.getenv("DB_PORT"),
-    )
+    # Pooled per worker process; conn.close() returns the connection to the pool
+    return db_pool.get_connection()
 
 
 def get_env():
@@ -631,13 +399,409 @@ def _extract_fbr_error_message(res_json, fallback_text=""):
     return "Invoice rejected by FBR. Please review the values and try again."
 
 
+def _parsed_upload(env):
+    """Parse result of the workbook last uploaded for *env*, or None."""
+    filepath, _ = workspace_store.load_upload(env)
+    if filepath:
+        return excel_parser.parse_invoice_workbook(filepath)
+    return None
+
+
+def _prepare_excel_invoice_render(cur, client_id, user_id, data, parsed):
+    """Fill *data* (an uploaded-Excel invoice payload) with the display-only
+    fields of its workbook block *parsed* and pick its template.
+    Returns (template_name, template context)."""
+    items = data["items"]
+
+    # Display-only values from the uploaded workbook (parsed once, cached by file hash)
+    if parsed:
+        section_data = parsed["section"]
+
+        # --- Assign extracted fields to `data` dictionary ---
+        data["sellerSTRN"] = section_data.get("sellerSTRN", "")
+        data["buyerSTRN"] = section_data.get("buyerSTRN", "")
+        data["CNIC"] = section_data.get("CNIC", "")
+        data["PO"] = section_data.get("PO#", "")
+
+        # Extract unit rate for each product item
+        product_rows = parsed["products"]
+        for i, item in enumerate(items):
+            if i < len(product_rows):  # Ensure index is in range
+                try:
+                    item["unitrate"] = float(product_rows[i].get("rate", 0))
+                except:
+                    item["unitrate"] = 0
+
+    # Calculate totals
+    total_excl = 0
+    total_tax = 0
+
+    for item in items:
+        try:
+            excl = float(str(item.get("valueSalesExcludingST", 0)).replace(",", ""))
+        except:
+            excl = 0
+        try:
+            tax = float(str(item.get("salesTaxApplicable", 0)).replace(",", ""))
+        except:
+            tax = 0
+
+        total_excl += excl
+        total_tax += tax
+
+    # Add totals to data
+    data["totalExcl"] = round(total_excl, 2)
+    data["totalTax"] = round(total_tax, 2)
+    data["totalInclusive"] = round(total_excl + total_tax, 2)
+
+    from num2words import num2words
+
+    # Convert to words with PKR style
+    total = round(data["totalInclusive"], 2)
+    amount_in_words = num2words(total, to="currency", lang="en", currency="USD")
+    amount_in_words = amount_in_words.replace("dollars", "rupees").replace(
+        "cents", "paisa"
+    )
+    amount_in_words += " only"
+    data["amountInWords"] = amount_in_words
+
+    # Get FBR invoice number
+    fbr_invoice = data.get("fbrInvoiceNumber", "")
+
+    # --- Generate QR Code as base64 ---
+    qr_base64 = ""
+    if fbr_invoice:
+        try:
+            qr = qrcode.make(fbr_invoice)
+            with BytesIO() as buffer:
+                qr.save(buffer)
+                buffer.seek(0)
+                qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        except Exception as e:
+            logger.warning("Error generating QR code: %s", e)
+            # Continue without QR code if there's an error
+
+    # Get username in one query
+    cur.execute("SELECT username FROM users WHERE id = %s", (user_id,))
+    user_row = cur.fetchone()
+    username = str(user_row[0]).strip() if user_row and user_row[0] is not None else None
+
+    # Get client logo in another query - removed strn column from the query
+    client_logo_url = None
+    if client_id:
+        cur.execute("SELECT logo_url FROM clients WHERE id = %s", (client_id,))
+        logo_row = cur.fetchone()
+        client_logo_url = logo_row[0] if logo_row else None
+
+    # Fetch FBR logo URL in a third query
+    cur.execute("SELECT fbr_logo FROM fbr LIMIT 1;")
+    fbr_row = cur.fetchone()
+    fbr_logo_url = fbr_row[0] if fbr_row else None
+
+    # Select the appropriate template based on username
+    if username == "8974121":
+        template_name = "invoice_template.html"
+    elif username == "5207949":
+        template_name = "invoice_zeeshanst.html"
+    elif username == "7542425":
+        template_name = "invoice_template3.html"
+    elif username in ["3075270", "B690329", "3520271603355", "3556084"]:
+        template_name = "invoice_template3.html"  # Use appropriate template for Care Pharmaceuticals
+    else:
+        template_name = "invoice_template3.html"
+
+    return template_name, {
+        "data": data,
+        "qr_base64": qr_base64,
+        "client_logo_url": client_logo_url,
+        "fbr_logo_url": fbr_logo_url,
+    }
+
+
+def _prepare_form_invoice_render(cur, client_id, username, data):
+    """Build (template_name, template context) for a form-created invoice.
+
+    Shared by /api/generate-form-invoice and submit_fbr so both render the
+    exact same HTML for an invoice, which lets the stored PDF be reused.
+    Mutates *data* in place.
+    """
+    # Ensure we store the client_id with the data for future reference
+    data["client_id"] = client_id
+
+    cur.execute("SELECT strn, logo_url FROM clients WHERE id = %s", (client_id,))
+    client_row = cur.fetchone()
+
+    # Get client's STRN directly from clients table
+    # First check if STRN is in the invoice_data directly
+    if "sellerSTRN" in data and data["sellerSTRN"]:
+        logger.debug("Using STRN from invoice data")
+    # Next check if it's in the nested sellerData structure (from form)
+    elif "sellerData" in data and "sellerSTRN" in data["sellerData"]:
+        data["sellerSTRN"] = data["sellerData"]["sellerSTRN"]
+        logger.debug("Using STRN from form input")
+    # Fall back to client's database record only as a last resort
+    elif client_row and client_row[0]:
+        data["sellerSTRN"] = client_row[0]
+        logger.debug("Using STRN from clients table")
+    else:
+        # Try business_profiles as final fallback
+        cur.execute(
+            """
+            SELECT strn FROM business_profiles 
+            WHERE client_id = %s AND is_default = true
+            LIMIT 1
+            """,
+            (client_id,),
+        )
+        bp_row = cur.fetchone()
+        if bp_row and bp_row[0]:
+            data["sellerSTRN"] = bp_row[0]
+            logger.debug("Using STRN from business_profiles")
+        else:
+            data["sellerSTRN"] = ""
+
+    client_logo_url = client_row[1] if client_row else None
+
+    # Get FBR logo URL
+    cur.execute("SELECT fbr_logo FROM fbr LIMIT 1;")
+    fbr_row = cur.fetchone()
+    fbr_logo_url = fbr_row[0] if fbr_row else None
+
+    # Make sure PO# is available
+    if "PO" not in data or not data["PO"]:
+        # First check if poNumber exists in the root of the data
+        if "poNumber" in data:
+            data["PO"] = data["poNumber"]
+        # Next check if it's in the invoiceData structure
+        elif "invoiceData" in data and "poNumber" in data["invoiceData"]:
+            data["PO"] = data["invoiceData"]["poNumber"]
+        # Check if it's in complete_invoice_data if available
+        elif "complete_invoice_data" in data:
+            invoice_data = data["complete_invoice_data"]
+            if isinstance(invoice_data, str):
+                try:
+                    invoice_data = json.loads(invoice_data)
+                except:
+                    invoice_data = {}
+            if "poNumber" in invoice_data:
+                data["PO"] = invoice_data["poNumber"]
+
+        logger.debug("PO number resolved: %s", data.get("PO", "Not set"))
+
+    # Ensure DC (delivery challan) value is present in data for downstream templates
+    if not data.get("DC"):
+        dc_value = data.get("dcNumber")
+
+        invoice_data = data.get("invoiceData")
+        if not dc_value and invoice_data:
+            if isinstance(invoice_data, str):
+                try:
+                    invoice_data = json.loads(invoice_data)
+                except Exception:
+                    invoice_data = {}
+            if isinstance(invoice_data, dict):
+                dc_value = (
+                    invoice_data.get("DC")
+                    or invoice_data.get("dcNumber")
+                    or dc_value
+                )
+
+        complete_invoice_data = data.get("complete_invoice_data")
+        if not dc_value and complete_invoice_data:
+            if isinstance(complete_invoice_data, str):
+                try:
+                    complete_invoice_data = json.loads(complete_invoice_data)
+                except Exception:
+                    complete_invoice_data = {}
+            if isinstance(complete_invoice_data, dict):
+                dc_value = (
+                    complete_invoice_data.get("DC")
+                    or complete_invoice_data.get("dcNumber")
+                    or dc_value
+                )
+
+        data["DC"] = dc_value or ""
+    else:
+        data["DC"] = data.get("DC", "")
+
+    # For client 8974121 (Computer Gold), set the delivery challan number
+    # Make sure the CNIC field is properly set regardless of how it came in
+    if username == "8974121":
+        # If the form was submitted (check if CNIC is in the data)
+        if "CNIC" in data and data["CNIC"]:
+            # It's already set correctly, nothing to do
+            pass
+        # Check if it's nested in invoiceData
+        elif "invoiceData" in data and "CNIC" in data["invoiceData"]:
+            data["CNIC"] = data["invoiceData"]["CNIC"]
+        # Check if it's in sellerData (as it is in the form)
+        elif "sellerData" in data and "CNIC" in data["sellerData"]:
+            data["CNIC"] = data["sellerData"]["CNIC"]
+        # Check if there's a special field for delivery challan in the data
+        elif "deliveryChallan" in data:
+            data["CNIC"] = data["deliveryChallan"]
+    else:
+        # For other clients, ensure CNIC is available (even if empty)
+        if "CNIC" not in data:
+            data["CNIC"] = ""
+
+    # Calculate totals
+    items = data.get("items", [])
+    total_excl = 0
+    total_tax = 0
+    total_further_tax = 0
+
+    buyer_reg = (
+        str(
+            data.get("buyerRegistrationType")
+            or (data.get("buyerData") or {}).get("buyerRegistrationType")
+            or (data.get("buyerData") or {}).get("registration_type")
+            or ""
+        )
+        .strip()
+        .lower()
+    )
+    apply_further_tax = username == "0946915" and buyer_reg == "unregistered"
+
+    # Add unit rate for each item if not present
+    for item in items:
+        try:
+            excl = float(str(item.get("valueSalesExcludingST", 0)).replace(",", ""))
+            tax = float(str(item.get("salesTaxApplicable", 0)).replace(",", ""))
+            qty = float(str(item.get("quantity", 1)).replace(",", ""))
+
+            total_excl += excl
+            total_tax += tax
+
+            further_tax_amount = 0
+            if apply_further_tax:
+                raw_ft_amount = item.get("furtherTaxAmount")
+                raw_ft_pct = item.get("furtherTaxPercent")
+                raw_ft = item.get("furtherTax")
+
+                # Priority 1: explicit amount field
+                if raw_ft_amount is not None:
+                    try:
+                        further_tax_amount = float(str(raw_ft_amount).replace(",", ""))
+                    except Exception:
+                        further_tax_amount = 0
+                else:
+                    # Priority 2: percent field -> compute from excl
+                    if raw_ft_pct is not None:
+                        try:
+                            further_pct = float(str(raw_ft_pct).replace("%", ""))
+                        except Exception:
+                            further_pct = 0
+                        if further_pct > 0 and excl > 0:
+                            further_tax_amount = round((excl * further_pct) / 100, 2)
+                    else:
+                        # Priority 3: raw furtherTax treated as AMOUNT (not percent)
+                        # Frontend sends furtherTax as amount in JSON; honor that here
+                        try:
+                            further_tax_amount = float(str(raw_ft).replace(",", "")) if raw_ft is not None else 0
+                        except Exception:
+                            further_tax_amount = 0
+
+                item["furtherTaxAmount"] = further_tax_amount
+                total_further_tax += further_tax_amount
+            else:
+                item["furtherTaxAmount"] = 0
+
+            # Calculate unit rate if not present
+            if "unitrate" not in item and qty > 0:
+                item["unitrate"] = excl / qty
+        except:
+            # Handle any conversion errors
+            pass
+
+    # Add totals to data
+    data["totalExcl"] = round(total_excl, 2)
+    if apply_further_tax:
+        data["totalFurtherTax"] = round(total_further_tax, 2)
+        data["totalTax"] = round(total_tax + total_further_tax, 2)
+        data["totalInclusive"] = round(total_excl + total_tax + total_further_tax, 2)
+        data["showFurtherTax"] = data["totalFurtherTax"] > 0
+    else:
+        data["totalFurtherTax"] = 0
+        data["totalTax"] = round(total_tax, 2)
+        data["totalInclusive"] = round(total_excl + total_tax, 2)
+        data["showFurtherTax"] = False
+
+    # Convert to words with PKR style
+    from num2words import num2words
+
+    total = round(data["totalInclusive"], 2)
+    amount_in_words = num2words(total, to="currency", lang="en", currency="USD")
+    amount_in_words = amount_in_words.replace("dollars", "rupees").replace(
+        "cents", "paisa"
+    )
+    amount_in_words += " only"
+    data["amountInWords"] = amount_in_words
+
+    # Generate QR Code as base64
+    qr_base64 = ""
+    fbr_invoice = data.get("fbrInvoiceNumber", "")
+    if fbr_invoice:
+        try:
+            qr = qrcode.make(fbr_invoice)
+            with BytesIO() as buffer:
+                qr.save(buffer)
+                buffer.seek(0)
+                qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        except Exception as e:
+            logger.warning("Error generating QR code: %s", e)
+
+    # Select the appropriate template based on username - expand with all your clients
+    if username in {"H075895", "F667833", "infinityeng"}:
+        template_name = "invoice_innovative.html"
+    elif username == "8974121":
+        template_name = "invoice_template.html"  # Computer Gold
+    elif username == "7542425":
+        template_name = "invoice_template3.html"
+    elif username in ["3075270", "0946915", "7542425", "2853653", "B690329", "3520271603355", "3556084"]:
+        template_name = "invoice_template3.html"  # Shared template for these users
+    else:
+        template_name = "invoice_template2.html"
+    logger.debug("Selected template %s", template_name, extra={"username": username})
+
+
+    return template_name, {
+        "data": data,
+        "qr_base64": qr_base64,
+        "client_logo_url": client_logo_url,
+        "fbr_logo_url": fbr_logo_url,
+        "username": username,
+    }
+
+
 add_invoice_form_routes(app, get_db_connection, get_env)
 add_draft_invoice_routes(app, get_db_connection, get_env)
 add_reports_routes(app, get_db_connection, get_env)
+add_pdf_job_routes(app, get_db_connection)
+pdf_jobs.init_queue(get_db_connection)
+workspace_store.init_store(get_db_connection, app.config["UPLOAD_FOLDER"])
+
+
+@app.cli.command("backfill-reporting")
+def backfill_reporting_command():
+    """Rebuild the invoice reporting columns and invoice_items from stored invoices."""
+    invoices_done, items_written = invoice_reporting.backfill_reporting(get_db_connection)
+    logger.info("Backfilled %s invoices (%s items)", invoices_done, items_written)
+
+
+@app.cli.command("migrate-pdfs-to-store")
+def migrate_pdfs_to_store_command():
+    """Move invoice PDFs still held in invoices.pdf_data into the PDF store."""
+    moved, moved_bytes = invoice_pdf.migrate_blobs_to_store(get_db_connection)
+    logger.info("Moved %s invoice PDFs (%s bytes) to the PDF store", moved, moved_bytes)
+
 
-# Store last uploaded file and last JSON per environment
-last_uploaded_file = {}
-last_json_data = {}
+# /records page size when ?limit= is given without a value / its upper bound
+RECORDS_PAGE_SIZE = 50
+RECORDS_MAX_PAGE_SIZE = 500
+
+# Invoices submitted to FBR at once by /submit-fbr-batch
+FBR_BATCH_CONCURRENCY = int(os.getenv("FBR_BATCH_CONCURRENCY", "4"))
 
 
 @app.route("/login", methods=["POST"])
@@ -646,7 +810,7 @@ def login():
     password = request.form.get("password")
     env = request.form.get("environment")
 
-    print("Trying to log in with:", username, password)
+    logger.info("Login attempt", extra={"username": username, "env": env})
 
     conn = get_db_connection()
     cur = conn.cursor()
@@ -657,14 +821,13 @@ def login():
     user = cur.fetchone()
 
     if not user:
-        print("No user found.")
+        logger.info("Login failed: unknown user or wrong password", extra={"username": username})
         cur.close()
         conn.close()
         return render_template("index.html", error="Invalid username or password")
 
     user_id = user[0]
     name = user[1]
-    print("User ID found:", user_id)
 
     cur.execute("SELECT id FROM clients WHERE user_id = %s", (user_id,))
     client = cur.fetchone()
@@ -672,7 +835,7 @@ def login():
     conn.close()
 
     if not client:
-        print("No client linked to this user.")
+        logger.warning("Login failed: no client linked to user %s", user_id)
         return render_template("index.html", error="Client info missing")
 
     # Make session permanent and set values
@@ -682,50 +845,86 @@ def login():
     session["env"] = env
     session["name"] = name
 
-    print("Session created with user_id:", session.get("user_id"))
+    logger.info("Session created", extra={"user_id": user_id, "client_id": client[0]})
     return redirect(url_for("dashboard_html"))
 
 
 @app.before_request
 def before_request():
-    print("Current session:", dict(session))
-    print("Current endpoint:", request.endpoint)
-
     # List of routes that don't require authentication
-    public_routes = ["index", "login", "static"]
+    public_routes = ["index", "login", "static", "prometheus_metrics"]
 
     # Check if route needs protection
     if request.endpoint and request.endpoint not in public_routes:
         if "user_id" not in session:
-            print("No user_id in session, redirecting to login")
+            logger.debug("No user_id in session, redirecting to login", extra={"sample_rate": 0.1})
             return redirect(url_for("index"))
 
 
 @app.route("/records", methods=["GET"])
+@data_versions.conditional_get(get_db_connection, "invoices", get_env)
 def get_records():
+    """All invoices of the session's client/env, newest first.
+
+    With ?limit=N (and the next_cursor of the previous page as ?cursor=) the
+    list is served in keyset pages as {"records", "next_cursor", "has_more",
+    "total_items"}; ?count=exact|approx|none picks how total_items is computed.
+    Without them the whole list is returned as before.
+    """
     env = get_env()
     client_id = session.get("client_id")
 
+    paginated = "limit" in request.args or "cursor" in request.args
+    cursor_row = None
+    limit = None
+    if paginated:
+        try:
+            limit = min(max(int(request.args.get("limit") or RECORDS_PAGE_SIZE), 1), RECORDS_MAX_PAGE_SIZE)
+            if request.args.get("cursor"):
+                cursor_row = pagination.decode_cursor(request.args["cursor"])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    count_mode = request.args.get("count", "none")
+    if count_mode not in pagination.COUNT_MODES:
+        count_mode = "none"
+
     conn = get_db_connection()
     cur = conn.cursor()
 
+    conditions = ["client_id = %s", "env = %s"]
+    params = [client_id, env]
+    total_count = None
+    if paginated:
+        total_count = pagination.count_rows(
+            cur, "FROM invoices WHERE client_id = %s AND env = %s", params, count_mode
+        )
+        if cursor_row:
+            conditions.append(pagination.keyset_condition("DESC"))
+            params.extend(cursor_row[:2])
+
     cur.execute(
-        """
-        SELECT invoice_data, fbr_response, status, created_at
+        f"""
+        SELECT invoice_data, fbr_response, status, created_at, id
         FROM invoices
-        WHERE client_id = %s AND env = %s
-        ORDER BY created_at DESC
+        WHERE {" AND ".join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        {"LIMIT %s" if paginated else ""}
     """,
-        (client_id, env),
+        params + ([limit + 1] if paginated else []),
     )
 
     rows = cur.fetchall()
     cur.close()
     conn.close()
 
+    has_more = paginated and len(rows) > limit
+    if paginated:
+        rows = rows[:limit]
+    start = cursor_row[2] + 1 if cursor_row else 1
+
     records = []
-    for idx, row in enumerate(rows, start=1):
-        invoice_data_raw, fbr_response_raw, status, created_at = row
+    for idx, row in enumerate(rows, start=start):
+        invoice_data_raw, fbr_response_raw, status, created_at, _ = row
 
         # Ensure parsed JSON objects
         try:
@@ -779,10 +978,25 @@ def get_records():
 
             records.append(record)
         except Exception as e:
-            print(f"Error parsing row #{idx}: {e}")
+            logger.warning("Error parsing row #%s: %s", idx, e)
             continue
 
-    return jsonify(records)
+    if not paginated:
+        return jsonify(records)
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = pagination.encode_cursor(last[3], last[4], start - 1 + len(rows))
+    return jsonify(
+        {
+            "records": records,
+            "next_cursor": next_cursor,
+            "has_more": has_more,
+            "total_items": total_count,
+            "count_mode": count_mode,
+        }
+    )
 
 
 # New endpoint to delete an invoice
@@ -842,6 +1056,7 @@ def delete_invoice():
         invoice_id = row[0]
 
         # Delete the invoice
+        invoice_reporting.remove_invoice(cur, invoice_id)
         cur.execute("DELETE FROM invoices WHERE id = %s", (invoice_id,))
         conn.commit()
 
@@ -851,7 +1066,7 @@ def delete_invoice():
         return jsonify({"success": True, "message": "Invoice deleted successfully"})
 
     except Exception as e:
-        print(f"Error deleting invoice: {str(e)}")
+        logger.error("Error deleting invoice: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
@@ -862,104 +1077,74 @@ def upload_excel():
     file = request.files.get("file")
     if not file or not file.filename.endswith((".xlsx", ".xls")):
         return jsonify({"error": "Invalid file format"}), 400
-    filepath = os.path.join(app.config["UPLOAD_FOLDER"], f"{env}_{file.filename}")
-    file.save(filepath)
-    last_uploaded_file[env] = filepath
+    workspace_store.save_upload(env, file.filename, file.read())
     return jsonify({"message": "File uploaded successfully"})
 
 
-# Get JSON Data
-@app.route("/get-json", methods=["GET"])
-def get_json():
-    env = get_env()
-    if env not in last_uploaded_file or not os.path.exists(last_uploaded_file[env]):
-        print("ERROR: File not found or not uploaded. Env =", env)
-        print("last_uploaded_file =", last_uploaded_file)
-        return jsonify({"error": "No file uploaded"}), 400
-
-    def safe(val, default=""):
-        return default if pd.isna(val) or val in [None, ""] else val
-
-    df = pd.read_excel(last_uploaded_file[env], header=None)
-
-    # Parse sectioned key-value pairs
-    section_data = {}
-    product_start_index = None
-
-    for i, row in df.iterrows():
-        key = str(row[0]).strip() if pd.notna(row[0]) else ""
-        val = row[1] if len(row) > 1 else None
+def _safe_cell(val, default=""):
+    return default if excel_parser.is_missing(val) else val
 
-        if key.lower() == "productdescription":
-            product_start_index = i
-            break
 
-        if key and not any(key.startswith(s) for s in ["1)", "2)", "3)", "4)"]):
-            section_data[key] = safe(val, "")
+def _build_excel_invoice_json(parsed, env):
+    """Turn one parsed workbook block into the FBR invoice payload.
 
-    if product_start_index is None:
-        print("ERROR: No product section found. Section data:", section_data)
-        print("File path:", last_uploaded_file[env])
-        return jsonify({"error": "No product section found"}), 400
-
-    product_df = pd.read_excel(last_uploaded_file[env], skiprows=product_start_index)
+    Raises ValueError when a product row cannot be converted.
+    """
+    section_data = {key: _safe_cell(val, "") for key, val in parsed["section"].items()}
 
     items = []
-    for _, row in product_df.iterrows():
+    for row in parsed["products"]:
         try:
-            rate_raw = safe(row.get("STrate", ""), "")
+            rate_raw = _safe_cell(row.get("STrate", ""), "")
             rate = (
                 str(rate_raw).strip()
                 if isinstance(rate_raw, str)
                 else f"{int(float(rate_raw) * 100)}%"
             )
 
-            hs_code_raw = safe(row.get("hsCode", ""))
+            hs_code_raw = _safe_cell(row.get("hsCode", ""))
             hs_code = (
                 "{:.4f}".format(float(hs_code_raw))
-                if isinstance(hs_code_raw, (int, float)) and not pd.isna(hs_code_raw)
+                if isinstance(hs_code_raw, (int, float)) and not excel_parser.is_missing(hs_code_raw)
                 else str(hs_code_raw).strip()
             )
 
             item = OrderedDict(
                 [
                     ("hsCode", hs_code),
-                    ("productDescription", safe(row.get("productDescription"))),
+                    ("productDescription", _safe_cell(row.get("productDescription"))),
                     ("rate", rate),
-                    ("uoM", safe(row.get("uoM"))),
-                    ("quantity", round(float(safe(row.get("quantity"), 0)), 2)),
-                    ("totalValues", round(float(safe(row.get("totalValues"), 0)), 2)),
+                    ("uoM", _safe_cell(row.get("uoM"))),
+                    ("quantity", round(float(_safe_cell(row.get("quantity"), 0)), 2)),
+                    ("totalValues", round(float(_safe_cell(row.get("totalValues"), 0)), 2)),
                     (
                         "valueSalesExcludingST",
-                        round(float(safe(row.get("valueSalesExcludingST"), 0)), 2),
+                        round(float(_safe_cell(row.get("valueSalesExcludingST"), 0)), 2),
                     ),
                     (
                         "fixedNotifiedValueOrRetailPrice",
-                        float(safe(row.get("fixedNotifiedValueOrRetailPrice"), 0)),
+                        float(_safe_cell(row.get("fixedNotifiedValueOrRetailPrice"), 0)),
                     ),
                     (
                         "salesTaxApplicable",
-                        round(float(safe(row.get("salesTaxApplicable"), 0)), 2),
+                        round(float(_safe_cell(row.get("salesTaxApplicable"), 0)), 2),
                     ),
                     (
                         "salesTaxWithheldAtSource",
-                        float(safe(row.get("salesTaxWithheldAtSource"), 0)),
+                        float(_safe_cell(row.get("salesTaxWithheldAtSource"), 0)),
                     ),
-                    ("extraTax", str(safe(row.get("extraTax")))),
-                    ("furtherTax", float(safe(row.get("furtherTax"), 0))),
-                    ("sroScheduleNo", str(safe(row.get("sroScheduleNo")))),
-                    ("fedPayable", float(safe(row.get("fedPayable"), 0))),
-                    ("discount", float(safe(row.get("discount"), 0))),
-                    ("saleType", str(safe(row.get("saleType")))),
-                    ("sroItemSerialNo", str(safe(row.get("sroItemSerialNo")))),
+                    ("extraTax", str(_safe_cell(row.get("extraTax")))),
+                    ("furtherTax", float(_safe_cell(row.get("furtherTax"), 0))),
+                    ("sroScheduleNo", str(_safe_cell(row.get("sroScheduleNo")))),
+                    ("fedPayable", float(_safe_cell(row.get("fedPayable"), 0))),
+                    ("discount", float(_safe_cell(row.get("discount"), 0))),
+                    ("saleType", str(_safe_cell(row.get("saleType")))),
+                    ("sroItemSerialNo", str(_safe_cell(row.get("sroItemSerialNo")))),
                 ]
             )
             items.append(item)
         except Exception as e:
-            return (
-                jsonify({"error": f"Error parsing row: {row.to_dict()} — {str(e)}"}),
-                400,
-            )
+            raise ValueError(f"Error parsing row: {dict(row)} — {str(e)}")
 
     raw_date = section_data.get("invoiceDate", "")
     if isinstance(raw_date, datetime.datetime):
@@ -969,249 +1154,250 @@ def get_json():
 
     invoice_json = OrderedDict(
         [
-            ("invoiceType", safe(section_data.get("invoiceType"))),
+            ("invoiceType", _safe_cell(section_data.get("invoiceType"))),
             ("invoiceDate", invoice_date),
-            ("sellerNTNCNIC", str(safe(section_data.get("sellerNTNCNIC")))),
-            ("sellerBusinessName", safe(section_data.get("sellerBusinessName"))),
-            ("sellerProvince", safe(section_data.get("sellerProvince"))),
-            ("sellerAddress", safe(section_data.get("sellerAddress"))),
-            ("buyerNTNCNIC", str(safe(section_data.get("buyerNTNCNIC")))),
-            ("buyerBusinessName", safe(section_data.get("buyerBusinessName"))),
-            ("buyerProvince", safe(section_data.get("buyerProvince"))),
-            ("buyerAddress", safe(section_data.get("buyerAddress"))),
-            ("buyerRegistrationType", safe(section_data.get("buyerRegistrationType"))),
+            ("sellerNTNCNIC", str(_safe_cell(section_data.get("sellerNTNCNIC")))),
+            ("sellerBusinessName", _safe_cell(section_data.get("sellerBusinessName"))),
+            ("sellerProvince", _safe_cell(section_data.get("sellerProvince"))),
+            ("sellerAddress", _safe_cell(section_data.get("sellerAddress"))),
+            ("buyerNTNCNIC", str(_safe_cell(section_data.get("buyerNTNCNIC")))),
+            ("buyerBusinessName", _safe_cell(section_data.get("buyerBusinessName"))),
+            ("buyerProvince", _safe_cell(section_data.get("buyerProvince"))),
+            ("buyerAddress", _safe_cell(section_data.get("buyerAddress"))),
+            ("buyerRegistrationType", _safe_cell(section_data.get("buyerRegistrationType"))),
             (
                 "invoiceRefNo",
-                str(safe(section_data.get("invoiceRefNo", ""))),
+                str(_safe_cell(section_data.get("invoiceRefNo", ""))),
             ),  # critical fix
-            ("scenarioId", safe(section_data.get("scenarioId"))),
+            ("scenarioId", _safe_cell(section_data.get("scenarioId"))),
         ]
     )
 
     # Only include scenarioId if sandbox
     if env == "sandbox":
-        invoice_json["scenarioId"] = safe(section_data.get("scenarioId"))
+        invoice_json["scenarioId"] = _safe_cell(section_data.get("scenarioId"))
 
     invoice_json["items"] = items
 
-    last_json_data[env] = invoice_json
+    return invoice_json
+
+
+# Get JSON Data
+@app.route("/get-json", methods=["GET"])
+def get_json():
+    env = get_env()
+    filepath, _ = workspace_store.load_upload(env)
+    if not filepath:
+        logger.warning("No uploaded workbook in workspace", extra={"env": env})
+        return jsonify({"error": "No file uploaded"}), 400
+
+    # One streaming pass over the workbook, cached for the later steps
+    parsed = excel_parser.parse_invoice_workbook(filepath)
+
+    if parsed["product_start_index"] is None:
+        section_data = {key: _safe_cell(val, "") for key, val in parsed["section"].items()}
+        logger.warning(
+            "No product section found", extra={"section_keys": list(section_data), "file": filepath}
+        )
+        return jsonify({"error": "No product section found"}), 400
+
+    try:
+        invoice_json = _build_excel_invoice_json(parsed, env)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    workspace_store.save(env, workspace_store.INVOICE_SLOT, invoice_json)
     return app.response_class(
         response=json.dumps(invoice_json, indent=2, allow_nan=False),
         mimetype="application/json",
     )
 
 
-@app.route("/submit-fbr", methods=["POST"])
-def submit_fbr():
-    env = get_env()
-    if env not in last_json_data:
-        return jsonify({"error": "No JSON to submit"}), 400
+def _submit_invoice_to_fbr(env, client_id, user_id, payload, config, parsed_workbook=None):
+    """POST one invoice payload to FBR and, if accepted, store it.
 
-    # Use a separate variable and clear global variable to save memory
-    json_data = last_json_data[env].copy()
+    Shared by /submit-fbr and /submit-fbr-batch. Renders the invoice HTML,
+    inserts the invoices row and queues its PDF job. Returns (result dict,
+    HTTP status). requests.Timeout / ConnectionError propagate to the caller.
+    Needs a request context (render_template / url_for).
+    """
+    json_data = payload.copy()
 
     if "sellerAddress" in json_data:
         json_data["sellerAddress"] = json_data["sellerAddress"].strip().replace("\n", " ")
     if "buyerAddress" in json_data:
         json_data["buyerAddress"] = json_data["buyerAddress"].strip().replace("\n", " ")
-        
-    try:
-        client_id = session.get("client_id")
-        if not client_id:
-            return jsonify({"error": "No client ID in session"}), 400
-
-        config = get_client_config(client_id, env)
-        api_url = config["api_url"]
-        api_token = config["api_token"]
-
-        print(f"API URL: {api_url}")  # Logging API URL (without token for security)
 
-        headers = {
-            "Authorization": f"Bearer {api_token}",
-            "Content-Type": "application/json",
-        }
-
-        # Log request data (excluding sensitive info)
-        print(f"Submitting data to FBR, env: {env}")
+    # Send request to FBR with timeout to prevent worker hanging; the pooled
+    # per-env session reuses keep-alive connections across submissions
+    try:
+        response = fbr_client.post_invoice(
+            env, config["api_url"], config["api_token"], json_data, timeout=180
+        )
+    except requests.Timeout:
+        metrics.count_fbr_submission(env, "none", "timeout")
+        raise
+    except requests.ConnectionError:
+        metrics.count_fbr_submission(env, "none", "connection_error")
+        raise
+    # Parse response
+    try:
+        res_json = response.json()
+    except Exception as e:
+        logger.warning(
+            "Failed to parse FBR response as JSON: %s",
+            e,
+            extra={"status": response.status_code, "response_text": response.text[:500]},
+        )
+        res_json = {}
+    # Whole responses only at DEBUG, and only a sample of them
+    logger.debug("FBR API response", extra={"fbr_response": res_json, "sample_rate": 0.05})
+
+    invoice_no = res_json.get("invoiceNumber", "N/A")
+    json_data["fbrInvoiceNumber"] = invoice_no
+    is_success = bool(invoice_no and invoice_no != "N/A")
+    metrics.count_fbr_submission(env, response.status_code, "Success" if is_success else "Failed")
+
+    # If failed, return error without inserting into DB
+    if not is_success:
+        friendly_error = _extract_fbr_error_message(res_json, response.text)
+        return (
+            {
+                "status": "Failed",
+                "status_code": response.status_code,
+                "error": friendly_error,
+                "response_text": response.text,
+            },
+            400,
+        )
 
-        # Send request to FBR with timeout to prevent worker hanging
-        response = requests.post(api_url, headers=headers, json=json_data, timeout=180)
-        print(f"FBR API Response status: {response.status_code}")
+    # Extract minimal necessary data
+    status = "Success"
+    date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        # Parse response
-        try:
-            res_json = response.json()
-            print(f"FBR API Response: {res_json}")
-        except Exception as e:
-            print(f"Failed to parse response as JSON: {str(e)}")
-            print(f"Response text: {response.text}")
-            res_json = {}
-
-        invoice_no = res_json.get("invoiceNumber", "N/A")
-        json_data["fbrInvoiceNumber"] = invoice_no
-        last_json_data[env]["fbrInvoiceNumber"] = invoice_no
-        is_success = bool(invoice_no and invoice_no != "N/A")
-
-        # If failed, return error without inserting into DB
-        if not is_success:
-            friendly_error = _extract_fbr_error_message(res_json, response.text)
-            return (
-                jsonify(
-                    {
-                        "status": "Failed",
-                        "status_code": response.status_code,
-                        "error": friendly_error,
-                        "response_text": response.text,
-                    }
-                ),
-                400,
+    # Render the invoice HTML now, exactly as the download endpoints will,
+    # so the PDF produced by the background job is reused by them
+    rendered_html = None
+    conn_temp = None
+    cur_temp = None
+    try:
+        conn_temp = get_db_connection()
+        cur_temp = conn_temp.cursor()
+        if "client_id" in json_data:
+            # Form flow: /api/generate-form-invoice renders from the stored invoice_data
+            cur_temp.execute(
+                "SELECT u.username FROM users u JOIN clients c ON u.id = c.user_id WHERE c.id = %s",
+                (client_id,),
             )
-
-        # Extract minimal necessary data
-        status = "Success"
-        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        # Generate PDF and store it (only for new invoices from now on)
-        pdf_binary = None
-        try:
-            # Generate PDF using same logic as generate-invoice-excel
-            data = json_data.copy()
-            items = data["items"]
-
-            # Transform form data structure to flat structure for template compatibility
-            # If data came from form (has nested sellerData/buyerData), flatten it
-            if "sellerData" in data:
-                seller_data = data["sellerData"]
-                data["sellerBusinessName"] = seller_data.get("sellerBusinessName", "")
-                data["sellerAddress"] = seller_data.get("sellerAddress", "")
-                data["sellerProvince"] = seller_data.get("sellerProvince", "")
-                data["sellerNTNCNIC"] = seller_data.get("sellerNTNCNIC", "")
-                data["sellerSTRN"] = seller_data.get("sellerSTRN", "")
-            
-            if "buyerData" in data:
-                buyer_data = data["buyerData"]
-                data["buyerBusinessName"] = buyer_data.get("buyerBusinessName", "")
-                data["buyerAddress"] = buyer_data.get("buyerAddress", "")
-                data["buyerProvince"] = buyer_data.get("buyerProvince", "")
-                data["buyerNTNCNIC"] = buyer_data.get("buyerNTNCNIC", "")
-                data["buyerSTRN"] = buyer_data.get("buyerSTRN", "")
-                data["buyerRegistrationType"] = buyer_data.get("buyerRegistrationType", "")
-
-            # Calculate totals and add unit rate for each item
-            total_excl = 0
-            total_tax = 0
-            for item in items:
-                excl = float(item.get("valueSalesExcludingST", 0))
-                tax = float(item.get("salesTaxApplicable", 0))
-                qty = float(item.get("quantity", 1))
-                
-                total_excl += excl
-                total_tax += tax
-                
-                # Calculate unit rate if not present
-                if "unitrate" not in item:
-                    item["unitrate"] = round(excl / qty, 2) if qty > 0 else 0
-            
-            data["totalExcl"] = round(total_excl, 2)
-            data["totalTax"] = round(total_tax, 2)
-            data["totalInclusive"] = round(total_excl + total_tax, 2)
-
-            # Convert to words
-            from num2words import num2words
-            total = round(data["totalInclusive"], 2)
-            amount_in_words = num2words(total, to="currency", lang="en", currency="USD")
-            amount_in_words = amount_in_words.replace("dollars", "rupees").replace("cents", "paisa") + " only"
-            data["amountInWords"] = amount_in_words
-
-            # Generate QR Code
-            import qrcode
-            import base64
-            fbr_invoice = data.get("fbrInvoiceNumber", "")
-            qr_base64 = ""
-            if fbr_invoice:
-                qr = qrcode.QRCode(version=1, box_size=10, border=2)
-                qr.add_data(fbr_invoice)
-                qr.make(fit=True)
-                img = qr.make_image(fill="black", back_color="white")
-                buffer = BytesIO()
-                img.save(buffer, format="PNG")
-                qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-
-            # Get client logo and username for template selection
-            conn_temp = get_db_connection()
-            cur_temp = conn_temp.cursor()
-            cur_temp.execute("SELECT logo_url FROM clients WHERE id = %s", (client_id,))
-            client_row = cur_temp.fetchone()
-            client_logo_url = client_row[0] if client_row else None
-            
-            cur_temp.execute("SELECT u.username FROM users u JOIN clients c ON u.id = c.user_id WHERE c.id = %s", (client_id,))
             user_row = cur_temp.fetchone()
             username = str(user_row[0]).strip() if user_row and user_row[0] is not None else None
-            
-            cur_temp.execute("SELECT fbr_logo FROM fbr LIMIT 1")
-            fbr_row = cur_temp.fetchone()
-            fbr_logo_url = fbr_row[0] if fbr_row else None
+            template_name, context = _prepare_form_invoice_render(
+                cur_temp, client_id, username, json.loads(json.dumps(json_data))
+            )
+        else:
+            # Excel flow: /generate-invoice-excel renders from the uploaded workbook
+            excel_data = copy.deepcopy(payload)
+            excel_data["fbrInvoiceNumber"] = invoice_no
+            template_name, context = _prepare_excel_invoice_render(
+                cur_temp, client_id, user_id, excel_data, parsed_workbook
+            )
+        rendered_html = render_template(template_name, **context)
+    except Exception as pdf_error:
+        logger.exception("Error rendering invoice HTML for PDF storage: %s", pdf_error)
+        # Continue without PDF if rendering fails
+    finally:
+        if cur_temp:
             cur_temp.close()
+        if conn_temp:
             conn_temp.close()
 
-            # Select template
-            if username in ["8974121"]:
-                template_name = "invoice_template.html"
-            elif username == "5207949":
-                template_name = "invoice_zeeshanst.html"
-            elif username == "7542425":
-                template_name = "invoice_template3.html"
-            elif username in ["3075270", "0946915", "2853653", "B690329", "3520271603355", "3556084"]:
-                template_name = "invoice_template3.html"
-            else:
-                template_name = "invoice_template2.html"
-
-            # Render and generate PDF
-            rendered_html = render_template(
-                template_name,
-                data=data,
-                qr_base64=qr_base64,
-                client_logo_url=client_logo_url,
-                fbr_logo_url=fbr_logo_url,
-                username=username
-            )
-            pdf_stream = BytesIO()
-            HTML(string=rendered_html).write_pdf(pdf_stream)
-            pdf_binary = pdf_stream.getvalue()
-        except Exception as pdf_error:
-            print(f"Error generating PDF for storage: {pdf_error}")
-            import traceback
-            traceback.print_exc()
-            # Continue without PDF if generation fails
-
-        # Insert into invoices table - use try/finally to ensure connection is closed
-        conn = None
-        cur = None
+    # Insert into invoices table - use try/finally to ensure connection is closed
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO invoices (client_id, env, invoice_data, fbr_response, status, created_at)
+            VALUES (%s, %s, %s, %s, %s, NOW())
+            RETURNING id
+        """,
+            (client_id, env, json.dumps(json_data), json.dumps(res_json), status),
+        )
+        invoice_id = cur.fetchone()[0]
+        invoice_reporting.record_invoice(cur, invoice_id)
+        conn.commit()
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+    # Queue the PDF render; failures here must not fail the FBR submission
+    pdf_job = None
+    if rendered_html:
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute(
-                """
-                INSERT INTO invoices (client_id, env, invoice_data, fbr_response, status, created_at, pdf_data)
-                VALUES (%s, %s, %s, %s, %s, NOW(), %s)
-            """,
-                (client_id, env, json.dumps(json_data), json.dumps(res_json), status, pdf_binary),
-            )
-            conn.commit()
-        finally:
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
+            job_id = pdf_jobs.get_queue().enqueue(invoice_id, client_id, env, rendered_html)
+            pdf_job = {
+                "id": job_id,
+                "status": pdf_jobs.JOB_QUEUED,
+                "status_url": url_for("get_pdf_job_status", job_id=job_id),
+            }
+        except Exception as e:
+            logger.error("Error queueing PDF job for invoice %s: %s", invoice_id, e)
+
+    return (
+        {
+            "status": status,
+            "invoiceNumber": invoice_no,
+            "date": date,
+            "invoiceId": str(invoice_id),
+            "pdfJob": pdf_job,
+        },
+        200,
+    )
+
+
+@app.route("/submit-fbr", methods=["POST"])
+def submit_fbr():
+    env = get_env()
+    payload = workspace_store.load(env, workspace_store.INVOICE_SLOT)
+    if payload is None:
+        return jsonify({"error": "No JSON to submit"}), 400
+
+    try:
+        client_id = session.get("client_id")
+        if not client_id:
+            return jsonify({"error": "No client ID in session"}), 400
+
+        config = get_client_config(client_id, env)
+
+        # Log request data (excluding sensitive info)
+        logger.info("Submitting invoice to FBR", extra={"env": env, "api_url": config["api_url"]})
+
+        result, status_code = _submit_invoice_to_fbr(
+            env,
+            client_id,
+            session.get("user_id"),
+            payload,
+            config,
+            parsed_workbook=None if "client_id" in payload else _parsed_upload(env),
+        )
+        payload["fbrInvoiceNumber"] = result.get("invoiceNumber", "N/A")
+        workspace_store.save(env, workspace_store.INVOICE_SLOT, payload)
+
+        if result["status"] != "Success":
+            return jsonify(result), status_code
 
         # If this submission originated from a saved draft, mark that draft as submitted
         try:
-            # Prefer draft_id from the request body, fallback to in-memory cache
+            # Prefer draft_id from the request body, fallback to the workspace payload
             req_body = request.get_json(silent=True) or {}
             draft_id = req_body.get("draft_id")
-            if not draft_id and env in last_json_data:
-                # last_json_data may contain a draft reference if the frontend set it
-                draft_id = last_json_data[env].get("draft_id")
+            if not draft_id:
+                # The payload may contain a draft reference if the frontend set it
+                draft_id = payload.get("draft_id")
 
             if draft_id:
                 try:
@@ -1230,202 +1416,301 @@ def submit_fbr():
                     conn2.commit()
                     cur2.close()
                     conn2.close()
-                    print(f"Marked draft {draft_id} as submitted for client {client_id} (env={env})")
+                    logger.info(
+                        "Marked draft %s as submitted", draft_id, extra={"client_id": client_id, "env": env}
+                    )
                 except Exception as e:
-                    print(f"Warning: Failed to mark draft {draft_id} as submitted: {e}")
+                    logger.warning("Failed to mark draft %s as submitted: %s", draft_id, e)
         except Exception as e:
             # Non-fatal: do not block a successful submission if marking draft fails
-            print(f"Error checking draft_id after submission: {e}")
+            logger.warning("Error checking draft_id after submission: %s", e)
 
         # Return response
-        return jsonify({"status": status, "invoiceNumber": invoice_no, "date": date})
+        return jsonify(result)
 
     except requests.Timeout:
-        print("Request to FBR API timed out")
+        logger.error("Request to FBR API timed out", extra={"env": env})
         return jsonify({"error": "Request to FBR API timed out after 15 seconds"}), 504
     except requests.ConnectionError:
-        print("Failed to connect to FBR API server")
+        logger.error("Failed to connect to FBR API server", extra={"env": env})
         return jsonify({"error": "Failed to connect to FBR API server"}), 503
     except Exception as e:
-        print(f"Error in submit_fbr: {str(e)}")
-        import traceback
-
-        traceback.print_exc()
+        logger.exception("Error in submit_fbr: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
-# Generate Invoice PDF - optimized to use less memory
-@app.route("/generate-invoice-excel", methods=["GET"])
-def generate_invoice_excel():
+# Get JSON for every invoice in a multi-invoice workbook
+@app.route("/get-json-batch", methods=["GET"])
+def get_json_batch():
     env = get_env()
-    if env not in last_json_data:
-        return jsonify({"error": "No JSON data to generate invoice"}), 400
-
-    try:
-        # Work with a copy of the data to avoid modifying global state
-        data = last_json_data[env].copy()
-        items = data["items"]
-
-        # Read from Excel file again to get display-only values
-        filepath = last_uploaded_file.get(env)
-        if filepath and os.path.exists(filepath):
-            df = pd.read_excel(filepath, header=None, keep_default_na=False)
-
-            # --- Extract section data (header fields above the product list) ---
-            section_data = {}
-            product_start_index = None
-
-            for i, row in df.iterrows():
-                key = str(row[0]).strip() if pd.notna(row[0]) else ""
-                val = row[1] if len(row) > 1 else None
-
-                # Check where product section starts
-                if key.lower() == "productdescription":
-                    product_start_index = i
-                    break
-
-                # Store key-value pairs from the header section
-                if key and not any(key.startswith(s) for s in ["1)", "2)", "3)", "4)"]):
-                    section_data[key] = val
-
-            # --- Assign extracted fields to `data` dictionary ---
-            data["sellerSTRN"] = section_data.get("sellerSTRN", "")
-            data["buyerSTRN"] = section_data.get("buyerSTRN", "")
-            data["CNIC"] = section_data.get("CNIC", "")
-            data["PO"] = section_data.get("PO#", "")
-
-            # --- Read products table from product_start_index ---
-            product_df = pd.read_excel(filepath, skiprows=product_start_index)
-
-            # Extract unit rate for each product item
-            for i, item in enumerate(items):
-                if i < len(product_df):  # Ensure index is in range
-                    try:
-                        item["unitrate"] = float(product_df.iloc[i].get("rate", 0))
-                    except:
-                        item["unitrate"] = 0
-
-        # Calculate totals
-        total_excl = 0
-        total_tax = 0
+    filepath, upload_sha256 = workspace_store.load_upload(env)
+    if not filepath:
+        return jsonify({"error": "No file uploaded"}), 400
 
-        for item in items:
-            try:
-                excl = float(str(item.get("valueSalesExcludingST", 0)).replace(",", ""))
-            except:
-                excl = 0
-            try:
-                tax = float(str(item.get("salesTaxApplicable", 0)).replace(",", ""))
-            except:
-                tax = 0
+    parsed_invoices = excel_parser.parse_invoice_workbook_batch(filepath)
+    if not parsed_invoices:
+        return jsonify({"error": "No product section found"}), 400
 
-            total_excl += excl
-            total_tax += tax
+    batch = []
+    for index, parsed in enumerate(parsed_invoices):
+        entry = {
+            "index": index,
+            "sheet": parsed["sheet"],
+            "block": parsed["block"],
+            "invoice": None,
+            "error": None,
+        }
+        try:
+            entry["invoice"] = _build_excel_invoice_json(parsed, env)
+        except ValueError as e:
+            entry["error"] = str(e)
+        batch.append(entry)
+
+    # The parsed blocks are not stored; /submit-fbr-batch re-reads them from the
+    # (cached) parse of the same upload
+    workspace_store.save(
+        env, workspace_store.BATCH_SLOT, {"upload_sha256": upload_sha256, "entries": batch}
+    )
+    valid = sum(1 for entry in batch if entry["invoice"] is not None)
+    response = {
+        "invoices": batch,
+        "summary": {"total": len(batch), "valid": valid, "invalid": len(batch) - valid},
+    }
+    return app.response_class(
+        response=json.dumps(response, indent=2, allow_nan=False),
+        mimetype="application/json",
+    )
 
-        # Add totals to data
-        data["totalExcl"] = round(total_excl, 2)
-        data["totalTax"] = round(total_tax, 2)
-        data["totalInclusive"] = round(total_excl + total_tax, 2)
 
-        from num2words import num2words
+@app.route("/submit-fbr-batch", methods=["POST"])
+def submit_fbr_batch():
+    env = get_env()
+    stored = workspace_store.load(env, workspace_store.BATCH_SLOT)
+    if not stored or not stored["entries"]:
+        return jsonify({"error": "No batch to submit"}), 400
 
-        # Convert to words with PKR style
-        total = round(data["totalInclusive"], 2)
-        amount_in_words = num2words(total, to="currency", lang="en", currency="USD")
-        amount_in_words = amount_in_words.replace("dollars", "rupees").replace(
-            "cents", "paisa"
-        )
-        amount_in_words += " only"
-        data["amountInWords"] = amount_in_words
+    filepath, upload_sha256 = workspace_store.load_upload(env)
+    if not filepath or upload_sha256 != stored["upload_sha256"]:
+        return jsonify({"error": "The uploaded workbook changed; load the batch again"}), 409
+    batch = stored["entries"]
+    parsed_invoices = excel_parser.parse_invoice_workbook_batch(filepath)
 
-        # Get FBR invoice number
-        fbr_invoice = data.get("fbrInvoiceNumber", "")
+    client_id = session.get("client_id")
+    if not client_id:
+        return jsonify({"error": "No client ID in session"}), 400
+    user_id = session.get("user_id")
 
-        # --- Generate QR Code as base64 ---
-        qr_base64 = ""
-        if fbr_invoice:
-            try:
-                qr = qrcode.make(fbr_invoice)
-                with BytesIO() as buffer:
-                    qr.save(buffer)
-                    buffer.seek(0)
-                    qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-            except Exception as e:
-                print(f"Error generating QR code: {str(e)}")
-                # Continue without QR code if there's an error
+    req_body = request.get_json(silent=True) or {}
+    indexes = req_body.get("indexes")
+    if indexes is not None:
+        try:
+            if not isinstance(indexes, list):
+                raise TypeError
+            wanted = {int(i) for i in indexes}
+        except (TypeError, ValueError):
+            return jsonify({"error": "indexes must be a list of invoice indexes"}), 400
+        unknown = wanted - {entry["index"] for entry in batch}
+        if unknown:
+            return jsonify({"error": f"Unknown batch indexes: {sorted(unknown)}"}), 400
+        selected = [entry for entry in batch if entry["index"] in wanted]
+    else:
+        selected = batch
 
-        # Fetch client logo from database
-        client_id = session.get("client_id")
-        user_id = session.get("user_id")
-        client_logo_url = None
+    try:
+        config = get_client_config(client_id, env)
+    except Exception as e:
+        logger.error("Error loading FBR config for batch: %s", e)
+        return jsonify({"error": str(e)}), 500
 
-        # Fetch required data from DB in a single connection
+    # Invoices of this batch that FBR already accepted, e.g. in a run whose
+    # response (or workspace save) was lost; keyed by invoiceRefNo
+    refs = {
+        str(entry["invoice"].get("invoiceRefNo") or "").strip()
+        for entry in selected
+        if entry["invoice"] is not None
+    }
+    refs.discard("")
+    accepted = {}
+    if refs:
         conn = None
         cur = None
         try:
             conn = get_db_connection()
             cur = conn.cursor()
-
-            # Get username in one query
-            cur.execute("SELECT username FROM users WHERE id = %s", (user_id,))
-            user_row = cur.fetchone()
-            username = str(user_row[0]).strip() if user_row and user_row[0] is not None else None
-
-            # Get client logo in another query - removed strn column from the query
-            if client_id:
-                cur.execute("SELECT logo_url FROM clients WHERE id = %s", (client_id,))
-                logo_row = cur.fetchone()
-                client_logo_url = logo_row[0] if logo_row else None
-
-            # Fetch FBR logo URL in a third query
-            cur.execute("SELECT fbr_logo FROM fbr LIMIT 1;")
-            fbr_row = cur.fetchone()
-            fbr_logo_url = fbr_row[0] if fbr_row else None
+            cur.execute(
+                """
+                SELECT invoice_ref, fbr_invoice_number
+                FROM invoices
+                WHERE client_id = %s AND env = %s AND status = 'Success'
+                  AND invoice_ref = ANY(%s)
+                """,
+                (client_id, env, sorted(refs)),
+            )
+            accepted = {ref: number for ref, number in cur.fetchall()}
+        except Exception as e:
+            logger.error("Error checking submitted invoices for batch: %s", e)
+            return jsonify({"error": str(e)}), 500
         finally:
             if cur:
                 cur.close()
             if conn:
                 conn.close()
 
-        # Select the appropriate template based on username
-        if username == "8974121":
-            template_name = "invoice_template.html"
-        elif username == "5207949":
-            template_name = "invoice_zeeshanst.html"
-        elif username == "7542425":
-            template_name = "invoice_template3.html"
-        elif username in ["3075270", "B690329", "3520271603355", "3556084"]:
-            template_name = "invoice_template3.html"  # Use appropriate template for Care Pharmaceuticals
-        else:
-            template_name = "invoice_template3.html"
+    # Worker threads record each accepted FBR number in the workspace right
+    # away, so a crash or timeout mid-batch cannot lead to a resubmission
+    save_lock = threading.Lock()
+
+    def submit_entry(entry):
+        base = {"index": entry["index"], "sheet": entry["sheet"], "block": entry["block"]}
+        if entry["invoice"] is None:
+            return {**base, "status": "Invalid", "error": entry["error"]}
+        submitted_no = entry["invoice"].get("fbrInvoiceNumber")
+        if submitted_no and submitted_no != "N/A":
+            # Already accepted by FBR in an earlier run; never submit twice
+            return {**base, "status": "Skipped", "invoiceNumber": submitted_no}
+        ref = str(entry["invoice"].get("invoiceRefNo") or "").strip()
+        if ref in accepted:
+            with save_lock:
+                entry["invoice"]["fbrInvoiceNumber"] = accepted[ref] or "N/A"
+            return {**base, "status": "Skipped", "invoiceNumber": accepted[ref]}
+        try:
+            result, _ = _submit_invoice_to_fbr(
+                env, client_id, user_id, entry["invoice"], config, parsed_invoices[entry["index"]]
+            )
+        except requests.Timeout:
+            result = {"status": "Failed", "error": "Request to FBR API timed out"}
+        except requests.ConnectionError:
+            result = {"status": "Failed", "error": "Failed to connect to FBR API server"}
+        except Exception as e:
+            logger.exception("Error submitting batch invoice %s: %s", entry["index"], e)
+            result = {"status": "Failed", "error": str(e)}
+        with save_lock:
+            entry["invoice"]["fbrInvoiceNumber"] = result.get("invoiceNumber", "N/A")
+            if result.get("status") == "Success":
+                try:
+                    workspace_store.save(env, workspace_store.BATCH_SLOT, stored)
+                except Exception as e:
+                    logger.error("Error saving batch progress after invoice %s: %s", entry["index"], e)
+        return {**base, **result}
+
+    started = time.monotonic()
+    concurrency = max(1, min(FBR_BATCH_CONCURRENCY, len(selected) or 1))
+    logger.info(
+        "Submitting batch of %s invoices to FBR",
+        len(selected),
+        extra={"env": env, "concurrency": concurrency},
+    )
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fbr-batch") as executor:
+        # Each worker needs its own copy of the request context for
+        # render_template/url_for and the session
+        futures = [
+            executor.submit(copy_current_request_context(submit_entry), entry)
+            for entry in selected
+        ]
+        results = [future.result() for future in futures]
+
+    # Keep the FBR numbers (also of skipped invoices) so a resubmitted batch
+    # skips the accepted invoices without asking the database again
+    workspace_store.save(env, workspace_store.BATCH_SLOT, stored)
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+
+    return jsonify(
+        {
+            "results": results,
+            "summary": {
+                "total": len(results),
+                "succeeded": counts.get("Success", 0),
+                "failed": counts.get("Failed", 0),
+                "invalid": counts.get("Invalid", 0),
+                "skipped": counts.get("Skipped", 0),
+                "elapsed_seconds": round(time.monotonic() - started, 2),
+            },
+        }
+    )
 
-        # --- Render HTML invoice with the selected template ---
-        rendered_html = render_template(
-            template_name,
-            data=data,
-            qr_base64=qr_base64,
-            client_logo_url=client_logo_url,
-            fbr_logo_url=fbr_logo_url,
+
+@app.route("/api/connection-stats", methods=["GET"])
+def connection_stats():
+    """Connection pool metrics for this worker process (DB and FBR API)."""
+    return jsonify({"db": db_pool.pool_stats(), "fbr": fbr_client.stats()})
+
+
+# Generate Invoice PDF - optimized to use less memory
+@app.route("/generate-invoice-excel", methods=["GET"])
+def generate_invoice_excel():
+    env = get_env()
+    data = workspace_store.load(env, workspace_store.INVOICE_SLOT)
+    if data is None:
+        return jsonify({"error": "No JSON data to generate invoice"}), 400
+
+    client_id = session.get("client_id")
+    user_id = session.get("user_id")
+
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        template_name, context = _prepare_excel_invoice_render(
+            cur, client_id, user_id, data, _parsed_upload(env)
         )
 
-        # --- Generate PDF directly to a stream ---
-        pdf_stream = BytesIO()
-        HTML(string=rendered_html).write_pdf(pdf_stream)
-        pdf_stream.seek(0)
+        # --- Render HTML invoice with the selected template ---
+        rendered_html = render_template(template_name, **context)
+        source_hash = invoice_pdf.html_content_hash(rendered_html)
+
+        # Look up the submitted invoice this upload belongs to
+        invoice_id = None
+        fbr_invoice = data.get("fbrInvoiceNumber")
+        if client_id and fbr_invoice:
+            cur.execute(
+                """
+                SELECT id FROM invoices
+                WHERE client_id = %s AND env = %s AND status = 'Success'
+                  AND invoice_data::jsonb->>'fbrInvoiceNumber' = %s
+                ORDER BY created_at DESC
+                LIMIT 1
+                """,
+                (client_id, env, fbr_invoice),
+            )
+            row = cur.fetchone()
+            invoice_id = row[0] if row else None
+
+        pdf_binary = None
+        if invoice_id is not None:
+            pdf_binary = invoice_pdf.load_cached_pdf(cur, invoice_id, source_hash)
+
+        if pdf_binary is None:
+            pdf_binary = pdf_renderer.render_pdf(rendered_html)
+            if invoice_id is not None:
+                try:
+                    invoice_pdf.store_invoice_pdf(cur, invoice_id, pdf_binary, source_hash)
+                    conn.commit()
+                except Exception as store_error:
+                    conn.rollback()
+                    logger.error("Error storing PDF for invoice %s: %s", invoice_id, store_error)
+        else:
+            logger.debug("Serving stored PDF for invoice %s", invoice_id)
 
         return send_file(
-            pdf_stream,
+            BytesIO(pdf_binary),
             mimetype="application/pdf",
             as_attachment=True,
             download_name="invoice.pdf",
         )
 
     except Exception as e:
-        print(f"Error generating PDF: {str(e)}")
-        import traceback
-
-        traceback.print_exc()
+        logger.exception("Error generating PDF: %s", e)
         return jsonify({"error": f"Failed to generate PDF: {str(e)}"}), 500
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
 
 
 @app.route("/")
@@ -1435,16 +1720,10 @@ def index():
 
 @app.route("/dashboard.html")
 def dashboard_html():
-    print("Dashboard access attempt")
-    print("Full session data:", dict(session))
-    print("User ID in session:", session.get("user_id"))
-    print("Request cookies:", dict(request.cookies))
-
     if "user_id" not in session:
-        print("No user_id in session, redirecting to login")
+        logger.info("No user_id in session, redirecting to login")
         return redirect(url_for("index"))
 
-    print("Access granted to dashboard")
     return render_template("dashboard.html")
 
 
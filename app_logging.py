@@ -0,0 +1,223 @@
+"""
+Leveled, structured logging for the app.
+
+Modules log through logging.getLogger(__name__) instead of print(). Records
+are formatted as one JSON object per line (LOG_FORMAT=text gives plain
+lines for local development) carrying the level, logger, message, any
+extra={...} fields and the id of the request that produced them. The id is
+taken from an incoming X-Request-ID header or generated, and is echoed in the
+response so a client report can be matched to the server's log lines.
+
+Handlers never write in the request thread: records go onto a bounded queue
+drained by a listener thread (restarted after fork, like the other per-process
+pools), and are dropped rather than blocking when the queue is full. Hot-path
+records can pass extra={"sample_rate": 0.05} to keep only that fraction; the
+per-request access log uses LOG_ACCESS_SAMPLE_RATE.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+
+from flask import g, has_app_context, request
+
+# Attributes every LogRecord has; anything else came in through extra={...}
+_STANDARD_ATTRS = frozenset(
+    vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None)).keys()
+) | {"message", "asctime", "request_id", "sample_rate"}
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp each record with the current request's id ("-" outside requests)."""
+
+    def filter(self, record):
+        request_id = None
+        if has_app_context():
+            request_id = g.get("request_id")
+        record.request_id = request_id or "-"
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep records logged with extra={"sample_rate": r} with probability r."""
+
+    def filter(self, record):
+        rate = getattr(record, "sample_rate", None)
+        if rate is None or rate >= 1:
+            return True
+        return random.random() < rate
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            "pid": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full,
+    and (re)starts its listener thread in the process that uses it."""
+
+    def __init__(self, log_queue, target):
+        super().__init__(log_queue)
+        self.target = target
+        self.dropped = 0
+
+        self._listener = None
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # Threads do not survive fork(), so each gunicorn worker starts its own
+        pid = os.getpid()
+        if self._listener is not None and self._listener_pid == pid:
+            return
+        with self._lock:
+            if self._listener is None or self._listener_pid != pid:
+                self._listener = logging.handlers.QueueListener(
+                    self.queue, self.target, respect_handler_level=True
+                )
+                self._listener.start()
+                self._listener_pid = pid
+
+    def prepare(self, record):
+        # Resolve the message and traceback now: args may change once the call returns
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None and self._listener_pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+
+
+_handler = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging():
+    """Route the root logger through the JSON (or text) queue handler. Idempotent."""
+    global _handler
+    with _setup_lock:
+        if _handler is not None:
+            return _handler
+
+        stream = logging.StreamHandler(sys.stdout)
+        if os.getenv("LOG_FORMAT", "json").lower() == "text":
+            stream.setFormatter(
+                logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s")
+            )
+        else:
+            stream.setFormatter(JSONFormatter())
+
+        handler = _DroppingQueueHandler(queue.Queue(_env_int("LOG_QUEUE_SIZE", 10000)), stream)
+        handler.addFilter(SamplingFilter())
+        handler.addFilter(RequestIdFilter())
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+        # Flush what is still queued when the process exits (e.g. after a CLI command)
+        atexit.register(handler.stop)
+        _handler = handler
+        return handler
+
+
+def init_app(app):
+    """Set up logging and give every request an id (X-Request-ID) and a sampled access log."""
+    setup_logging()
+    access_logger = logging.getLogger("access")
+    access_sample_rate = _env_float("LOG_ACCESS_SAMPLE_RATE", 0.1)
+
+    @app.before_request
+    def _assign_request_id():
+        incoming = request.headers.get("X-Request-ID", "")
+        # Client-supplied ids are accepted only when short and printable
+        if incoming and len(incoming) <= 64 and incoming.isprintable():
+            g.request_id = incoming
+        else:
+            g.request_id = uuid.uuid4().hex
+        g.request_started = time.monotonic()
+
+    @app.after_request
+    def _log_request(response):
+        request_id = g.get("request_id")
+        if request_id:
+            response.headers["X-Request-ID"] = request_id
+        started = g.get("request_started")
+        if started is not None:
+            access_logger.info(
+                "%s %s %s",
+                request.method,
+                request.path,
+                response.status_code,
+                extra={
+                    "method": request.method,
+                    "path": request.path,
+                    "endpoint": request.endpoint,
+                    "status": response.status_code,
+                    "duration_ms": round((time.monotonic() - started) * 1000, 1),
+                    # Errors are always kept
+                    "sample_rate": 1 if response.status_code >= 500 else access_sample_rate,
+                },
+            )
+        return response
+
+
+def stats():
+    if _handler is None:
+        return None
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped, "pid": os.getpid()}
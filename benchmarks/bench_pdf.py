@@ -0,0 +1,283 @@
+"""
+Benchmark the invoice templates: render time, PDF size and peak memory.
+
+Every templates/invoice_*.html is rendered with synthetic invoices of each
+--items size (by default 3, 40 and 600 line items) the way the app does it:
+render_template in a request context of the app, then pdf_renderer.render_pdf.
+The context is built like _prepare_form_invoice_render builds it (totals,
+amount in words, FBR QR code). No database is needed. The templates draw a
+client and an FBR logo; by default images from static/images stand in for
+them as file:// URLs (--client-logo / --fbr-logo take other files or URLs).
+file:// images are embedded as they are, while http(s) URLs go through the
+logo cache (resized to LOGO_CACHE_MAX_PX) as in the app.
+
+Each (template, size) runs in a fresh process with PDF_RENDER_PROCESSES=0, so
+WeasyPrint renders in that process and its peak RSS (ru_maxrss) belongs to
+that case alone. The first render is reported separately as "cold" (font
+discovery, stylesheet parsing); the statistics cover the --runs renders
+after it, which is what a warm render process in the app pays.
+
+    python benchmarks/bench_pdf.py --items 3,40,600 --runs 3
+
+Results go to a JSON file (--output; by default benchmarks/results/
+pdf-<commit>.json). --compare OLD.json and --fail-over PCT work as in
+bench_reports.py.
+"""
+import argparse
+import base64
+import datetime
+import glob
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_reports import compare, git_commit, percentile  # noqa: E402
+
+_DESCRIPTIONS = (
+    "ROUND BARS", "Deformed steel bars grade 60", "Copper winding wire 1.2mm",
+    "PVC pressure pipe 4 inch class B", "Cotton fabric 60x60 bleached",
+    "Ceramic floor tile 600x600 matt finish", "Ball bearing 6204 ZZ",
+)
+_UOMS = ("MT", "KG", "Meter", "Numbers, pieces, units", "Square Metre")
+
+DEFAULT_CLIENT_LOGO = os.path.join(ROOT, "static", "images", "taxlinkpro-favicon.svg")
+DEFAULT_FBR_LOGO = os.path.join(ROOT, "static", "images", "44420737_9019796.jpg")
+
+
+def logo_url(value):
+    """file:// URL for a local path; URLs are passed through."""
+    if not value or "://" in value:
+        return value or None
+    return "file://" + os.path.abspath(value)
+
+
+def templates():
+    return sorted(os.path.basename(p) for p in glob.glob(os.path.join(ROOT, "templates", "invoice_*.html")))
+
+
+def build_context(item_count, seed=42, client_logo=DEFAULT_CLIENT_LOGO, fbr_logo=DEFAULT_FBR_LOGO):
+    """Template context for a synthetic invoice with *item_count* line items."""
+    import qrcode
+    from num2words import num2words
+
+    rng = random.Random(seed)
+    items = []
+    for n in range(item_count):
+        quantity = rng.randint(1, 500)
+        unit_rate = round(rng.uniform(50, 25000), 2)
+        value = round(quantity * unit_rate, 2)
+        tax = round(value * 0.18, 2)
+        items.append(
+            {
+                "hsCode": f"{rng.randint(1000, 9999)}.{rng.randint(1000, 9999)}",
+                "hs_code": f"{rng.randint(1000, 9999)}.{rng.randint(1000, 9999)}",
+                "product_code": f"P-{n + 1:05d}",
+                "productDescription": f"{rng.choice(_DESCRIPTIONS)} #{n + 1}",
+                "rate": "18%",
+                "uoM": rng.choice(_UOMS),
+                "quantity": float(quantity),
+                "valueSalesExcludingST": value,
+                "salesTaxApplicable": tax,
+                "totalValues": round(value + tax, 2),
+                "unitrate": unit_rate,
+                "furtherTaxAmount": 0,
+                "saleType": "Goods at standard rate (default)",
+            }
+        )
+
+    total_excl = round(sum(i["valueSalesExcludingST"] for i in items), 2)
+    total_tax = round(sum(i["salesTaxApplicable"] for i in items), 2)
+    total = round(total_excl + total_tax, 2)
+    amount_in_words = num2words(total, to="currency", lang="en", currency="USD")
+    amount_in_words = amount_in_words.replace("dollars", "rupees").replace("cents", "paisa") + " only"
+
+    fbr_invoice = f"8255820DI{int(time.time() * 1000)}"
+    with BytesIO() as buffer:
+        qrcode.make(fbr_invoice).save(buffer)
+        qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+    data = {
+        "invoiceType": "Sale Invoice",
+        "invoiceDate": datetime.date.today().isoformat(),
+        "invoiceRefNo": "BENCH-0001",
+        "PO": "PO-7781",
+        "DC": "DC-1209",
+        "CNIC": "",
+        "sellerNTNCNIC": "8255820",
+        "sellerBusinessName": "Bench Steel Re-Rolling Mills",
+        "sellerProvince": "Punjab",
+        "sellerAddress": "Near Khokhar Village, Ring Road, Lahore",
+        "sellerSTRN": "32-77-8762-039-96",
+        "buyerNTNCNIC": "1280797",
+        "buyerBusinessName": "Bench Engineering Industries (Pvt) Ltd",
+        "buyerProvince": "Sindh",
+        "buyerAddress": "F/628, S.I.T.E., Karachi West",
+        "buyerSTRN": "12-00-9876-543-21",
+        "buyerRegistrationType": "Registered",
+        "fbrInvoiceNumber": fbr_invoice,
+        "items": items,
+        "totalExcl": total_excl,
+        "totalTax": total_tax,
+        "totalFurtherTax": 0,
+        "totalInclusive": total,
+        "showFurtherTax": False,
+        "amountInWords": amount_in_words,
+    }
+    return {
+        "data": data,
+        "qr_base64": qr_base64,
+        "client_logo_url": logo_url(client_logo),
+        "fbr_logo_url": logo_url(fbr_logo),
+        "username": None,
+    }
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_case(template_name, item_count, runs, client_logo=DEFAULT_CLIENT_LOGO, fbr_logo=DEFAULT_FBR_LOGO):
+    """Render one case in this process (called in the --worker subprocess)."""
+    os.environ["PDF_RENDER_PROCESSES"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import app as app_module  # noqa: E402
+    import pdf_renderer  # noqa: E402
+    from flask import render_template  # noqa: E402
+
+    context = build_context(item_count, client_logo=client_logo, fbr_logo=fbr_logo)
+    baseline_rss = _peak_rss_mb()
+    template_ms = []
+    pdf_ms = []
+    cold_ms = None
+    html_bytes = pdf_bytes = 0
+    with app_module.app.test_request_context():
+        for attempt in range(runs + 1):
+            started = time.perf_counter()
+            html = render_template(template_name, **context)
+            rendered = time.perf_counter()
+            pdf = pdf_renderer.render_pdf(html)
+            finished = time.perf_counter()
+            if attempt == 0:
+                cold_ms = (finished - started) * 1000
+                continue
+            template_ms.append((rendered - started) * 1000)
+            pdf_ms.append((finished - rendered) * 1000)
+            html_bytes, pdf_bytes = len(html.encode("utf-8")), len(pdf)
+
+    totals = [t + p for t, p in zip(template_ms, pdf_ms)]
+    peak_rss = _peak_rss_mb()
+    return {
+        "items": item_count,
+        "runs": runs,
+        "cold_ms": round(cold_ms, 1),
+        "median_ms": round(statistics.median(totals), 1),
+        "p95_ms": round(percentile(totals, 95), 1),
+        "min_ms": round(min(totals), 1),
+        "template_ms": round(statistics.median(template_ms), 1),
+        "pdf_ms": round(statistics.median(pdf_ms), 1),
+        "html_bytes": html_bytes,
+        "pdf_bytes": pdf_bytes,
+        "peak_rss_mb": peak_rss,
+        "render_rss_mb": round(peak_rss - baseline_rss, 1),
+    }
+
+
+def _run_worker(template_name, item_count, runs, timeout, client_logo, fbr_logo):
+    completed = subprocess.run(
+        [
+            sys.executable, os.path.abspath(__file__), "--worker", template_name, str(item_count), str(runs),
+            "--client-logo", client_logo, "--fbr-logo", fbr_logo,
+        ],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        timeout=timeout,
+    )
+    if completed.returncode != 0:
+        return {"items": item_count, "error": completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--items",
+        type=lambda v: [int(s) for s in v.split(",") if s],
+        default=[3, 40, 600],
+        help="comma-separated line item counts, one case each",
+    )
+    parser.add_argument("--runs", type=int, default=3, help="warm renders per case (after the cold one)")
+    parser.add_argument("--templates", type=lambda v: [t for t in v.split(",") if t],
+                        help="comma-separated template files (default: templates/invoice_*.html)")
+    parser.add_argument("--timeout", type=float, default=900, help="seconds allowed per case")
+    parser.add_argument("--client-logo", default=DEFAULT_CLIENT_LOGO, help="client logo file or URL (\"\" for none)")
+    parser.add_argument("--fbr-logo", default=DEFAULT_FBR_LOGO, help="FBR logo file or URL (\"\" for none)")
+    parser.add_argument("--output", help="results file (default benchmarks/results/pdf-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--fail-over", type=float, help="exit 1 if a median regressed by more than this %%")
+    parser.add_argument("--worker", nargs=3, metavar=("TEMPLATE", "ITEMS", "RUNS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        template_name, item_count, runs = args.worker
+        print(json.dumps(run_case(template_name, int(item_count), int(runs), args.client_logo, args.fbr_logo)))
+        return
+
+    commit = git_commit()
+    results = {
+        "benchmark": "pdf",
+        "commit": commit,
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "parameters": {
+            "items": args.items,
+            "runs": args.runs,
+            "client_logo": logo_url(args.client_logo),
+            "fbr_logo": logo_url(args.fbr_logo),
+        },
+        "sizes": {},
+    }
+    for item_count in args.items:
+        size_results = {}
+        for template_name in args.templates or templates():
+            result = _run_worker(
+                template_name, item_count, args.runs, args.timeout, args.client_logo, args.fbr_logo
+            )
+            name = os.path.splitext(template_name)[0]
+            size_results[name] = result
+            if "error" in result:
+                print(f"[{item_count:>4} items] {name:<20} failed: {' '.join(result['error'])}")
+                continue
+            print(
+                f"[{item_count:>4} items] {name:<20} median {result['median_ms']:>8.1f} ms"
+                f" (jinja {result['template_ms']:>6.1f}, pdf {result['pdf_ms']:>8.1f})"
+                f"  cold {result['cold_ms']:>8.1f} ms  {result['pdf_bytes'] / 1024:>7.1f} KiB"
+                f"  peak RSS {result['peak_rss_mb']:>6.1f} MiB (+{result['render_rss_mb']})"
+            )
+        results["sizes"][str(item_count)] = size_results
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"pdf-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        if compare(results, previous, args.fail_over):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Benchmark the report endpoints and /records at several data sizes.
+
+For every --sizes entry (invoices per client) the benchmark clients are
+reseeded (seed_data.py), then each endpoint below is requested through the
+Flask test client as the first benchmark client: --warmup untimed calls, then
+--runs timed ones. The report cache is disabled (REPORT_CACHE_SIZE=0) unless
+--with-cache is given, so the numbers are the SQL and Python cost. DB time and
+query counts come from the Server-Timing header.
+
+    DB_NAME=erp_bench python benchmarks/bench_reports.py --sizes 1000,10000,50000
+
+Results go to a JSON file (--output; by default benchmarks/results/
+reports-<commit>.json) with the commit, parameters and per-size, per-endpoint
+timings. --compare OLD.json prints the change against an earlier run and,
+with --fail-over PCT, exits non-zero when any median got that much slower.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import seed_data  # noqa: E402
+
+_SERVER_TIMING = re.compile(r'(\w+);dur=([0-9.]+)(?:;desc="[^"]*?x(\d+)")?')
+
+
+def sample_filters(client_id):
+    """User id, invoice ids and the most common buyer / product of *client_id*."""
+    conn = seed_data.db_pool.get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT user_id FROM clients WHERE id = %s", (client_id,))
+        user_id = cur.fetchone()[0]
+        cur.execute(
+            """
+            SELECT id FROM invoices
+            WHERE client_id = %s AND env = 'production' AND status = 'Success'
+            ORDER BY created_at DESC
+            LIMIT 50
+            """,
+            (client_id,),
+        )
+        invoice_ids = [str(row[0]) for row in cur.fetchall()]
+        cur.execute(
+            """
+            SELECT buyer_name FROM invoice_items
+            WHERE client_id = %s AND env = 'production' AND buyer_name IS NOT NULL
+            GROUP BY buyer_name ORDER BY COUNT(*) DESC LIMIT 1
+            """,
+            (client_id,),
+        )
+        row = cur.fetchone()
+        buyer = row[0] if row else ""
+        cur.execute(
+            """
+            SELECT product_description FROM invoice_items
+            WHERE client_id = %s AND env = 'production' AND product_description IS NOT NULL
+            GROUP BY product_description ORDER BY COUNT(*) DESC LIMIT 1
+            """,
+            (client_id,),
+        )
+        row = cur.fetchone()
+        product = row[0] if row else ""
+    finally:
+        cur.close()
+        conn.close()
+    return {"user_id": user_id, "invoice_ids": invoice_ids, "buyer": buyer, "product": product}
+
+
+def endpoints(today, sample):
+    """(name, method, path, query args / JSON body) of every benchmarked request."""
+    month_start = today.replace(day=1)
+    last_month_end = month_start - datetime.timedelta(days=1)
+    last_month = {"start_date": str(last_month_end.replace(day=1)), "end_date": str(last_month_end)}
+    last_year = {"start_date": str(today - datetime.timedelta(days=365)), "end_date": str(today)}
+    invoice_ids = sample["invoice_ids"]
+    first_id = invoice_ids[0] if invoice_ids else "0"
+    return [
+        ("dashboard_all", "GET", "/api/reports/dashboard", {"period": "all"}),
+        ("dashboard_month", "GET", "/api/reports/dashboard", {"period": "month"}),
+        ("dashboard_year", "GET", "/api/reports/dashboard", {"period": "year"}),
+        ("dashboard_custom", "GET", "/api/reports/dashboard", {"period": "custom", **last_month}),
+        ("invoices_page1", "GET", "/api/reports/invoices", {"page": 1, "per_page": 20}),
+        ("invoices_page50", "GET", "/api/reports/invoices", {"page": 50, "per_page": 20}),
+        ("invoices_approx_count", "GET", "/api/reports/invoices", {"page": 1, "per_page": 20, "count": "approx"}),
+        ("invoices_cursor", "GET", "/api/reports/invoices", {"cursor": "", "per_page": 20}),
+        ("invoices_buyer", "GET", "/api/reports/invoices", {"buyer_name": sample["buyer"], "per_page": 20}),
+        ("invoices_product", "GET", "/api/reports/invoices", {"product_name": sample["product"], "per_page": 20}),
+        ("invoices_sort_amount", "GET", "/api/reports/invoices", {"sort_field": "total_amount", "per_page": 20}),
+        ("invoice_detail", "GET", f"/api/reports/invoice/{first_id}", {}),
+        ("product_analytics", "GET", "/api/reports/product-analytics", {}),
+        ("product_analytics_year", "GET", "/api/reports/product-analytics", last_year),
+        ("product_analytics_month", "GET", "/api/reports/product-analytics", last_month),
+        ("buyer_analytics", "GET", "/api/reports/buyer-analytics", {}),
+        ("buyer_analytics_month", "GET", "/api/reports/buyer-analytics", last_month),
+        ("downloadable_invoices", "GET", "/api/reports/downloadable-invoices", {"env": "production"}),
+        ("summarize_50", "POST", "/api/reports/summarize", {"invoice_ids": invoice_ids, "env": "production"}),
+        ("records_legacy", "GET", "/records", {"env": "production"}),
+        ("records_page", "GET", "/records", {"env": "production", "limit": 50}),
+        ("records_page_exact", "GET", "/records", {"env": "production", "limit": 50, "count": "exact"}),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _server_timing(header):
+    phases = {}
+    for name, duration, count in _SERVER_TIMING.findall(header or ""):
+        phases[f"{name}_ms"] = float(duration)
+        if count:
+            phases[f"{name}_count"] = int(count)
+    return phases
+
+
+def time_endpoint(client, method, path, args, runs, warmup):
+    timings = []
+    response = None
+    for attempt in range(warmup + runs):
+        started = time.perf_counter()
+        if method == "POST":
+            response = client.post(path, json=args)
+        else:
+            response = client.get(path, query_string=args)
+        elapsed = (time.perf_counter() - started) * 1000
+        if attempt >= warmup:
+            timings.append(elapsed)
+
+    result = {
+        "status": response.status_code,
+        "bytes": len(response.get_data()),
+        "runs": runs,
+        "mean_ms": round(statistics.mean(timings), 2),
+        "median_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(percentile(timings, 95), 2),
+        "min_ms": round(min(timings), 2),
+        "max_ms": round(max(timings), 2),
+    }
+    # Phases of the last run (db time / query count, template time)
+    result.update(_server_timing(response.headers.get("Server-Timing")))
+    return result
+
+
+def run(args):
+    if not args.with_cache:
+        os.environ["REPORT_CACHE_SIZE"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("SLOW_REQUEST_MS", "0")
+    os.environ["SERVER_TIMING_HEADER"] = "true"
+
+    import app as app_module  # noqa: E402  (reads the environment at import)
+
+    flask_app = app_module.app
+    today = datetime.date.today()
+    results = {
+        "benchmark": "reports",
+        "commit": git_commit(),
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parameters": {
+            "sizes": args.sizes,
+            "clients": args.clients,
+            "items": args.items,
+            "nested_ratio": args.nested_ratio,
+            "days": args.days,
+            "runs": args.runs,
+            "warmup": args.warmup,
+            "with_cache": args.with_cache,
+            "seed": args.seed,
+        },
+        "sizes": {},
+    }
+
+    for size in args.sizes:
+        if args.skip_seed:
+            conn = seed_data.db_pool.get_connection()
+            client_ids = seed_data.ensure_clients(conn, args.clients)
+            conn.close()
+        else:
+            client_ids = seed_data.seed(
+                clients=args.clients,
+                invoices_per_client=size,
+                items_per_invoice=args.items,
+                nested_ratio=args.nested_ratio,
+                days=args.days,
+                products_per_client=args.products,
+                buyers_per_client=args.buyers,
+                random_seed=args.seed,
+            )
+
+        sample = sample_filters(client_ids[0])
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = sample["user_id"]
+            sess["client_id"] = client_ids[0]
+
+        size_results = {}
+        for name, method, path, query in endpoints(today, sample):
+            if args.only and name not in args.only:
+                continue
+            size_results[name] = time_endpoint(client, method, path, query, args.runs, args.warmup)
+            timing = size_results[name]
+            print(
+                f"[{size:>7} invoices/client] {name:<26} median {timing['median_ms']:>9.1f} ms"
+                f"  p95 {timing['p95_ms']:>9.1f} ms  db {timing.get('db_ms', 0):>8.1f} ms"
+                f" / {timing.get('db_count', 0):>3} queries  HTTP {timing['status']}"
+            )
+        results["sizes"][str(size)] = size_results
+    return results
+
+
+def compare(results, previous, fail_over):
+    """Print median changes against *previous*; returns the number of regressions over *fail_over*%."""
+    regressions = 0
+    print(f"\nCompared with {previous.get('commit')} ({previous.get('started_at')}):")
+    for size, size_results in results["sizes"].items():
+        old_size = previous.get("sizes", {}).get(size, {})
+        for name, timing in size_results.items():
+            old = old_size.get(name)
+            if not old or not old.get("median_ms") or "median_ms" not in timing:
+                continue
+            change = (timing["median_ms"] - old["median_ms"]) / old["median_ms"] * 100
+            flag = ""
+            if fail_over is not None and change > fail_over:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(
+                f"[{size:>7}] {name:<26} {old['median_ms']:>9.1f} -> {timing['median_ms']:>9.1f} ms"
+                f" ({change:+6.1f}%){flag}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--sizes",
+        type=lambda v: [int(s) for s in v.split(",") if s],
+        default=[1000, 10000],
+        help="comma-separated invoices per client, one benchmark round each",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="timed requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed requests per endpoint first")
+    parser.add_argument("--only", type=lambda v: set(v.split(",")), help="comma-separated endpoint names")
+    parser.add_argument("--with-cache", action="store_true", help="keep the report cache enabled")
+    parser.add_argument("--skip-seed", action="store_true", help="benchmark the data already seeded")
+    parser.add_argument("--output", help="results file (default benchmarks/results/reports-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--fail-over", type=float, help="exit 1 if a median regressed by more than this %%")
+    seed_data.add_seed_arguments(parser)
+    args = parser.parse_args()
+
+    results = run(args)
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"reports-{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        if compare(results, previous, args.fail_over):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
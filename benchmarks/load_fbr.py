@@ -0,0 +1,396 @@
+"""
+Load test for the submission flows, against the mock FBR API.
+
+Runs --users virtual users against a running app (gunicorn or flask run, at
+--app-url), each logged in as one of the bench_* clients with its own session
+and so its own workspace. Together they push --submissions invoices through
+the full app, picked at random with --excel-ratio:
+
+    excel  POST /upload-excel (a freshly generated workbook), GET /get-json,
+           POST /submit-fbr
+    form   POST /api/invoice/create, POST /submit-fbr
+
+Everything runs in the sandbox env. With --configure (the default) the
+bench clients are created when missing and their sandbox API URL is pointed
+at the mock (mock_fbr.py, at --mock-url), so start that first:
+
+    python benchmarks/mock_fbr.py --latency-ms 400 --jitter-ms 300 --error-rate 0.01 &
+    python benchmarks/load_fbr.py --users 20 --submissions 1000
+
+Reports throughput and p50/p95/p99 latency per flow, for the whole flow and
+for the /submit-fbr step alone, and the outcome counts (Success; Failed for
+FBR rejections and 5xx answers, which the app reports alike; timeout,
+connection_error, error). Results, with the mock's own counts, are written
+as JSON (--output; by default benchmarks/results/
+load-fbr-<commit>.json).
+"""
+import argparse
+import datetime
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+from openpyxl import Workbook
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import seed_data  # noqa: E402
+from bench_reports import git_commit, percentile  # noqa: E402
+
+ENV = "sandbox"
+BENCH_PASSWORD = "bench"
+FBR_PATH = "/di_data/v1/di/postinvoicedata_sb"
+
+PRODUCT_COLUMNS = (
+    "productDescription", "hsCode", "quantity", "rate", "valueSalesExcludingST", "STrate",
+    "salesTaxApplicable", "totalValues", "uoM", "fixedNotifiedValueOrRetailPrice",
+    "salesTaxWithheldAtSource", "extraTax", "furtherTax", "sroScheduleNo", "fedPayable",
+    "discount", "saleType", "sroItemSerialNo",
+)
+_PRODUCTS = (
+    ("ROUND BARS", "7214.9990", "MT"),
+    ("STEEL PIPE", "7306.3090", "KG"),
+    ("COPPER WIRE", "7408.1990", "KG"),
+    ("PVC SHEET", "3920.4900", "Numbers, pieces, units"),
+    ("COTTON FABRIC", "5208.1100", "Meter"),
+)
+
+
+def configure_clients(count, mock_url):
+    """Create bench_1..bench_<count> if needed and point their sandbox API at the mock."""
+    conn = seed_data.db_pool.get_connection()
+    try:
+        seed_data.ensure_schema(conn)
+        client_ids = seed_data.ensure_clients(conn, count)
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE clients SET sandbox_api_url = %s, sandbox_api_token = %s WHERE id IN %s",
+            (mock_url.rstrip("/") + FBR_PATH, BENCH_PASSWORD, tuple(client_ids)),
+        )
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return client_ids
+
+
+def _line_items(rng):
+    items = []
+    for description, hs_code, uom in rng.sample(_PRODUCTS, rng.randint(1, 3)):
+        quantity = rng.randint(1, 50)
+        unit_rate = rng.randint(100, 5000)
+        value = round(quantity * unit_rate, 2)
+        tax = round(value * 0.18, 2)
+        items.append(
+            {
+                "productDescription": description,
+                "hsCode": hs_code,
+                "quantity": quantity,
+                "rate": unit_rate,
+                "valueSalesExcludingST": value,
+                "salesTaxApplicable": tax,
+                "totalValues": round(value + tax, 2),
+                "uoM": uom,
+            }
+        )
+    return items
+
+
+def build_workbook(rng, ref):
+    """An invoice workbook laid out like the upload template (header fields, then products)."""
+    workbook = Workbook()
+    sheet = workbook.active
+    rows = [
+        ("Seller Information",),
+        ("sellerBusinessName", "Bench Steel Mills"),
+        ("sellerAddress", "Ring Road, Lahore"),
+        ("sellerProvince", "Punjab"),
+        ("sellerNTNCNIC", "8255820"),
+        (),
+        ("Invoice Information",),
+        ("scenarioId", "SN001"),
+        ("invoiceType", "Sale Invoice"),
+        ("invoiceDate", datetime.date.today().isoformat()),
+        ("invoiceRefNo", ref),
+        ("Buyer Information",),
+        ("buyerBusinessName", "Bench Engineering Industries"),
+        ("buyerAddress", "SITE, Karachi"),
+        ("buyerProvince", "Sindh"),
+        ("buyerNTNCNIC", "1280797"),
+        ("buyerRegistrationType", "Registered"),
+        (),
+        ("Products",),
+        PRODUCT_COLUMNS,
+    ]
+    for item in _line_items(rng):
+        rows.append(
+            tuple(
+                {
+                    **item,
+                    "STrate": "18%",
+                    "fixedNotifiedValueOrRetailPrice": 0,
+                    "salesTaxWithheldAtSource": 0,
+                    "furtherTax": 0,
+                    "fedPayable": 0,
+                    "discount": 0,
+                    "saleType": "Goods at standard rate (default)",
+                }.get(column)
+                for column in PRODUCT_COLUMNS
+            )
+        )
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def build_form_invoice(rng, ref):
+    return {
+        "invoiceType": "Sale Invoice",
+        "invoiceDate": datetime.date.today().isoformat(),
+        "invoiceRefNo": ref,
+        "scenarioId": "SN001",
+        "sellerData": {
+            "sellerBusinessName": "Bench Steel Mills",
+            "sellerAddress": "Ring Road, Lahore",
+            "sellerProvince": "Punjab",
+            "sellerNTNCNIC": "8255820",
+        },
+        "buyerData": {
+            "buyerBusinessName": "Bench Engineering Industries",
+            "buyerAddress": "SITE, Karachi",
+            "buyerProvince": "Sindh",
+            "buyerNTNCNIC": "1280797",
+            "buyerRegistrationType": "Registered",
+        },
+        "items": [
+            {
+                "productDescription": item["productDescription"],
+                "hsCode": item["hsCode"],
+                "quantity": item["quantity"],
+                "uoM": item["uoM"],
+                "valueSalesExcludingST": item["valueSalesExcludingST"],
+                "salesTaxApplicable": item["salesTaxApplicable"],
+                "taxRate": "18%",
+                "saleType": "Goods at standard rate (default)",
+            }
+            for item in _line_items(rng)
+        ],
+    }
+
+
+def _submit_outcome(response):
+    if response.status_code == 200:
+        return "Success"
+    if response.status_code == 400:
+        try:
+            if response.json().get("status") == "Failed":
+                return "Failed"
+        except ValueError:
+            pass
+    return {504: "timeout", 503: "connection_error"}.get(response.status_code, "error")
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, number, app_url, jobs, excel_ratio, timeout, results, seed):
+        super().__init__(name=f"vu-{number}", daemon=True)
+        self.number = number
+        self.app_url = app_url.rstrip("/")
+        self.jobs = jobs
+        self.excel_ratio = excel_ratio
+        self.timeout = timeout
+        self.results = results
+
+        self.rng = random.Random(seed)
+        self.http = requests.Session()
+
+    def login(self, username):
+        response = self.http.post(
+            f"{self.app_url}/login",
+            data={"username": username, "password": BENCH_PASSWORD, "environment": ENV},
+            allow_redirects=False,
+            timeout=self.timeout,
+        )
+        if response.status_code != 302 or "erp_session" not in self.http.cookies:
+            raise RuntimeError(f"Login as {username} failed (HTTP {response.status_code})")
+
+    def _call(self, method, path, **kwargs):
+        return self.http.request(
+            method, f"{self.app_url}{path}", params={"env": ENV}, timeout=self.timeout, **kwargs
+        )
+
+    def run(self):
+        for job in self.jobs:
+            flow = "excel" if self.rng.random() < self.excel_ratio else "form"
+            ref = f"LOAD-{self.number}-{job}"
+            started = time.perf_counter()
+            outcome = None
+            submit_seconds = None
+            try:
+                if flow == "excel":
+                    content = build_workbook(self.rng, ref)
+                    response = self._call("POST", "/upload-excel", files={"file": (f"{ref}.xlsx", content)})
+                    if response.status_code == 200:
+                        response = self._call("GET", "/get-json")
+                else:
+                    response = self._call("POST", "/api/invoice/create", json=build_form_invoice(self.rng, ref))
+                if response.status_code != 200:
+                    outcome = f"prepare_http_{response.status_code}"
+                else:
+                    submit_started = time.perf_counter()
+                    response = self._call("POST", "/submit-fbr", json={})
+                    submit_seconds = time.perf_counter() - submit_started
+                    outcome = _submit_outcome(response)
+            except requests.RequestException as e:
+                outcome = f"client_{type(e).__name__}"
+            self.results.append(
+                {
+                    "flow": flow,
+                    "outcome": outcome,
+                    "seconds": time.perf_counter() - started,
+                    "submit_seconds": submit_seconds,
+                }
+            )
+
+
+def _latency_summary(seconds):
+    if not seconds:
+        return None
+    ms = [s * 1000 for s in seconds]
+    return {
+        "count": len(ms),
+        "p50_ms": round(percentile(ms, 50), 1),
+        "p95_ms": round(percentile(ms, 95), 1),
+        "p99_ms": round(percentile(ms, 99), 1),
+        "max_ms": round(max(ms), 1),
+    }
+
+
+def summarize(results, elapsed):
+    summary = {
+        "completed": len(results),
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_per_second": round(len(results) / elapsed, 2) if elapsed else None,
+        "outcomes": {},
+        "flows": {},
+    }
+    for result in results:
+        summary["outcomes"][result["outcome"]] = summary["outcomes"].get(result["outcome"], 0) + 1
+    for flow in ("excel", "form", "all"):
+        selected = [r for r in results if flow == "all" or r["flow"] == flow]
+        if not selected:
+            continue
+        successes = [r for r in selected if r["outcome"] == "Success"]
+        summary["flows"][flow] = {
+            "submissions": len(selected),
+            "succeeded": len(successes),
+            "success_per_second": round(len(successes) / elapsed, 2) if elapsed else None,
+            "flow": _latency_summary([r["seconds"] for r in selected]),
+            "submit_fbr": _latency_summary(
+                [r["submit_seconds"] for r in selected if r["submit_seconds"] is not None]
+            ),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--mock-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--clients", type=int, default=5, help="bench clients the users are spread over")
+    parser.add_argument("--submissions", type=int, default=200, help="total invoices to submit")
+    parser.add_argument("--excel-ratio", type=float, default=0.5, help="share of Excel (vs form) submissions")
+    parser.add_argument("--timeout", type=float, default=240, help="HTTP timeout per app request, seconds")
+    parser.add_argument("--no-configure", dest="configure", action="store_false",
+                        help="do not create/repoint the bench clients (the DB is not touched)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument("--output", help="results file (default benchmarks/results/load-fbr-<commit>.json)")
+    args = parser.parse_args()
+
+    if args.configure:
+        configure_clients(args.clients, args.mock_url)
+    try:
+        requests.post(f"{args.mock_url}/_mock/reset", timeout=5)
+    except requests.RequestException:
+        print(f"Mock FBR API not reachable at {args.mock_url}; start benchmarks/mock_fbr.py first")
+        sys.exit(1)
+
+    # Jobs are handed out from one shared iterator so fast users take more of them
+    counter = itertools.count(1)
+    lock = threading.Lock()
+
+    def jobs():
+        while True:
+            with lock:
+                job = next(counter)
+            if job > args.submissions:
+                return
+            yield job
+
+    results = []
+    users = []
+    for number in range(1, args.users + 1):
+        user = VirtualUser(number, args.app_url, jobs(), args.excel_ratio, args.timeout, results, args.seed + number)
+        user.login(f"{seed_data.BENCH_USER_PREFIX}{(number - 1) % args.clients + 1}")
+        users.append(user)
+
+    started = time.perf_counter()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.perf_counter() - started
+
+    summary = summarize(results, elapsed)
+    mock_stats = requests.get(f"{args.mock_url}/_mock/stats", timeout=5).json()
+
+    print(
+        f"{summary['completed']} submissions by {args.users} users in {summary['elapsed_seconds']}s: "
+        f"{summary['throughput_per_second']}/s"
+    )
+    print("Outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(summary["outcomes"].items())))
+    for flow, stats in summary["flows"].items():
+        for step in ("flow", "submit_fbr"):
+            latency = stats[step]
+            if latency:
+                print(
+                    f"  {flow:<6} {step:<11} p50 {latency['p50_ms']:>8.1f} ms  p95 {latency['p95_ms']:>8.1f} ms"
+                    f"  p99 {latency['p99_ms']:>8.1f} ms  (n={latency['count']})"
+                )
+
+    commit = git_commit()
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"load-fbr-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "benchmark": "load-fbr",
+                "commit": commit,
+                "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "parameters": {
+                    "users": args.users,
+                    "clients": args.clients,
+                    "submissions": args.submissions,
+                    "excel_ratio": args.excel_ratio,
+                    "seed": args.seed,
+                },
+                "summary": summary,
+                "mock": mock_stats,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Local stand-in for the FBR Digital Invoicing API, for load tests.
+
+Accepts invoice POSTs on the FBR paths (/di_data/v1/di/postinvoicedata and
+postinvoicedata_sb; any other path works too) and answers in FBR's formats:
+an invoiceNumber plus a "Valid" validationResponse with one invoiceStatuses
+entry per item, or no invoiceNumber and an "Invalid" validationResponse
+whose errorCode/error sit at the invoice level (bad header fields) or on the
+offending item. Payloads are checked the way FBR rejects them most often
+(NTN/CNIC length, date format, HS code, rate, missing items). The error
+codes are representative, not FBR's full catalogue.
+
+Faults are injected at random, per request:
+
+    --latency-ms / --jitter-ms   response delay (mean, uniform +/- jitter)
+    --invalid-rate               share of otherwise valid invoices rejected
+    --error-rate                 share answered 500/502/503/504 with an HTML body
+    --timeout-rate               share held for --timeout-seconds (past the app's
+                                 180 s client timeout by default) before answering
+
+    python benchmarks/mock_fbr.py --port 8001 --latency-ms 400 --jitter-ms 300 --error-rate 0.02
+
+Settings can be changed while it runs with POST /_mock/config (a JSON object
+of the names above, underscored), and overridden per client by adding them to
+the API URL stored for it, e.g. .../postinvoicedata_sb?error_rate=0.5.
+GET /_mock/stats returns the counts per outcome, POST /_mock/reset zeroes them.
+With --token, requests without that bearer token get FBR's bare 401.
+"""
+import argparse
+import datetime
+import logging
+import random
+import re
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request
+
+_TAX_ID = re.compile(r"^(\w{7}|\d{13})$")
+_HS_CODE = re.compile(r"^\d{4}\.\d{4}$")
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# Rejections drawn for --invalid-rate: (errorCode, error, item level)
+_RANDOM_REJECTIONS = (
+    ("0052", "Provide proper HS Code with invoice no. {ref}", True),
+    ("0046", "Provide rate in accordance with the selected sale type.", True),
+    ("0002", "Buyer Registration No. is not registered with FBR.", False),
+    ("0113", "Invoice date is not in the current or previous tax period.", False),
+)
+
+CONFIG_TYPES = {
+    "latency_ms": float,
+    "jitter_ms": float,
+    "invalid_rate": float,
+    "error_rate": float,
+    "timeout_rate": float,
+    "timeout_seconds": float,
+}
+
+
+class MockFBR:
+    def __init__(self, token=None, seed=None, **config):
+        self.token = token
+        self.config = {
+            "latency_ms": 200.0,
+            "jitter_ms": 100.0,
+            "invalid_rate": 0.0,
+            "error_rate": 0.0,
+            "timeout_rate": 0.0,
+            "timeout_seconds": 200.0,
+        }
+        self.config.update({k: v for k, v in config.items() if v is not None})
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._last_number = 0
+        self._stats = {}
+
+    def update_config(self, values):
+        for name, value in values.items():
+            if name not in CONFIG_TYPES:
+                raise ValueError(f"Unknown setting: {name}")
+            self.config[name] = CONFIG_TYPES[name](value)
+
+    def _settings(self, overrides):
+        settings = dict(self.config)
+        for name, value in overrides.items():
+            if name in CONFIG_TYPES:
+                settings[name] = CONFIG_TYPES[name](value)
+        return settings
+
+    def _random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _count(self, outcome, seconds):
+        with self._lock:
+            entry = self._stats.setdefault(outcome, {"count": 0, "total_seconds": 0.0})
+            entry["count"] += 1
+            entry["total_seconds"] += seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                "config": dict(self.config),
+                "outcomes": {
+                    outcome: {
+                        "count": entry["count"],
+                        "avg_seconds": round(entry["total_seconds"] / entry["count"], 3),
+                    }
+                    for outcome, entry in self._stats.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def _invoice_number(self, seller_ntn):
+        # FBR numbers are <seller NTN>DI<epoch ms>; keep them unique under load
+        with self._lock:
+            number = max(int(time.time() * 1000), self._last_number + 1)
+            self._last_number = number
+        return f"{seller_ntn}DI{number}"
+
+    def handle(self, payload, authorization, overrides):
+        """(HTTP status, JSON body or text, outcome) for one invoice POST."""
+        started = time.monotonic()
+        settings = self._settings(overrides)
+
+        if self.token and authorization != f"Bearer {self.token}":
+            self._count("unauthorized", 0.0)
+            return 401, "", "unauthorized"
+
+        delay = settings["latency_ms"] + (self._random() * 2 - 1) * settings["jitter_ms"]
+        time.sleep(max(delay, 0.0) / 1000)
+
+        draw = self._random()
+        if draw < settings["timeout_rate"]:
+            time.sleep(settings["timeout_seconds"])
+            outcome, status, body = "timeout", 504, _gateway_page(504, "Gateway Time-out")
+        elif draw < settings["timeout_rate"] + settings["error_rate"]:
+            code = (500, 502, 503, 504)[int(self._random() * 4)]
+            outcome, status, body = "server_error", code, _gateway_page(code, "Server Error")
+        else:
+            body = validate_invoice(payload)
+            if body is None and self._random() < settings["invalid_rate"]:
+                body = _random_rejection(payload, self._random())
+            if body is None:
+                outcome, status, body = "valid", 200, self._accept(payload)
+            else:
+                outcome, status = "invalid", 200
+        self._count(outcome, time.monotonic() - started)
+        return status, body, outcome
+
+    def _accept(self, payload):
+        invoice_number = self._invoice_number(str(payload.get("sellerNTNCNIC", "")))
+        return {
+            "invoiceNumber": invoice_number,
+            "dated": _now(),
+            "validationResponse": {
+                "statusCode": "00",
+                "status": "Valid",
+                "error": "",
+                "invoiceStatuses": [
+                    {
+                        "itemSNo": str(n),
+                        "statusCode": "00",
+                        "status": "Valid",
+                        "invoiceNo": f"{invoice_number}-{n}",
+                        "errorCode": "",
+                        "error": "",
+                    }
+                    for n in range(1, len(payload.get("items") or []) + 1)
+                ],
+            },
+        }
+
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _gateway_page(status, title):
+    return f"<html><head><title>{status} {title}</title></head><body><h1>{title}</h1></body></html>"
+
+
+def _rejected(error_code, error, item_index=None, item_count=0):
+    """FBR's "Invalid" response; item-level errors list every item's status."""
+    statuses = None
+    if item_index is not None:
+        statuses = [
+            {
+                "itemSNo": str(n),
+                "statusCode": "01" if n == item_index else "00",
+                "status": "Invalid" if n == item_index else "Valid",
+                "invoiceNo": None,
+                "errorCode": error_code if n == item_index else "",
+                "error": error if n == item_index else "",
+            }
+            for n in range(1, item_count + 1)
+        ]
+        error_code, error = "", ""
+    return {
+        "dated": _now(),
+        "validationResponse": {
+            "statusCode": "01",
+            "status": "Invalid",
+            "errorCode": error_code,
+            "error": error,
+            "invoiceStatuses": statuses,
+        },
+    }
+
+
+def validate_invoice(payload):
+    """The rejection FBR would send for *payload*, or None when it passes."""
+    if not isinstance(payload, dict):
+        return _rejected("0000", "Invalid JSON payload.")
+    if not _TAX_ID.match(str(payload.get("sellerNTNCNIC", ""))):
+        return _rejected("0401", "Seller NTN/CNIC is invalid. It must be 7 or 13 digits.")
+    buyer_registered = str(payload.get("buyerRegistrationType", "")).lower() == "registered"
+    if buyer_registered and not _TAX_ID.match(str(payload.get("buyerNTNCNIC", ""))):
+        return _rejected("0002", "Provide valid Buyer Registration No. It must be 7 or 13 digits.")
+    if not _DATE.match(str(payload.get("invoiceDate", ""))):
+        return _rejected("0113", "Invoice date is not in proper format. Format should be YYYY-MM-DD.")
+    if not payload.get("invoiceType"):
+        return _rejected("0011", "Provide invoice type.")
+
+    items = payload.get("items") or []
+    if not items:
+        return _rejected("0021", "Provide at least one item in the invoice.")
+    for n, item in enumerate(items, start=1):
+        if not _HS_CODE.match(str(item.get("hsCode", ""))):
+            ref = payload.get("invoiceRefNo") or "null"
+            return _rejected("0052", f"Provide proper HS Code with invoice no. {ref}", n, len(items))
+        if not str(item.get("rate", "")).strip():
+            return _rejected("0046", "Provide rate.", n, len(items))
+    return None
+
+
+def _random_rejection(payload, draw):
+    code, error, item_level = _RANDOM_REJECTIONS[int(draw * len(_RANDOM_REJECTIONS))]
+    error = error.format(ref=payload.get("invoiceRefNo") or "null")
+    if item_level:
+        return _rejected(code, error, 1, len(payload.get("items") or []))
+    return _rejected(code, error)
+
+
+def create_app(mock):
+    app = Flask(__name__)
+
+    @app.route("/_mock/config", methods=["GET", "POST"])
+    def mock_config():
+        if request.method == "POST":
+            try:
+                mock.update_config(request.get_json() or {})
+            except (TypeError, ValueError) as e:
+                return jsonify({"error": str(e)}), 400
+        return jsonify(mock.config)
+
+    @app.route("/_mock/stats", methods=["GET"])
+    def mock_stats():
+        return jsonify(mock.stats())
+
+    @app.route("/_mock/reset", methods=["POST"])
+    def mock_reset():
+        mock.reset()
+        return jsonify({"ok": True})
+
+    @app.route("/<path:path>", methods=["POST"])
+    def post_invoice(path):
+        try:
+            overrides = request.args.to_dict()
+            status, body, _ = mock.handle(
+                request.get_json(silent=True), request.headers.get("Authorization"), overrides
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if isinstance(body, dict):
+            return jsonify(body), status
+        return Response(body, status=status, mimetype="text/html")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--token", help="bearer token to require (default: accept any)")
+    parser.add_argument("--seed", type=int, help="random seed for reproducible fault sequences")
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=float, default=200.0)
+    args = parser.parse_args()
+
+    mock = MockFBR(
+        token=args.token,
+        seed=args.seed,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        invalid_rate=args.invalid_rate,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+    )
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    print(f"Mock FBR API on http://{args.host}:{args.port}/di_data/v1/di/postinvoicedata_sb")
+    create_app(mock).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Synthetic invoice data for the report benchmarks.
+
+Seeds the database configured by DB_HOST / DB_NAME / DB_USER / DB_PASSWORD /
+DB_PORT (the same variables the app reads; point them at a scratch database)
+with benchmark clients and their invoices:
+
+    python benchmarks/seed_data.py --clients 3 --invoices 20000 --items 4
+
+Invoices are spread over --days days, mostly production and successful, and
+use both payload shapes the app stores: flat (buyerBusinessName, ... at the
+top level, as the Excel flow writes them) and nested (sellerData / buyerData
+objects, as saved form drafts carry them; --nested-ratio). Product and buyer
+popularity is skewed so top-N reports have realistic winners.
+
+The base tables are created when missing and every migrations/*.sql file is
+applied (they are idempotent), then the reporting columns and rollups are
+backfilled as `flask backfill-reporting` would. Only rows of the bench_*
+clients are deleted on reseeding.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from psycopg2.extras import execute_values  # noqa: E402
+
+import db_pool  # noqa: E402
+import invoice_reporting  # noqa: E402
+
+BENCH_USER_PREFIX = "bench_"
+INSERT_BATCH_SIZE = 1000
+
+# Tables the migrations build on; a real database already has (richer) versions of them
+BASE_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username TEXT UNIQUE NOT NULL,
+    name TEXT,
+    password_hash TEXT
+);
+
+CREATE TABLE IF NOT EXISTS clients (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    strn TEXT,
+    logo_url TEXT,
+    sandbox_api_url TEXT,
+    sandbox_api_token TEXT,
+    production_api_url TEXT,
+    production_api_token TEXT
+);
+
+CREATE TABLE IF NOT EXISTS invoices (
+    id SERIAL PRIMARY KEY,
+    client_id INTEGER NOT NULL REFERENCES clients(id),
+    env TEXT NOT NULL,
+    invoice_data JSONB,
+    fbr_response JSONB,
+    status TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    pdf_data BYTEA
+);
+
+-- product_code comes from the migrations
+CREATE TABLE IF NOT EXISTS products (
+    id SERIAL PRIMARY KEY,
+    client_id INTEGER NOT NULL REFERENCES clients(id),
+    description TEXT NOT NULL,
+    hs_code TEXT,
+    uom TEXT,
+    default_tax_rate NUMERIC,
+    sro_schedule_no TEXT,
+    sro_item_serial_no TEXT,
+    sale_type TEXT,
+    is_active BOOLEAN DEFAULT TRUE
+);
+"""
+
+_PRODUCT_WORDS = (
+    "Steel", "Copper", "PVC", "Cotton", "Polyester", "Ceramic", "Aluminium", "Rubber",
+    "Glass", "Paper", "Plastic", "Leather", "Wooden", "Brass", "Nylon", "Silicone",
+)
+_PRODUCT_NOUNS = (
+    "Pipe", "Wire", "Sheet", "Fabric", "Valve", "Bolt", "Panel", "Cable", "Tile",
+    "Bearing", "Gasket", "Hose", "Bracket", "Fitting", "Roll", "Carton",
+)
+_BUYER_WORDS = (
+    "Al-Noor", "Crescent", "Indus", "Habib", "Faisal", "Karachi", "Lahore", "Punjab",
+    "Sindh", "Margalla", "Ravi", "Chenab", "Pak", "United", "Star", "Metro",
+)
+_BUYER_SUFFIXES = ("Traders", "Industries", "Enterprises", "& Co", "Textiles", "Builders")
+_PROVINCES = ("Sindh", "Punjab", "Khyber Pakhtunkhwa", "Balochistan", "Islamabad Capital Territory")
+_UOMS = ("Numbers, pieces, units", "KG", "Meter", "Square Metre", "Liter")
+
+
+def _catalog(rng, size, make):
+    names = set()
+    while len(names) < size:
+        names.add(make(rng))
+    names = sorted(names)
+    rng.shuffle(names)
+    # Zipf-like weights: the first entries sell far more often than the tail
+    weights = [1.0 / (rank + 1) for rank in range(len(names))]
+    return names, weights
+
+
+def _product_name(rng):
+    return f"{rng.choice(_PRODUCT_WORDS)} {rng.choice(_PRODUCT_NOUNS)} {rng.randint(1, 99)}"
+
+
+def _buyer_name(rng):
+    return f"{rng.choice(_BUYER_WORDS)} {rng.choice(_BUYER_WORDS)} {rng.choice(_BUYER_SUFFIXES)}"
+
+
+def build_invoice(rng, number, created_at, products, buyers, items_per_invoice, nested):
+    """One invoice payload shaped like the ones the app stores."""
+    buyer = rng.choices(buyers[0], buyers[1])[0]
+    items = []
+    for product in rng.choices(products[0], products[1], k=max(1, rng.randint(1, items_per_invoice * 2 - 1))):
+        quantity = rng.randint(1, 50)
+        value_excl = round(quantity * rng.uniform(100, 20000), 2)
+        tax = round(value_excl * 0.18, 2)
+        items.append(
+            {
+                "hsCode": f"{rng.randint(1000, 9999)}.{rng.randint(1000, 9999)}",
+                "productDescription": product,
+                "rate": "18%",
+                "uoM": rng.choice(_UOMS),
+                "quantity": quantity,
+                "valueSalesExcludingST": value_excl,
+                "salesTaxApplicable": tax,
+                "totalValues": round(value_excl + tax, 2),
+                "fixedNotifiedValueOrRetailPrice": 0.0,
+                "salesTaxWithheldAtSource": 0.0,
+                "extraTax": "",
+                "furtherTax": 0.0,
+                "sroScheduleNo": "",
+                "fedPayable": 0.0,
+                "discount": 0.0,
+                "saleType": "Goods at standard rate (default)",
+                "sroItemSerialNo": "",
+            }
+        )
+
+    seller = {
+        "sellerNTNCNIC": "1234567",
+        "sellerBusinessName": "Benchmark Seller (Pvt) Ltd",
+        "sellerProvince": "Sindh",
+        "sellerAddress": "Plot 1, Industrial Area, Karachi",
+    }
+    buyer_fields = {
+        "buyerNTNCNIC": str(rng.randint(1000000, 9999999)),
+        "buyerBusinessName": buyer,
+        "buyerProvince": rng.choice(_PROVINCES),
+        "buyerAddress": f"{rng.randint(1, 500)} Main Road",
+        "buyerRegistrationType": rng.choice(("Registered", "Unregistered")),
+    }
+    invoice = {
+        "invoiceType": "Sale Invoice",
+        "invoiceRefNo": f"INV-{number:07d}",
+        "fbrInvoiceNumber": f"{rng.randint(10**11, 10**12 - 1)}DI{created_at:%y%m%d}{number:06d}",
+        "items": items,
+    }
+    # A few payloads have no invoiceDate; reports then fall back to created_at
+    if rng.random() > 0.05:
+        invoice["invoiceDate"] = created_at.strftime("%Y-%m-%d")
+    if nested:
+        invoice["sellerData"] = seller
+        invoice["buyerData"] = buyer_fields
+    else:
+        invoice.update(seller)
+        invoice.update(buyer_fields)
+    return invoice
+
+
+def ensure_schema(conn):
+    cur = conn.cursor()
+    cur.execute(BASE_SCHEMA_SQL)
+    conn.commit()
+    migrations_dir = os.path.join(ROOT, "migrations")
+    for name in sorted(os.listdir(migrations_dir)):
+        if name.endswith(".sql"):
+            with open(os.path.join(migrations_dir, name), encoding="utf-8") as f:
+                cur.execute(f.read())
+            conn.commit()
+    cur.close()
+
+
+def ensure_clients(conn, count):
+    """Create (or reuse) bench_1..bench_<count> users with one client each; returns client ids."""
+    cur = conn.cursor()
+    client_ids = []
+    for n in range(1, count + 1):
+        username = f"{BENCH_USER_PREFIX}{n}"
+        cur.execute(
+            """
+            INSERT INTO users (username, name, password_hash) VALUES (%s, %s, %s)
+            ON CONFLICT (username) DO UPDATE SET name = EXCLUDED.name
+            RETURNING id
+            """,
+            (username, f"Benchmark client {n}", "bench"),
+        )
+        user_id = cur.fetchone()[0]
+        cur.execute("SELECT id FROM clients WHERE user_id = %s ORDER BY id LIMIT 1", (user_id,))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("INSERT INTO clients (user_id) VALUES (%s) RETURNING id", (user_id,))
+            row = cur.fetchone()
+        client_ids.append(row[0])
+    conn.commit()
+    cur.close()
+    return client_ids
+
+
+def clear_client_data(conn, client_ids):
+    cur = conn.cursor()
+    ids = tuple(client_ids)
+    for table in ("report_daily_totals", "report_monthly_products", "report_monthly_buyers"):
+        cur.execute(f"DELETE FROM {table} WHERE client_id::text IN %s", (tuple(str(i) for i in ids),))
+    cur.execute("DELETE FROM invoice_items WHERE invoice_id IN (SELECT id FROM invoices WHERE client_id IN %s)", (ids,))
+    cur.execute("DELETE FROM invoices WHERE client_id IN %s", (ids,))
+    cur.execute("DELETE FROM products WHERE client_id IN %s", (ids,))
+    conn.commit()
+    cur.close()
+
+
+def seed(
+    clients=2,
+    invoices_per_client=5000,
+    items_per_invoice=4,
+    nested_ratio=0.3,
+    days=365,
+    products_per_client=300,
+    buyers_per_client=400,
+    random_seed=42,
+):
+    """(Re)seed the benchmark clients; returns their client ids."""
+    rng = random.Random(random_seed)
+    started = time.monotonic()
+    conn = db_pool.get_connection()
+    try:
+        ensure_schema(conn)
+        client_ids = ensure_clients(conn, clients)
+        clear_client_data(conn, client_ids)
+
+        now = datetime.datetime.now().replace(microsecond=0)
+        cur = conn.cursor()
+        number = 0
+        for client_id in client_ids:
+            products = _catalog(rng, products_per_client, _product_name)
+            buyers = _catalog(rng, buyers_per_client, _buyer_name)
+            rows = []
+            for _ in range(invoices_per_client):
+                number += 1
+                created_at = now - datetime.timedelta(seconds=rng.randint(0, days * 86400))
+                invoice = build_invoice(
+                    rng, number, created_at, products, buyers, items_per_invoice,
+                    nested=rng.random() < nested_ratio,
+                )
+                status = "Success" if rng.random() < 0.95 else "Failed"
+                env = "production" if rng.random() < 0.8 else "sandbox"
+                fbr_response = {"invoiceNumber": invoice["fbrInvoiceNumber"] if status == "Success" else None}
+                rows.append(
+                    (client_id, env, json.dumps(invoice), json.dumps(fbr_response), status, created_at)
+                )
+                if len(rows) >= INSERT_BATCH_SIZE:
+                    _insert_invoices(cur, rows)
+                    conn.commit()
+                    rows = []
+            if rows:
+                _insert_invoices(cur, rows)
+                conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    invoice_reporting.backfill_reporting(db_pool.get_connection)
+
+    conn = db_pool.get_connection()
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("ANALYZE")
+        cur.close()
+    finally:
+        conn.autocommit = False
+        conn.close()
+
+    print(
+        f"Seeded {len(client_ids)} clients x {invoices_per_client} invoices "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return client_ids
+
+
+def _insert_invoices(cur, rows):
+    execute_values(
+        cur,
+        "INSERT INTO invoices (client_id, env, invoice_data, fbr_response, status, created_at) VALUES %s",
+        rows,
+        page_size=INSERT_BATCH_SIZE,
+    )
+
+
+def add_seed_arguments(parser):
+    parser.add_argument("--clients", type=int, default=2, help="benchmark clients to seed")
+    parser.add_argument("--items", type=int, default=4, help="average items per invoice")
+    parser.add_argument("--nested-ratio", type=float, default=0.3, help="share of sellerData/buyerData payloads")
+    parser.add_argument("--days", type=int, default=365, help="spread created_at over this many days")
+    parser.add_argument("--products", type=int, default=300, help="distinct products per client")
+    parser.add_argument("--buyers", type=int, default=400, help="distinct buyers per client")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=5000, help="invoices per client")
+    add_seed_arguments(parser)
+    args = parser.parse_args()
+    seed(
+        clients=args.clients,
+        invoices_per_client=args.invoices,
+        items_per_invoice=args.items,
+        nested_ratio=args.nested_ratio,
+        days=args.days,
+        products_per_client=args.products,
+        buyers_per_client=args.buyers,
+        random_seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Conditional GET for the invoice and draft listing APIs.
+
+/records, /api/reports/invoices, /api/reports/downloadable-invoices and
+/api/draft-invoices return large JSON bodies that browsers poll. Database
+triggers keep a per-client change counter for invoices and for drafts
+(client_data_versions). conditional_get() reads that one row, derives an ETag
+from it and the request (path, query args, environment, today's date for the
+relative date filters) and answers a matching If-None-Match with 304 before
+the listing query runs. The version read is also left in flask.g.data_version
+so report_cache.cached_report() keys its entries by it and never answers a
+changed ETag with a body cached under an older one.
+"""
+import functools
+import hashlib
+import logging
+from datetime import date
+
+from flask import g, make_response, request, session
+
+logger = logging.getLogger(__name__)
+
+# Bump when a listing's response format changes so browsers drop their copies
+ETAG_FORMAT_VERSION = "1"
+
+
+def get_version(get_db_connection, client_id, scope):
+    """Current change counter of *client_id*'s *scope* ("invoices" / "drafts")."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT version FROM client_data_versions WHERE client_id = %s AND scope = %s",
+            (str(client_id), scope),
+        )
+        row = cur.fetchone()
+        return row[0] if row else 0
+    finally:
+        cur.close()
+        conn.close()
+
+
+def make_etag(client_id, scope, version, env):
+    args = sorted(request.args.items(multi=True))
+    token = "|".join(
+        [
+            ETAG_FORMAT_VERSION,
+            str(client_id),
+            scope,
+            str(version),
+            env or "",
+            request.path,
+            repr(args),
+            date.today().isoformat(),
+        ]
+    )
+    return hashlib.sha1(token.encode("utf-8")).hexdigest()
+
+
+def conditional_get(get_db_connection, scope, get_env=None):
+    """Serve 304 Not Modified while the client's *scope* has not changed.
+
+    *get_env* returns the environment the view reads, for views that depend
+    on it. If the version lookup fails the view runs normally, without an ETag.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            client_id = session.get("client_id")
+            if not client_id:
+                return view(*args, **kwargs)
+
+            try:
+                version = get_version(get_db_connection, client_id, scope)
+            except Exception as e:
+                logger.warning("Error reading %s data version: %s", scope, e)
+                return view(*args, **kwargs)
+
+            g.data_version = (scope, version)
+            etag = make_etag(client_id, scope, version, get_env() if get_env else None)
+            if request.if_none_match.contains_weak(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            # Let browsers and the proxy keep the body but always revalidate it
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,387 @@
+"""
+Pooled PostgreSQL connections shared by every route module.
+
+Handlers keep calling get_db_connection() and conn.close() exactly as before;
+close() now hands the connection back to the pool instead of tearing down the
+TCP/auth session. Pools are created lazily per process so gunicorn workers
+never share sockets inherited across fork().
+"""
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from itertools import count
+
+import psycopg2
+import psycopg2.extensions
+
+import request_timing
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that adds its query time and count to the current request's "db" phase."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            request_timing.record("db", time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            request_timing.record("db", time.perf_counter() - started)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within DB_POOL_TIMEOUT."""
+
+
+class PooledConnection:
+    """Proxy around a psycopg2 connection checked out from a ConnectionPool.
+
+    Everything except close() is delegated to the real connection, so existing
+    code (cursor(), commit(), rollback(), ...) keeps working unchanged. It can
+    also be used as a context manager: ``with get_db_connection() as conn:``
+    commits (or rolls back) like a psycopg2 connection, then returns it to the pool.
+    """
+
+    def __init__(self, pool, conn, token):
+        self._pool = pool
+        self._conn = conn
+        self._token = token
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def raw(self):
+        return self._conn
+
+    @property
+    def closed(self):
+        # Report the proxy as closed once it has been returned to the pool
+        return 1 if self._released else self._conn.closed
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._token, self._conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Like a psycopg2 connection: commit on a clean exit, roll back on an
+        # exception; then return the connection to the pool
+        try:
+            if not self._released:
+                if exc_type is None:
+                    self._conn.commit()
+                else:
+                    try:
+                        self._conn.rollback()
+                    except Exception:
+                        pass
+        finally:
+            self.close()
+        return False
+
+    def __del__(self):
+        # Safety net for handlers that return early without closing: hand the
+        # raw connection to the pool's orphan queue, reclaimed on next checkout.
+        try:
+            if not self._released:
+                self._released = True
+                self._pool._orphans.append((self._token, self._conn))
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections for one process."""
+
+    def __init__(
+        self,
+        connect_kwargs,
+        minconn=1,
+        maxconn=10,
+        timeout=30.0,
+        healthcheck_interval=30.0,
+        leak_timeout=60.0,
+        max_lifetime=1800.0,
+    ):
+        self.connect_kwargs = connect_kwargs
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.leak_timeout = leak_timeout
+        self.max_lifetime = max_lifetime
+
+        self._cond = threading.Condition(threading.RLock())
+        # Idle connections as (conn, idle_since)
+        self._idle = deque()
+        # Checked out: token -> dict(conn, checked_out_at, stack, warned)
+        self._in_use = {}
+        self._tokens = count(1)
+        self._created_at = {}
+        self._orphans = deque()
+        self._total = 0
+        self._closed = False
+
+        self.stats_counters = {
+            "checkouts": 0,
+            "connections_opened": 0,
+            "connections_discarded": 0,
+            "healthcheck_failures": 0,
+            "leaks_detected": 0,
+            "leaks_reclaimed": 0,
+            "wait_timeouts": 0,
+        }
+
+        for _ in range(self.minconn):
+            try:
+                conn = self._open()
+                self._idle.append((conn, time.monotonic()))
+            except Exception as e:
+                logger.warning("DB pool: failed to pre-open connection: %s", e)
+                break
+
+    # ---------------- internals ----------------
+    def _open(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        self._total += 1
+        self._created_at[id(conn)] = time.monotonic()
+        self.stats_counters["connections_opened"] += 1
+        return conn
+
+    def _discard(self, conn):
+        self._total -= 1
+        self._created_at.pop(id(conn), None)
+        self.stats_counters["connections_discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, conn):
+        created = self._created_at.get(id(conn))
+        return (
+            self.max_lifetime > 0
+            and created is not None
+            and time.monotonic() - created > self.max_lifetime
+        )
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if self._is_expired(conn):
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            self.stats_counters["healthcheck_failures"] += 1
+            return False
+
+    def _reset(self, conn):
+        """Leave the connection idle and outside any transaction."""
+        if conn.closed:
+            return False
+        try:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+            return True
+        except Exception:
+            return False
+
+    def _reclaim_orphans(self):
+        while self._orphans:
+            token, conn = self._orphans.popleft()
+            entry = self._in_use.pop(token, None)
+            if entry is None:
+                continue
+            self.stats_counters["leaks_reclaimed"] += 1
+            logger.warning(
+                "DB pool: connection was garbage-collected without close(); checked out at:\n%s",
+                entry["stack"],
+            )
+            if self._reset(conn) and not self._is_expired(conn):
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+
+    def _detect_leaks(self):
+        if self.leak_timeout <= 0:
+            return
+        now = time.monotonic()
+        for entry in list(self._in_use.values()):
+            if entry["warned"] or now - entry["checked_out_at"] < self.leak_timeout:
+                continue
+            entry["warned"] = True
+            self.stats_counters["leaks_detected"] += 1
+            logger.warning(
+                "DB pool: connection held for %.0fs (leak timeout %.0fs); checked out at:\n%s",
+                now - entry["checked_out_at"],
+                self.leak_timeout,
+                entry["stack"],
+            )
+
+    # ---------------- public API ----------------
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        stack = "".join(traceback.format_stack(limit=8)[:-2])
+
+        with self._cond:
+            if self._closed:
+                raise PoolTimeout("Connection pool is closed")
+
+            while True:
+                self._reclaim_orphans()
+                self._detect_leaks()
+
+                conn = None
+                while self._idle:
+                    candidate, idle_since = self._idle.pop()
+                    if self._is_healthy(candidate, idle_since):
+                        conn = candidate
+                        break
+                    self._discard(candidate)
+
+                if conn is None and self._total < self.maxconn:
+                    conn = self._open()
+
+                if conn is not None:
+                    token = next(self._tokens)
+                    proxy = PooledConnection(self, conn, token)
+                    self._in_use[token] = {
+                        "conn": conn,
+                        "checked_out_at": time.monotonic(),
+                        "stack": stack,
+                        "warned": False,
+                    }
+                    self.stats_counters["checkouts"] += 1
+                    return proxy
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats_counters["wait_timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No database connection available within {self.timeout:.0f}s "
+                        f"(max {self.maxconn} per worker)"
+                    )
+                # Wake up periodically so orphaned connections get reclaimed
+                self._cond.wait(min(remaining, 1.0))
+
+    def _release(self, token, conn):
+        with self._cond:
+            self._in_use.pop(token, None)
+            if self._closed or not self._reset(conn) or self._is_expired(conn):
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pid": os.getpid(),
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "open": self._total,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                **self.stats_counters,
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _connect_kwargs():
+    return {
+        "host": os.getenv("DB_HOST"),
+        "database": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "port": os.getenv("DB_PORT"),
+        "connect_timeout": _env_int("DB_CONNECT_TIMEOUT", 10),
+        "cursor_factory": TimedCursor,
+    }
+
+
+def get_pool():
+    """Return this process's pool, creating it on first use (and after fork)."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = ConnectionPool(
+                _connect_kwargs(),
+                minconn=_env_int("DB_POOL_MIN", 1),
+                maxconn=_env_int("DB_POOL_MAX", 10),
+                timeout=_env_float("DB_POOL_TIMEOUT", 30),
+                healthcheck_interval=_env_float("DB_POOL_HEALTHCHECK_INTERVAL", 30),
+                leak_timeout=_env_float("DB_POOL_LEAK_TIMEOUT", 60),
+                max_lifetime=_env_float("DB_POOL_MAX_LIFETIME", 1800),
+            )
+            _pool_pid = pid
+    return _pool
+
+
+def get_connection():
+    """Check out a pooled connection; close() (or leaving a with-block) returns it."""
+    return get_pool().getconn()
+
+
+def pool_stats():
+    if _pool is None or _pool_pid != os.getpid():
+        return None
+    return _pool.stats()
@@ -3,6 +3,8 @@ import json
 from datetime import datetime, timedelta
 from decimal import Decimal
 
+import data_versions
+
 
 def _normalize_json(value):
     """Recursively convert database types (e.g., Decimal) into JSON-friendly primitives."""
@@ -26,6 +28,7 @@ def add_draft_invoice_routes(app, get_db_connection, get_env):
         return render_template("draft-invoices.html")
 
     @app.route("/api/draft-invoices", methods=["GET"])
+    @data_versions.conditional_get(get_db_connection, "drafts")
     def get_draft_invoices():
         client_id = session.get("client_id")
         if not client_id:
@@ -0,0 +1,298 @@
+"""
+Single-pass parser for uploaded invoice workbooks.
+
+The Excel flow used to open the same upload four times with pd.read_excel
+(header section, product table, then both again for the PDF).
+parse_invoice_workbook() streams the first sheet once with openpyxl in
+read_only mode, splits it into the header key/value section and the product
+table, and caches the result by the file's SHA-256 so later steps (get_json,
+submit_fbr, generate_invoice_excel) reuse it without reopening the file. parse_invoice_workbook_batch() does the
+same for workbooks carrying many invoices (one per sheet, or several blocks
+on a sheet).
+
+Cell values are typed the way read_excel typed them, so the JSON built from
+them does not change: integral numbers come back as int, empty cells as "" in
+the header section and NaN in the product table, and product columns that are
+entirely numeric become numpy int64/float64 values.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from openpyxl import load_workbook
+
+import metrics
+
+PRODUCT_HEADER_KEY = "productdescription"
+# Header fields that open the next invoice when they follow a product table
+BLOCK_START_KEYS = frozenset(
+    ["seller information", "invoice information", "sellerbusinessname", "sellerntncnic", "invoicetype"]
+)
+# Instruction rows in the template ("1) ...", "2) ...") are not header fields
+_SKIPPED_PREFIXES = ("1)", "2)", "3)", "4)")
+
+# pandas' default NA strings (read_excel(keep_default_na=True))
+NA_STRINGS = frozenset(
+    [
+        "", " ", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+        "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+        "nan", "null",
+    ]
+)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def is_missing(value):
+    """True for the values read_excel would have turned into NaN."""
+    if value is None:
+        return True
+    if isinstance(value, float):
+        return math.isnan(value)
+    if isinstance(value, str):
+        return value in NA_STRINGS
+    return False
+
+
+def _convert_cell(value):
+    # Same conversions as pandas' openpyxl reader
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _iter_sheets(filepath, first_only=False):
+    """Yield (sheet title, row iterator) for the sheets of *filepath*."""
+    if filepath.lower().endswith(".xls"):
+        # openpyxl cannot read legacy .xls; let pandas/xlrd load it once
+        import pandas as pd
+
+        frames = pd.read_excel(
+            filepath, header=None, keep_default_na=False, dtype=object,
+            sheet_name=0 if first_only else None,
+        )
+        if first_only:
+            frames = {"Sheet1": frames}
+        for title, df in frames.items():
+            yield title, ([_convert_cell(v) for v in row] for row in df.itertuples(index=False))
+        return
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheets = workbook.worksheets[:1] if first_only else workbook.worksheets
+        for sheet in sheets:
+            rows = (
+                [_convert_cell(v) for v in row]
+                for row in sheet.iter_rows(min_row=1, values_only=True)
+            )
+            yield sheet.title, rows
+    finally:
+        workbook.close()
+
+
+def _infer_column(values):
+    """Type one product column the way read_excel's parser does."""
+    values = [np.nan if is_missing(v) else v for v in values]
+    present = [v for v in values if not (isinstance(v, float) and math.isnan(v))]
+    if not present:
+        return values
+
+    if all(isinstance(v, bool) for v in present):
+        return values
+
+    numbers = []
+    all_int = len(present) == len(values)
+    for v in values:
+        if isinstance(v, bool):
+            return values
+        if isinstance(v, int):
+            numbers.append(v)
+        elif isinstance(v, float):
+            # NaN or a non-integral number (integral ones were made int)
+            numbers.append(v)
+            all_int = False
+        elif isinstance(v, str):
+            try:
+                numbers.append(int(v.strip()))
+            except ValueError:
+                try:
+                    numbers.append(float(v))
+                except ValueError:
+                    return values
+                all_int = False
+        else:
+            # Dates and other objects keep the column as object dtype
+            return values
+
+    if all_int:
+        return [np.int64(v) for v in numbers]
+    return [np.float64(v) for v in numbers]
+
+
+def _column_names(header_row):
+    names = []
+    seen = {}
+    for position, value in enumerate(header_row):
+        name = value if value != "" else f"Unnamed: {position}"
+        if name in seen:
+            # Duplicate headers are suffixed (.1, .2, ...) like pandas does
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _new_block():
+    return {
+        "section": OrderedDict(),
+        "product_start_index": None,
+        "header_row": None,
+        "product_rows": [],
+        "last_product_with_data": -1,
+    }
+
+
+def _split_blocks(rows):
+    """Walk a sheet once, yielding one raw block per invoice.
+
+    A block is a header section followed by a productDescription table. When a
+    header field (see BLOCK_START_KEYS) turns up again below a product table,
+    the table ends and the next invoice begins on that row.
+    """
+    block = _new_block()
+    for index, row in enumerate(rows):
+        first = row[0] if row else ""
+        key = "" if is_missing(first) else str(first).strip()
+
+        if block["header_row"] is not None:
+            if key.lower() not in BLOCK_START_KEYS:
+                block["product_rows"].append(row)
+                if any(v != "" for v in row):
+                    block["last_product_with_data"] = len(block["product_rows"]) - 1
+                continue
+            yield block
+            block = _new_block()
+
+        if key.lower() == PRODUCT_HEADER_KEY:
+            block["product_start_index"] = index
+            while row and row[-1] == "":
+                row = row[:-1]
+            block["header_row"] = row
+            continue
+        if key and not key.startswith(_SKIPPED_PREFIXES):
+            block["section"][key] = row[1] if len(row) > 1 else ""
+
+    yield block
+
+
+def _finish_block(block):
+    header_row = block["header_row"]
+    products = []
+    columns = []
+    if header_row is not None:
+        # Trailing empty rows are dropped, empty rows inside the table are kept
+        product_rows = block["product_rows"][: block["last_product_with_data"] + 1]
+        width = max([len(header_row)] + [len(r) for r in product_rows])
+        header_row = list(header_row) + [""] * (width - len(header_row))
+        columns = _column_names(header_row)
+        padded = [list(r) + [""] * (width - len(r)) for r in product_rows]
+        typed_columns = [_infer_column([r[c] for r in padded]) for c in range(width)]
+        for row_index in range(len(padded)):
+            products.append(
+                OrderedDict((columns[c], typed_columns[c][row_index]) for c in range(width))
+            )
+
+    return {
+        "section": block["section"],
+        "product_start_index": block["product_start_index"],
+        "columns": columns,
+        "products": products,
+    }
+
+
+def _parse(filepath):
+    for _, rows in _iter_sheets(filepath, first_only=True):
+        for block in _split_blocks(rows):
+            return _finish_block(block)
+    return _finish_block(_new_block())
+
+
+def _parse_batch(filepath):
+    invoices = []
+    for title, rows in _iter_sheets(filepath):
+        sheet_blocks = [b for b in _split_blocks(rows) if b["header_row"] is not None]
+        for number, block in enumerate(sheet_blocks, start=1):
+            parsed = _finish_block(block)
+            parsed["sheet"] = title
+            parsed["block"] = number
+            invoices.append(parsed)
+    return invoices
+
+
+def file_sha256(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_size = _env_int("EXCEL_PARSE_CACHE_SIZE", 16)
+
+
+def _cached(key, parse, filepath):
+    with _cache_lock:
+        parsed = _cache.get(key)
+        if parsed is not None:
+            _cache.move_to_end(key)
+            return parsed
+
+    started = time.perf_counter()
+    parsed = parse(filepath)
+    metrics.observe_excel_parse(key[0], time.perf_counter() - started)
+
+    with _cache_lock:
+        _cache[key] = parsed
+        _cache.move_to_end(key)
+        while len(_cache) > _cache_size:
+            _cache.popitem(last=False)
+    return parsed
+
+
+def parse_invoice_workbook(filepath):
+    """Parse the first invoice of *filepath* and return the (shared, read-only) result.
+
+    Returns a dict with:
+      section               header key -> raw cell value ("" when empty)
+      product_start_index   row index of the productDescription header, or None
+      columns               product table column names
+      products              one OrderedDict per product row, keyed by column
+    """
+    return _cached(("single", file_sha256(filepath)), _parse, filepath)
+
+
+def parse_invoice_workbook_batch(filepath):
+    """Parse every invoice in *filepath*: one per sheet, or several blocks per sheet.
+
+    Returns a list of parse results shaped like parse_invoice_workbook()'s,
+    each with the "sheet" title and 1-based "block" number it came from.
+    Sheets without a product table (e.g. instructions) are skipped.
+    """
+    return _cached(("batch", file_sha256(filepath)), _parse_batch, filepath)
@@ -0,0 +1,169 @@
+"""
+Pooled HTTP client for the FBR invoice API.
+
+requests.post() opens (and TLS-handshakes) a fresh connection per call. Each
+process here keeps one requests.Session per environment (sandbox /
+production, the URLs come from get_client_config) whose HTTPAdapter holds up to
+FBR_POOL_SIZE keep-alive connections per host, so sequential submits and the
+batch workers reuse warm connections. The sessions are shared by every client
+of the process, so they never store cookies. stats() reports per-environment request
+counts, latency and how many TCP connections urllib3 actually opened.
+"""
+import http.cookiejar
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import request_timing
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class FBRClient:
+    def __init__(self, pool_size=10, pool_block=False):
+        self.pool_size = max(1, pool_size)
+        self.pool_block = pool_block
+
+        self._sessions = {}
+        self._adapters = {}
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def _session(self, env):
+        session = self._sessions.get(env)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(env)
+            if session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=self.pool_size,
+                    pool_block=self.pool_block,
+                    max_retries=0,  # FBR submissions are not idempotent
+                )
+                session = requests.Session()
+                # One session serves every client: a cookie set by one
+                # client's response must never be sent with another's request
+                session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._adapters[env] = adapter
+                self._counters[env] = {
+                    "requests": 0,
+                    "errors": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                }
+                self._sessions[env] = session
+        return session
+
+    def _record(self, env, elapsed, failed):
+        with self._lock:
+            counters = self._counters[env]
+            counters["requests"] += 1
+            counters["total_seconds"] += elapsed
+            counters["max_seconds"] = max(counters["max_seconds"], elapsed)
+            if failed:
+                counters["errors"] += 1
+
+    def post_invoice(self, env, api_url, api_token, payload, timeout=180):
+        """POST an invoice payload to FBR over this process's pooled session."""
+        session = self._session(env)
+        headers = {
+            "Authorization": f"Bearer {api_token}",
+            "Content-Type": "application/json",
+        }
+        started = time.monotonic()
+        failed = True
+        http_status = "error"
+        try:
+            response = session.post(api_url, headers=headers, json=payload, timeout=timeout)
+            failed = response.status_code >= 500
+            http_status = response.status_code
+            return response
+        finally:
+            elapsed = time.monotonic() - started
+            self._record(env, elapsed, failed)
+            request_timing.record("fbr", elapsed)
+            metrics.observe_fbr_request(env, http_status, elapsed)
+
+    def stats(self):
+        with self._lock:
+            result = {"pid": os.getpid(), "pool_size": self.pool_size, "envs": {}}
+            for env, adapter in self._adapters.items():
+                counters = dict(self._counters[env])
+                requests_made = counters["requests"]
+                counters["avg_seconds"] = (
+                    round(counters["total_seconds"] / requests_made, 3) if requests_made else None
+                )
+                counters["total_seconds"] = round(counters["total_seconds"], 3)
+                counters["max_seconds"] = round(counters["max_seconds"], 3)
+
+                hosts = []
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    opened = getattr(pool, "num_connections", 0)
+                    served = getattr(pool, "num_requests", 0)
+                    # The pool queue is pre-filled with None placeholders
+                    idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+                    hosts.append(
+                        {
+                            "host": pool.host,
+                            "port": pool.port,
+                            "connections_opened": opened,
+                            "requests": served,
+                            "idle_connections": idle,
+                            "reuse_ratio": round(1 - opened / served, 3) if served else None,
+                        }
+                    )
+                counters["hosts"] = hosts
+                result["envs"][env] = counters
+            return result
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._adapters.clear()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return this process's client, creating it on first use (and after fork)."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _client = FBRClient(pool_size=_env_int("FBR_POOL_SIZE", 10))
+            _client_pid = pid
+    return _client
+
+
+def post_invoice(env, api_url, api_token, payload, timeout=180):
+    return get_client().post_invoice(env, api_url, api_token, payload, timeout=timeout)
+
+
+def stats():
+    if _client is None or _client_pid != os.getpid():
+        return None
+    return _client.stats()
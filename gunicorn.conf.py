@@ -0,0 +1,23 @@
+"""
+gunicorn settings for the app (picked up automatically from the working directory).
+
+Only the Prometheus multi-process cleanup lives here; workers, threads and
+binding keep coming from the command line / GUNICORN_CMD_ARGS.
+"""
+import os
+import shutil
+
+
+def on_starting(server):
+    # Start from an empty metrics directory so values of a previous run are not reported
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -5,6 +5,8 @@ from flask import request, jsonify, session
 import json
 from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
+from psycopg2.errors import UniqueViolation
+import workspace_store
 
 SPECIAL_USERNAMES = {"H075895", "F667833", "infinityeng"}
 
@@ -34,6 +36,51 @@ def _require_valid_tax_id(value, label):
     raise ValueError(f"{label} must be 7 characters (NTN) or 13 digits (CNIC)")
 
 
+def _upsert_products(cur, client_id, products):
+    """Insert *products* (description, hs_code, uom, default_tax_rate, sale_type)
+    for a client in one statement, reactivating soft-deleted ones that already
+    exist (matched case-insensitively). Existing active products are left as they are.
+    """
+    if not products:
+        return
+    # Sorted so concurrent upserts lock the index entries in the same order
+    products = sorted(products, key=lambda p: p[0].lower())
+    descriptions, hs_codes, uoms, tax_rates, sale_types = (list(col) for col in zip(*products))
+    # Form values may arrive as numbers; the text arrays need strings
+    hs_codes, uoms, sale_types = (
+        [None if v is None else str(v) for v in col] for col in (hs_codes, uoms, sale_types)
+    )
+    cur.execute(
+        """
+        INSERT INTO products
+          (client_id, description, hs_code, uom, default_tax_rate, sale_type, is_active)
+        SELECT %s, p.description, p.hs_code, p.uom, p.default_tax_rate, p.sale_type, TRUE
+        FROM UNNEST(%s::text[], %s::text[], %s::text[], %s::numeric[], %s::text[])
+          AS p(description, hs_code, uom, default_tax_rate, sale_type)
+        ON CONFLICT (client_id, LOWER(description)) DO UPDATE
+        SET is_active = TRUE
+        WHERE products.is_active = FALSE
+        """,
+        (client_id, descriptions, hs_codes, uoms, tax_rates, sale_types),
+    )
+
+
+def _duplicate_product_response(cur, client_id, description):
+    """409 for a product description the client already uses (call after rolling back)."""
+    cur.execute(
+        """
+        SELECT id, description FROM products
+        WHERE client_id = %s AND LOWER(description) = LOWER(%s)
+        """,
+        (client_id, description),
+    )
+    row = cur.fetchone()
+    body = {"error": f'A product named "{row[1] if row else description}" already exists'}
+    if row:
+        body["conflicting_product_id"] = row[0]
+    return jsonify(body), 409
+
+
 # Business Profiles / Buyers / Products / Invoice APIs
 def add_invoice_form_routes(app, get_db_connection, get_env):
     # ---------------- Business Profiles ----------------
@@ -486,24 +533,6 @@ def add_invoice_form_routes(app, get_db_connection, get_env):
             has_product_code = "product_code" in available_columns
             has_sro_item_serial_no = "sro_item_serial_no" in available_columns
 
-            # Case-insensitive match to prevent duplicates
-            cur.execute(
-                """
-                SELECT id, is_active FROM products
-                WHERE client_id = %s AND LOWER(description) = LOWER(%s)
-                """,
-                (client_id, description),
-            )
-            existing = cur.fetchone()
-            if existing:
-                if existing[1] is False:
-                    cur.execute(
-                        "UPDATE products SET is_active = TRUE WHERE id = %s",
-                        (existing[0],),
-                    )
-                    conn.commit()
-                return jsonify({"id": existing[0], "message": "Product already exists"}), 200
-
             # Determine username for user-specific behavior
             cur.execute(
                 """
@@ -567,18 +596,35 @@ def add_invoice_form_routes(app, get_db_connection, get_env):
                 columns.append("sro_item_serial_no")
                 values.append(payload_sro_item)
 
+            # Same key as _upsert_products: an existing product (matched
+            # case-insensitively) is kept as it is, and reactivated if soft-deleted
             placeholders = ", ".join(["%s"] * len(values))
             cur.execute(
                 f"""
                 INSERT INTO products ({', '.join(columns)}, is_active)
                 VALUES ({placeholders}, TRUE)
-                RETURNING id
+                ON CONFLICT (client_id, LOWER(description)) DO UPDATE
+                SET is_active = TRUE
+                WHERE products.is_active = FALSE
+                RETURNING id, (xmax = 0) AS inserted
                 """,
                 values,
             )
-            new_id = cur.fetchone()[0]
+            row = cur.fetchone()
+            if row is None:
+                # Conflict with an active product: nothing was written
+                cur.execute(
+                    "SELECT id FROM products WHERE client_id = %s AND LOWER(description) = LOWER(%s)",
+                    (client_id, description),
+                )
+                row = (cur.fetchone()[0], False)
             conn.commit()
-            return jsonify({"id": new_id, "message": "Product created successfully"})
+            if not row[1]:
+                return jsonify({"id": row[0], "message": "Product already exists"}), 200
+            return jsonify({"id": row[0], "message": "Product created successfully"})
+        except UniqueViolation:
+            conn.rollback()
+            return _duplicate_product_response(cur, client_id, description)
         except Exception as e:
             conn.rollback()
             return jsonify({"error": f"Failed to create product: {str(e)}"}), 500
@@ -695,6 +741,10 @@ def add_invoice_form_routes(app, get_db_connection, get_env):
             if not updated:
                 return jsonify({"error": "Product update failed"}), 404
             return jsonify({"id": updated[0], "message": "Product updated successfully"})
+        except UniqueViolation:
+            # Renamed to the description of another of the client's products
+            conn.rollback()
+            return _duplicate_product_response(cur, client_id, description)
         except Exception as e:
             conn.rollback()
             return jsonify({"error": f"Failed to update product: {str(e)}"}), 500
@@ -855,56 +905,56 @@ def add_invoice_form_routes(app, get_db_connection, get_env):
         data = request.get_json() or {}
         product_list = data.get("products", [])
         if not product_list:
+            cur.close()
+            conn.close()
             return jsonify({"error": "No products provided for import"}), 400
 
-        results = {"imported": 0, "skipped": 0}
         sro_schedule_no = "EIGHTH SCHEDULE Table 1" if username == "3075270" else ""
         sro_item_serial_no = "81" if username == "3075270" else ""
 
+        # One row per description (case-insensitive, first spelling wins),
+        # sorted so concurrent imports lock the index entries in the same order
+        names = {}
         for name in product_list:
-            cur.execute(
-                """
-                SELECT id, is_active FROM products
-                WHERE client_id = %s AND LOWER(description) = LOWER(%s)
-                """,
-                (client_id, name),
-            )
-            existing = cur.fetchone()
-            if existing:
-                # Reactivate if soft-deleted
-                if existing[1] is False:
-                    cur.execute(
-                        "UPDATE products SET is_active = TRUE WHERE id = %s",
-                        (existing[0],),
-                    )
-                    results["imported"] += 1
-                else:
-                    results["skipped"] += 1
-                continue
+            name = str(name or "").strip()
+            if name:
+                names.setdefault(name.lower(), name)
+        names = [names[key] for key in sorted(names)]
 
-            cur.execute(
-                """
-                INSERT INTO products
-                  (client_id, description, hs_code, uom, default_tax_rate,
-                   sale_type, sro_schedule_no, sro_item_serial_no, is_active)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s, TRUE)
-                """,
-                (
-                    client_id,
-                    name,
-                    "",
-                    "Numbers, pieces, units",
-                    1,
-                    "Goods at Reduced Rate",
-                    sro_schedule_no,
-                    sro_item_serial_no,
-                ),
-            )
-            results["imported"] += 1
+        # New products are inserted and soft-deleted ones reactivated in one
+        # statement, on the same key as _upsert_products; active ones are skipped
+        try:
+            imported = 0
+            if names:
+                cur.execute(
+                    """
+                    INSERT INTO products
+                      (client_id, description, hs_code, uom, default_tax_rate,
+                       sale_type, sro_schedule_no, sro_item_serial_no, is_active)
+                    SELECT %s, p.description, '', 'Numbers, pieces, units', 1,
+                           'Goods at Reduced Rate', %s, %s, TRUE
+                    FROM UNNEST(%s::text[]) AS p(description)
+                    ON CONFLICT (client_id, LOWER(description)) DO UPDATE
+                    SET is_active = TRUE
+                    WHERE products.is_active = FALSE
+                    """,
+                    (client_id, sro_schedule_no, sro_item_serial_no, names),
+                )
+                imported = cur.rowcount
+            conn.commit()
+        except UniqueViolation as e:
+            conn.rollback()
+            # The detail names the conflicting key, e.g. Key (...)=(...) already exists
+            detail = e.diag.message_detail or str(e)
+            return jsonify({"error": f"Product import conflicts with an existing product: {detail}"}), 409
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"error": f"Failed to import products: {str(e)}"}), 500
+        finally:
+            cur.close()
+            conn.close()
 
-        conn.commit()
-        cur.close()
-        conn.close()
+        results = {"imported": imported, "skipped": len(product_list) - imported}
         return jsonify(
             {
                 "message": f'Imported {results["imported"]} products, skipped {results["skipped"]} existing products',
@@ -998,6 +1048,7 @@ def add_invoice_form_routes(app, get_db_connection, get_env):
 
         # Items
         items_list = []
+        new_products = {}
 
         # Helper to quantize monetary values to 2 decimals with half-up rounding
         def q2(val):
@@ -1062,61 +1113,44 @@ def add_invoice_form_routes(app, get_db_connection, get_env):
                     item["product_code"] = item_data.get("product_code") or item_data.get("productCode") or ""
                 items_list.append(item)
 
-                # Persist product if new (reactivate if soft deleted)
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute(
-                    """
-                    SELECT id, is_active FROM products
-                    WHERE client_id = %s AND LOWER(description) = LOWER(%s)
-                    """,
-                    (client_id, item_data["productDescription"]),
-                )
-                existing = cur.fetchone()
-                if existing:
-                    if existing[1] is False:
-                        cur.execute(
-                            "UPDATE products SET is_active = TRUE WHERE id = %s",
-                            (existing[0],),
-                        )
-                        conn.commit()
-                else:
-                    # Process tax rate before executing query
+                # Product to persist if new (reactivated if soft deleted); the
+                # first item of a description wins, as it did item by item
+                description = str(item_data["productDescription"])
+                if description.lower() not in new_products:
                     tax_rate_str = item_data.get("taxRate", "17%")
                     tax_rate_num = tax_rate_str.replace("%", "") if isinstance(tax_rate_str, str) else tax_rate_str
                     # Try to convert to float, fallback to 17 if it fails
                     try:
-                        float(tax_rate_num)
+                        tax_rate_num = float(tax_rate_num)
                     except (ValueError, TypeError):
-                        tax_rate_num = "17"
-                        
-                    cur.execute(
-                        """
-                        INSERT INTO products
-                          (client_id, description, hs_code, uom, default_tax_rate, sale_type, is_active)
-                        VALUES (%s,%s,%s,%s,%s,%s, TRUE)
-                        """,
-                        (
-                            client_id,
-                            item_data["productDescription"],
-                            item_data.get("hsCode", ""),
-                            item_data.get("uoM", "Numbers, pieces, units"),
-                            tax_rate_num,
-                            item_data.get("saleType", "Goods at Reduced Rate"),
-                        ),
+                        tax_rate_num = 17.0
+                    new_products[description.lower()] = (
+                        description,
+                        item_data.get("hsCode", ""),
+                        item_data.get("uoM", "Numbers, pieces, units"),
+                        tax_rate_num,
+                        item_data.get("saleType", "Goods at Reduced Rate"),
                     )
-                    conn.commit()
-                cur.close()
-                conn.close()
             except Exception as e:
                 return jsonify({"error": f"Error processing item: {str(e)}"}), 400
 
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            _upsert_products(cur, client_id, list(new_products.values()))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"error": f"Failed to save products: {str(e)}"}), 500
+        finally:
+            cur.close()
+            conn.close()
+
         invoice_json["items"] = items_list
         invoice_json["client_id"] = client_id
 
-        # Store into global cache (used by PDF generator)
-        import app  # local import to avoid circular import at module load time
-        app.last_json_data[env] = invoice_json
+        # Store into the session workspace (used by PDF generator and /submit-fbr)
+        workspace_store.save(env, workspace_store.INVOICE_SLOT, invoice_json)
 
         # Draft save
         if data.get("saveDraft"):
@@ -0,0 +1,187 @@
+"""
+Stored invoice PDFs, keyed by the HTML they were rendered from.
+
+Every PDF is rendered from a Jinja template; invoices.pdf_source_hash records the
+SHA-256 of that HTML. A stored PDF is served as long as re-rendering the
+template yields the same HTML, so a download after submit (or a second
+download) never runs WeasyPrint again, while a template or data change still
+produces a fresh PDF.
+
+The PDF bytes live in the content-addressed store (pdf_store.py) under
+invoices.pdf_sha256; rows written before that keep them in pdf_data until
+migrate_blobs_to_store() moves them, and are served from there meanwhile.
+"""
+import hashlib
+import logging
+from io import BytesIO
+
+from flask import jsonify, send_file
+
+import pdf_store
+
+logger = logging.getLogger(__name__)
+
+# WHERE fragment for "this invoice has a stored PDF", in either location
+HAS_PDF_SQL = "(pdf_sha256 IS NOT NULL OR pdf_data IS NOT NULL)"
+
+
+def html_content_hash(rendered_html):
+    return hashlib.sha256(rendered_html.encode("utf-8")).hexdigest()
+
+
+def load_cached_pdf(cur, invoice_id, source_hash):
+    """Return the stored PDF bytes for *invoice_id* if they match *source_hash*."""
+    cur.execute(
+        f"""
+        SELECT pdf_sha256, pdf_data FROM invoices
+        WHERE id = %s AND {HAS_PDF_SQL} AND pdf_source_hash = %s
+        """,
+        (invoice_id, source_hash),
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    pdf_sha256, pdf_data = row
+    if pdf_sha256:
+        try:
+            return pdf_store.read_pdf(pdf_sha256)
+        except FileNotFoundError:
+            # Lost from the store: render again rather than fail the download
+            logger.warning("Stored PDF %s of invoice %s is missing", pdf_sha256, invoice_id)
+            return None
+    return bytes(pdf_data) if pdf_data is not None else None
+
+
+def has_cached_pdf(cur, invoice_id, source_hash):
+    cur.execute(
+        f"""
+        SELECT 1 FROM invoices
+        WHERE id = %s AND {HAS_PDF_SQL} AND pdf_source_hash = %s
+        """,
+        (invoice_id, source_hash),
+    )
+    return cur.fetchone() is not None
+
+
+def store_invoice_pdf(cur, invoice_id, pdf_binary, source_hash):
+    # The file is written before the row; a rolled-back update only leaves an unreferenced file
+    pdf_sha256, pdf_size = pdf_store.put_pdf(pdf_binary)
+    cur.execute(
+        """
+        UPDATE invoices
+        SET pdf_sha256 = %s, pdf_size = %s, pdf_data = NULL, pdf_source_hash = %s
+        WHERE id = %s
+        """,
+        (pdf_sha256, pdf_size, source_hash, invoice_id),
+    )
+
+
+def send_invoice_pdf(pdf_sha256, pdf_data, download_name):
+    """Download response for a stored PDF: from the store when moved, else from the legacy blob.
+
+    A file missing from the store (e.g. written on another node without a
+    shared PDF_STORE_DIR) answers 404; the next render stores it again.
+    """
+    if pdf_sha256:
+        try:
+            return pdf_store.send_pdf(pdf_sha256, download_name)
+        except FileNotFoundError:
+            logger.warning("Stored PDF %s (%s) is missing from the PDF store", pdf_sha256, download_name)
+            return jsonify({"error": "Invoice PDF file is missing; generate the invoice PDF again"}), 404
+    return send_file(
+        BytesIO(bytes(pdf_data)),
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=download_name,
+    )
+
+
+def read_invoice_pdf(pdf_sha256, pdf_data):
+    if pdf_sha256:
+        return pdf_store.read_pdf(pdf_sha256)
+    return bytes(pdf_data)
+
+
+def migrate_blobs_to_store(get_db_connection, batch_size=100):
+    """Move every invoices.pdf_data blob into the PDF store.
+
+    Walks the rows still holding pdf_data in id order, committing after each
+    batch so an interrupted run can simply be started again. Returns
+    (invoices moved, bytes moved).
+    """
+    moved = 0
+    moved_bytes = 0
+    last_id = None
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        while True:
+            if last_id is None:
+                cur.execute(
+                    "SELECT id FROM invoices WHERE pdf_data IS NOT NULL ORDER BY id LIMIT %s",
+                    (batch_size,),
+                )
+            else:
+                cur.execute(
+                    """
+                    SELECT id FROM invoices
+                    WHERE pdf_data IS NOT NULL AND id > %s
+                    ORDER BY id LIMIT %s
+                    """,
+                    (last_id, batch_size),
+                )
+            ids = [row[0] for row in cur.fetchall()]
+            if not ids:
+                break
+
+            # Blobs are fetched one at a time to keep memory flat
+            for invoice_id in ids:
+                cur.execute(
+                    "SELECT pdf_data FROM invoices WHERE id = %s AND pdf_data IS NOT NULL FOR UPDATE",
+                    (invoice_id,),
+                )
+                row = cur.fetchone()
+                if not row:
+                    continue
+                pdf_sha256, pdf_size = pdf_store.put_pdf(bytes(row[0]))
+                cur.execute(
+                    """
+                    UPDATE invoices
+                    SET pdf_sha256 = %s, pdf_size = %s, pdf_data = NULL
+                    WHERE id = %s
+                    """,
+                    (pdf_sha256, pdf_size, invoice_id),
+                )
+                moved += 1
+                moved_bytes += pdf_size
+            conn.commit()
+            last_id = ids[-1]
+            logger.info("Moved %s invoice PDFs to the store (%s bytes)", moved, moved_bytes)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+    return moved, moved_bytes
+
+
+def pending_render_job(cur, invoice_id):
+    """Id of a queued or running render job for *invoice_id*, or None.
+
+    Requests never wait for it: the async download answers with this job
+    instead of queuing another one, a synchronous download renders inline.
+    """
+    # A failed job waiting out its retry backoff is not about to produce a PDF
+    cur.execute(
+        """
+        SELECT id FROM pdf_render_jobs
+        WHERE invoice_id = %s AND status IN ('queued', 'running')
+          AND (next_attempt_at IS NULL OR next_attempt_at <= NOW())
+        ORDER BY created_at DESC
+        LIMIT 1
+        """,
+        (invoice_id,),
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
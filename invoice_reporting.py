@@ -0,0 +1,329 @@
+"""
+Reporting columns extracted from stored invoices.
+
+Reports used to dig through invoices.invoice_data on every request: expanding
+the items with jsonb_array_elements and recomputing the invoice date, buyer and
+reference per row, none of which can use an index. sync_invoices() copies those
+fields into plain columns instead: the header fields (invoice_date, buyer_name,
+invoice_ref, fbr_invoice_number and the totals) on invoices, and one row per
+item in invoice_items. It runs when an invoice is stored and from the
+`flask backfill-reporting` command for existing rows.
+
+The report_* rollup tables hold daily and monthly totals on top of that. They
+are adjusted incrementally (record_invoice adds an invoice, remove_invoice
+subtracts it before it is deleted) and rebuilt from scratch by the backfill. The extraction is done in
+SQL with the same fallbacks the reports used (productDescription/description/
+productName/name, buyerBusinessName or buyerData.buyerBusinessName,
+invoiceDate or created_at).
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Item values that are not plain numbers become NULL instead of failing the insert
+_NUMBER_PATTERN = r"^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$"
+
+
+def _numeric(key):
+    return (
+        f"CASE WHEN (item.value->>'{key}') ~ '{_NUMBER_PATTERN}' "
+        f"THEN (item.value->>'{key}')::numeric END"
+    )
+
+
+# invoiceDate as a date, or the day the invoice was stored when it is missing or
+# not a real calendar date (2024-02-30, 2024-13-01): the ::date cast is only
+# reached once the month and the day within that month have been checked, so
+# one bad payload can neither fail the sync nor drop out of date-filtered reports
+_INVOICE_DATE_SQL = """
+    CASE
+        WHEN jsonb_typeof(inv.invoice_data::jsonb) = 'object'
+             AND (inv.invoice_data::jsonb->>'invoiceDate')
+                 ~ '^[1-9][0-9]{3}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])'
+        THEN CASE
+            WHEN SUBSTRING(inv.invoice_data::jsonb->>'invoiceDate', 9, 2)::int <= EXTRACT(
+                DAY FROM (LEFT(inv.invoice_data::jsonb->>'invoiceDate', 7) || '-01')::date
+                         + INTERVAL '1 month - 1 day'
+            )
+            THEN LEFT(inv.invoice_data::jsonb->>'invoiceDate', 10)::date
+            ELSE DATE(inv.created_at)
+        END
+        ELSE DATE(inv.created_at)
+    END
+"""
+
+_SYNC_HEADERS_SQL = """
+    UPDATE invoices inv
+    SET
+        invoice_date = """ + _INVOICE_DATE_SQL + """,
+        buyer_name = CASE
+            WHEN jsonb_typeof(inv.invoice_data::jsonb) = 'object' THEN
+                COALESCE(
+                    inv.invoice_data::jsonb->>'buyerBusinessName',
+                    CASE
+                        WHEN jsonb_typeof(inv.invoice_data::jsonb->'buyerData') = 'object'
+                        THEN inv.invoice_data::jsonb->'buyerData'->>'buyerBusinessName'
+                    END
+                )
+        END,
+        invoice_ref = CASE
+            WHEN jsonb_typeof(inv.invoice_data::jsonb) = 'object'
+            THEN NULLIF(inv.invoice_data::jsonb->>'invoiceRefNo', '')
+        END,
+        fbr_invoice_number = CASE
+            WHEN jsonb_typeof(inv.fbr_response::jsonb) = 'object'
+            THEN NULLIF(inv.fbr_response::jsonb->>'invoiceNumber', '')
+        END
+    WHERE inv.id IN %s
+"""
+
+_SYNC_ITEMS_SQL = f"""
+    INSERT INTO invoice_items (
+        invoice_id, client_id, env, line_no, product_description, hs_code,
+        quantity, value_excl, tax, total, invoice_date, month, buyer_name, created_at
+    )
+    SELECT
+        inv.id,
+        inv.client_id,
+        inv.env,
+        item.ordinality::int,
+        COALESCE(
+            item.value->>'productDescription', item.value->>'description',
+            item.value->>'productName', item.value->>'name'
+        ),
+        item.value->>'hsCode',
+        {_numeric("quantity")},
+        {_numeric("valueSalesExcludingST")},
+        {_numeric("salesTaxApplicable")},
+        {_numeric("totalValues")},
+        inv.invoice_date,
+        TO_CHAR(inv.invoice_date, 'YYYY-MM'),
+        inv.buyer_name,
+        inv.created_at
+    FROM invoices inv
+    CROSS JOIN LATERAL jsonb_array_elements(
+        CASE
+            WHEN jsonb_typeof(inv.invoice_data::jsonb) = 'object' AND
+                 jsonb_typeof(inv.invoice_data::jsonb->'items') = 'array'
+            THEN inv.invoice_data::jsonb->'items'
+            ELSE '[]'::jsonb
+        END
+    ) WITH ORDINALITY AS item(value, ordinality)
+    WHERE inv.id IN %s
+      AND inv.status = 'Success'
+      AND jsonb_typeof(item.value) = 'object'
+"""
+
+_SYNC_TOTALS_SQL = """
+    UPDATE invoices inv
+    SET
+        total_excl = totals.total_excl,
+        total_tax = totals.total_tax,
+        total_amount = totals.total_amount
+    FROM (
+        SELECT
+            i.id,
+            SUM(ii.value_excl) AS total_excl,
+            SUM(ii.tax) AS total_tax,
+            SUM(ii.total) AS total_amount
+        FROM invoices i
+        LEFT JOIN invoice_items ii ON ii.invoice_id = i.id
+        WHERE i.id IN %s
+        GROUP BY i.id
+    ) totals
+    WHERE inv.id = totals.id
+"""
+
+
+# Rollup upserts. {scope} limits the source rows; {sign} is +1 when adding
+# invoices and -1 when removing them.
+_DAILY_ROLLUP_SQL = """
+    INSERT INTO report_daily_totals AS r (
+        client_id, env, day, invoice_count, total_excl, total_tax, total_amount
+    )
+    SELECT
+        client_id, env, invoice_date,
+        {sign} * COUNT(*),
+        {sign} * COALESCE(SUM(total_excl), 0),
+        {sign} * COALESCE(SUM(total_tax), 0),
+        {sign} * COALESCE(SUM(total_amount), 0)
+    FROM invoices
+    WHERE {scope} AND status = 'Success' AND invoice_date IS NOT NULL
+    GROUP BY client_id, env, invoice_date
+    ON CONFLICT (client_id, env, day) DO UPDATE SET
+        invoice_count = r.invoice_count + EXCLUDED.invoice_count,
+        total_excl = r.total_excl + EXCLUDED.total_excl,
+        total_tax = r.total_tax + EXCLUDED.total_tax,
+        total_amount = r.total_amount + EXCLUDED.total_amount
+"""
+
+_PRODUCT_ROLLUP_SQL = """
+    INSERT INTO report_monthly_products AS r (
+        client_id, env, month, product_description, line_count, quantity, value_excl, tax, total
+    )
+    SELECT
+        client_id, env, month, product_description,
+        {sign} * COUNT(*),
+        {sign} * COALESCE(SUM(quantity), 0),
+        {sign} * COALESCE(SUM(value_excl), 0),
+        {sign} * COALESCE(SUM(tax), 0),
+        {sign} * COALESCE(SUM(total), 0)
+    FROM invoice_items
+    WHERE {scope} AND product_description IS NOT NULL
+    GROUP BY client_id, env, month, product_description
+    ON CONFLICT (client_id, env, month, product_description) DO UPDATE SET
+        line_count = r.line_count + EXCLUDED.line_count,
+        quantity = r.quantity + EXCLUDED.quantity,
+        value_excl = r.value_excl + EXCLUDED.value_excl,
+        tax = r.tax + EXCLUDED.tax,
+        total = r.total + EXCLUDED.total
+"""
+
+_BUYER_ROLLUP_SQL = """
+    INSERT INTO report_monthly_buyers AS r (
+        client_id, env, month, buyer_name, invoice_count, total_tax, total_amount
+    )
+    SELECT
+        client_id, env, TO_CHAR(created_at, 'YYYY-MM'), buyer_name,
+        {sign} * COUNT(*),
+        {sign} * COALESCE(SUM(total_tax), 0),
+        {sign} * COALESCE(SUM(total_amount), 0)
+    FROM invoices
+    WHERE {scope} AND status = 'Success' AND buyer_name IS NOT NULL
+    GROUP BY client_id, env, TO_CHAR(created_at, 'YYYY-MM'), buyer_name
+    ON CONFLICT (client_id, env, month, buyer_name) DO UPDATE SET
+        invoice_count = r.invoice_count + EXCLUDED.invoice_count,
+        total_tax = r.total_tax + EXCLUDED.total_tax,
+        total_amount = r.total_amount + EXCLUDED.total_amount
+"""
+
+# Rollup rows left empty once their last invoice is removed
+_PRUNE_ROLLUPS_SQL = (
+    """
+    DELETE FROM report_daily_totals
+    WHERE invoice_count <= 0
+      AND (client_id, env, day) IN (
+          SELECT client_id, env, invoice_date FROM invoices WHERE id IN %s
+      )
+    """,
+    """
+    DELETE FROM report_monthly_products
+    WHERE line_count <= 0
+      AND (client_id, env, month, product_description) IN (
+          SELECT client_id, env, month, product_description FROM invoice_items WHERE invoice_id IN %s
+      )
+    """,
+    """
+    DELETE FROM report_monthly_buyers
+    WHERE invoice_count <= 0
+      AND (client_id, env, month, buyer_name) IN (
+          SELECT client_id, env, TO_CHAR(created_at, 'YYYY-MM'), buyer_name FROM invoices WHERE id IN %s
+      )
+    """,
+)
+
+_ROLLUP_TABLES = ("report_daily_totals", "report_monthly_products", "report_monthly_buyers")
+
+
+def _apply_rollups(cur, invoice_ids, sign):
+    cur.execute(_DAILY_ROLLUP_SQL.format(sign=sign, scope="id IN %s"), (invoice_ids,))
+    cur.execute(_PRODUCT_ROLLUP_SQL.format(sign=sign, scope="invoice_id IN %s"), (invoice_ids,))
+    cur.execute(_BUYER_ROLLUP_SQL.format(sign=sign, scope="id IN %s"), (invoice_ids,))
+
+
+def rebuild_rollups(cur):
+    """Recompute every rollup table from invoices / invoice_items.
+
+    The tables stay locked against incremental updates until the caller
+    commits, so invoices stored meanwhile are counted exactly once.
+    """
+    cur.execute(f"LOCK TABLE {', '.join(_ROLLUP_TABLES)} IN EXCLUSIVE MODE")
+    for table in _ROLLUP_TABLES:
+        cur.execute(f"DELETE FROM {table}")
+    cur.execute(_DAILY_ROLLUP_SQL.format(sign=1, scope="TRUE"))
+    cur.execute(_PRODUCT_ROLLUP_SQL.format(sign=1, scope="TRUE"))
+    cur.execute(_BUYER_ROLLUP_SQL.format(sign=1, scope="TRUE"))
+
+
+def sync_invoices(cur, invoice_ids):
+    """(Re)build the reporting columns and invoice_items rows of *invoice_ids*.
+
+    Returns the number of item rows written.
+    """
+    invoice_ids = tuple(invoice_ids)
+    if not invoice_ids:
+        return 0
+    cur.execute(_SYNC_HEADERS_SQL, (invoice_ids,))
+    cur.execute("DELETE FROM invoice_items WHERE invoice_id IN %s", (invoice_ids,))
+    cur.execute(_SYNC_ITEMS_SQL, (invoice_ids,))
+    items_written = cur.rowcount
+    cur.execute(_SYNC_TOTALS_SQL, (invoice_ids,))
+    return items_written
+
+
+def record_invoice(cur, invoice_id):
+    """Fill in the reporting data of a just-inserted invoice inside the caller's transaction.
+
+    Runs under a savepoint so a reporting failure never loses the invoice
+    itself; the backfill command can repair it later.
+    """
+    cur.execute("SAVEPOINT invoice_reporting_sync")
+    try:
+        sync_invoices(cur, [invoice_id])
+        _apply_rollups(cur, (invoice_id,), 1)
+        cur.execute("RELEASE SAVEPOINT invoice_reporting_sync")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT invoice_reporting_sync")
+        logger.error("Error writing reporting data for invoice %s: %s", invoice_id, e)
+
+
+def remove_invoice(cur, invoice_id):
+    """Take an invoice out of the rollups; call in the transaction that deletes it."""
+    cur.execute("SAVEPOINT invoice_reporting_remove")
+    try:
+        invoice_ids = (invoice_id,)
+        _apply_rollups(cur, invoice_ids, -1)
+        for prune_sql in _PRUNE_ROLLUPS_SQL:
+            cur.execute(prune_sql, (invoice_ids,))
+        cur.execute("RELEASE SAVEPOINT invoice_reporting_remove")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT invoice_reporting_remove")
+        logger.error("Error removing invoice %s from report rollups: %s", invoice_id, e)
+
+
+def backfill_reporting(get_db_connection, batch_size=500):
+    """Rebuild the reporting data of every invoice, one batch per transaction, then the rollups."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    invoices_done = 0
+    items_written = 0
+    last_id = None
+    try:
+        while True:
+            if last_id is None:
+                cur.execute("SELECT id FROM invoices ORDER BY id LIMIT %s", (batch_size,))
+            else:
+                cur.execute(
+                    "SELECT id FROM invoices WHERE id > %s ORDER BY id LIMIT %s",
+                    (last_id, batch_size),
+                )
+            ids = [row[0] for row in cur.fetchall()]
+            if not ids:
+                break
+
+            items_written += sync_invoices(cur, ids)
+            conn.commit()
+            invoices_done += len(ids)
+            last_id = ids[-1]
+            logger.info("Reporting backfill: %s invoices, %s items", invoices_done, items_written)
+
+        rebuild_rollups(cur)
+        conn.commit()
+        logger.info("Reporting backfill: rollups rebuilt")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+    return invoices_done, items_written
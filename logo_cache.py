@@ -0,0 +1,179 @@
+"""
+Local disk cache for the logo images embedded in invoice PDFs.
+
+Templates keep pointing at client_logo_url / fbr_logo_url; the render
+processes pass url_fetcher() to WeasyPrint, which serves those images from
+LOGO_CACHE_DIR instead of downloading them on every render. Each logo is
+fetched once, resized/optimized with Pillow and stored under a hash of its URL
+next to a small JSON file holding the ETag. After LOGO_CACHE_TTL seconds the
+logo is revalidated with If-None-Match; a stale copy keeps being served if the
+logo host is down.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+import requests
+from PIL import Image
+from weasyprint import default_url_fetcher
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+CACHE_DIR = os.getenv("LOGO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "invoice_logo_cache"))
+CACHE_TTL = _env_int("LOGO_CACHE_TTL", 24 * 3600)
+FETCH_TIMEOUT = _env_int("LOGO_FETCH_TIMEOUT", 10)
+# Logos print at most ~160px wide; keep enough pixels for a sharp print
+MAX_DIMENSION = _env_int("LOGO_CACHE_MAX_PX", 600)
+
+_RASTER_FORMATS = {"PNG": "image/png", "JPEG": "image/jpeg", "GIF": "image/gif", "WEBP": "image/webp"}
+
+# url -> (checked_at, image path, mime type); avoids re-reading metadata per render
+_memo = {}
+_lock = threading.Lock()
+
+
+def _paths(url):
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.img"), os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def _write_atomic(path, payload):
+    # Several render processes may refresh the same logo at once
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def optimize_image(content, mime_type):
+    """Shrink a downloaded logo to MAX_DIMENSION and re-encode it compactly.
+
+    Returns (bytes, mime_type); anything Pillow cannot handle (e.g. SVG) is
+    returned unchanged.
+    """
+    try:
+        image = Image.open(BytesIO(content))
+        image_format = image.format
+        if image_format not in _RASTER_FORMATS:
+            return content, mime_type
+
+        image.thumbnail((MAX_DIMENSION, MAX_DIMENSION))
+        out = BytesIO()
+        if image_format == "JPEG":
+            image.convert("RGB").save(out, format="JPEG", quality=85, optimize=True)
+            out_mime = "image/jpeg"
+        else:
+            if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                image = image.convert("RGBA")
+            image.save(out, format="PNG", optimize=True)
+            out_mime = "image/png"
+
+        optimized = out.getvalue()
+        if len(optimized) >= len(content) and image_format in ("PNG", "JPEG"):
+            # Already small; keep the original encoding
+            return content, _RASTER_FORMATS[image_format]
+        return optimized, out_mime
+    except Exception as e:
+        logger.warning("Logo cache: could not optimize image (%s); storing original", e)
+        return content, mime_type
+
+
+def _download(url, meta):
+    """Fetch *url*, revalidating with the cached ETag.
+
+    Returns (meta, content), or None when the cached copy is still current.
+    """
+    headers = {}
+    if meta and meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+
+    response = requests.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+    if response.status_code == 304 and meta:
+        return None
+    response.raise_for_status()
+
+    mime_type = response.headers.get("Content-Type", "application/octet-stream").split(";")[0].strip()
+    content, mime_type = optimize_image(response.content, mime_type)
+    return {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "mime_type": mime_type,
+        "size": len(content),
+        "original_size": len(response.content),
+        "fetched_at": time.time(),
+    }, content
+
+
+def get_logo(url):
+    """Return (path, mime_type) of the cached copy of *url*, fetching it if needed."""
+    now = time.time()
+    memo = _memo.get(url)
+    if memo and now - memo[0] < CACHE_TTL:
+        return memo[1], memo[2]
+
+    with _lock:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        image_path, meta_path = _paths(url)
+        meta = _read_meta(meta_path) if os.path.exists(image_path) else None
+
+        if meta and now - meta.get("fetched_at", 0) < CACHE_TTL:
+            _memo[url] = (meta["fetched_at"], image_path, meta["mime_type"])
+            return image_path, meta["mime_type"]
+
+        try:
+            result = _download(url, meta)
+            if result is None:
+                meta["fetched_at"] = now
+            else:
+                meta, content = result
+                _write_atomic(image_path, content)
+                logger.info(
+                    "Logo cache: stored %s (%s -> %s bytes)", url, meta["original_size"], meta["size"]
+                )
+            _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        except Exception as e:
+            if not meta:
+                raise
+            # Logo host is slow or down: keep serving the stale copy for a while
+            logger.warning("Logo cache: refresh of %s failed (%s); serving cached copy", url, e)
+            meta["fetched_at"] = now - CACHE_TTL + min(CACHE_TTL, 300)
+
+        _memo[url] = (meta["fetched_at"], image_path, meta["mime_type"])
+        return image_path, meta["mime_type"]
+
+
+def url_fetcher(url, *args, **kwargs):
+    """WeasyPrint url_fetcher serving remote images from the local logo cache."""
+    if url.startswith(("http://", "https://")):
+        image_path, mime_type = get_logo(url)
+        with open(image_path, "rb") as f:
+            return {"string": f.read(), "mime_type": mime_type, "redirected_url": url}
+    return default_url_fetcher(url, *args, **kwargs)
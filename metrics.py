@@ -0,0 +1,148 @@
+"""
+Prometheus metrics for the invoicing service.
+
+Metrics are defined here and updated where the work happens: request latency
+per endpoint (init_app), FBR submission latency and outcomes (fbr_client and
+_submit_invoice_to_fbr), PDF render duration and size (pdf_renderer), Excel
+parse duration (excel_parser), report cache lookups (report_cache) and DB
+pool usage (refreshed after each request). GET /metrics exposes them, behind
+METRICS_TOKEN when that is set.
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by
+the workers: prometheus_client then keeps every worker's values in mmap'ed
+files there, /metrics aggregates all of them whichever worker answers, and
+gunicorn.conf.py cleans up after workers that exit. Without it, each process
+reports only its own values.
+"""
+import os
+import time
+
+from flask import Response, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+_ENVIRON_KEY = "erp.metrics_started"
+
+REQUEST_SECONDS = Histogram(
+    "erp_http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    ["method", "endpoint", "status"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+FBR_REQUEST_SECONDS = Histogram(
+    "erp_fbr_request_duration_seconds",
+    "Round-trip time of FBR API invoice submissions.",
+    ["env", "http_status"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 180),
+)
+FBR_SUBMISSIONS = Counter(
+    "erp_fbr_submissions_total",
+    "Invoice submissions to FBR by outcome (Success, Failed, timeout, connection_error).",
+    ["env", "http_status", "outcome"],
+)
+PDF_RENDER_SECONDS = Histogram(
+    "erp_pdf_render_duration_seconds",
+    "WeasyPrint render time per PDF.",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30),
+)
+PDF_SIZE_BYTES = Histogram(
+    "erp_pdf_size_bytes",
+    "Size of rendered invoice PDFs.",
+    buckets=(16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 5e6),
+)
+EXCEL_PARSE_SECONDS = Histogram(
+    "erp_excel_parse_duration_seconds",
+    "Time spent parsing uploaded workbooks (cache misses only).",
+    ["kind"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REPORT_CACHE_LOOKUPS = Counter(
+    "erp_report_cache_lookups_total",
+    "Report cache lookups; hit ratio = rate(result=\"hit\") / rate(all).",
+    ["result"],
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "erp_db_pool_connections",
+    "Database connections of the worker pools by state.",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+
+
+def observe_fbr_request(env, http_status, seconds):
+    FBR_REQUEST_SECONDS.labels(env, str(http_status)).observe(seconds)
+
+
+def count_fbr_submission(env, http_status, outcome):
+    FBR_SUBMISSIONS.labels(env, str(http_status), outcome).inc()
+
+
+def observe_pdf_render(seconds, size):
+    PDF_RENDER_SECONDS.observe(seconds)
+    PDF_SIZE_BYTES.observe(size)
+
+
+def observe_excel_parse(kind, seconds):
+    EXCEL_PARSE_SECONDS.labels(kind).observe(seconds)
+
+
+def count_report_cache_lookup(hit):
+    REPORT_CACHE_LOOKUPS.labels("hit" if hit else "miss").inc()
+
+
+_pool_stats = None
+
+
+def _update_pool_gauges():
+    stats = _pool_stats() if _pool_stats else None
+    if stats is None:
+        return
+    DB_POOL_CONNECTIONS.labels("in_use").set(stats["in_use"])
+    DB_POOL_CONNECTIONS.labels("idle").set(stats["idle"])
+    DB_POOL_CONNECTIONS.labels("open").set(stats["open"])
+
+
+def _registry():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def init_app(app, pool_stats=None):
+    """Time every request and serve GET /metrics; *pool_stats* returns db_pool.pool_stats()."""
+    global _pool_stats
+    _pool_stats = pool_stats
+
+    @app.before_request
+    def _start_metrics_timer():
+        request.environ[_ENVIRON_KEY] = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = request.environ.get(_ENVIRON_KEY)
+        if started is not None:
+            # The endpoint name, not the path, keeps label cardinality bounded
+            REQUEST_SECONDS.labels(
+                request.method, request.endpoint or "unmatched", str(response.status_code)
+            ).observe(time.perf_counter() - started)
+            _update_pool_gauges()
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def prometheus_metrics():
+        # Public route (no login); METRICS_TOKEN, when set, must come as a bearer token
+        token = os.getenv("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            return Response("Unauthorized\n", status=401, mimetype="text/plain")
+        _update_pool_gauges()
+        return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,15 @@
+-- SHA-256 of the rendered invoice HTML that produced invoices.pdf_data, so a stored PDF is
+-- only reused when the template output it was rendered from has not changed (see invoice_pdf.py)
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND table_name = 'invoices'
+          AND column_name = 'pdf_source_hash'
+    ) THEN
+        ALTER TABLE invoices
+            ADD COLUMN pdf_source_hash TEXT;
+    END IF;
+END $$;
@@ -0,0 +1,47 @@
+-- Background PDF rendering queue (see pdf_jobs.py). invoice_id / client_id copy the
+-- column types of invoices.id / clients.id so the table works with either serial or UUID keys.
+DO $$
+DECLARE
+    invoice_id_type TEXT;
+    client_id_type TEXT;
+BEGIN
+    SELECT format_type(a.atttypid, a.atttypmod) INTO invoice_id_type
+    FROM pg_attribute a
+    WHERE a.attrelid = 'public.invoices'::regclass AND a.attname = 'id';
+
+    SELECT format_type(a.atttypid, a.atttypmod) INTO client_id_type
+    FROM pg_attribute a
+    WHERE a.attrelid = 'public.invoices'::regclass AND a.attname = 'client_id';
+
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.tables
+        WHERE table_schema = 'public'
+          AND table_name = 'pdf_render_jobs'
+    ) THEN
+        EXECUTE format(
+            'CREATE TABLE pdf_render_jobs (
+                id TEXT PRIMARY KEY,
+                invoice_id %s REFERENCES invoices(id) ON DELETE CASCADE,
+                client_id %s NOT NULL,
+                env TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT ''queued'',
+                html TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )',
+            invoice_id_type,
+            client_id_type
+        );
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_pdf_render_jobs_pending
+    ON pdf_render_jobs (status, created_at)
+    WHERE status IN ('queued', 'running');
+
+CREATE INDEX IF NOT EXISTS idx_pdf_render_jobs_invoice
+    ON pdf_render_jobs (invoice_id);
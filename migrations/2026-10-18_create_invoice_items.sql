@@ -0,0 +1,57 @@
+-- One row per invoice line item, extracted from invoices.invoice_data when the invoice is
+-- stored (see invoice_reporting.py) so reports aggregate plain columns instead of expanding
+-- every invoice's JSON per request. Existing invoices: run `flask backfill-reporting`.
+DO $$
+DECLARE
+    invoice_id_type TEXT;
+    client_id_type TEXT;
+BEGIN
+    SELECT format_type(a.atttypid, a.atttypmod) INTO invoice_id_type
+    FROM pg_attribute a
+    WHERE a.attrelid = 'public.invoices'::regclass AND a.attname = 'id';
+
+    SELECT format_type(a.atttypid, a.atttypmod) INTO client_id_type
+    FROM pg_attribute a
+    WHERE a.attrelid = 'public.invoices'::regclass AND a.attname = 'client_id';
+
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.tables
+        WHERE table_schema = 'public'
+          AND table_name = 'invoice_items'
+    ) THEN
+        EXECUTE format(
+            'CREATE TABLE invoice_items (
+                id BIGSERIAL PRIMARY KEY,
+                invoice_id %s NOT NULL REFERENCES invoices(id) ON DELETE CASCADE,
+                client_id %s NOT NULL,
+                env TEXT NOT NULL,
+                line_no INTEGER NOT NULL,
+                product_description TEXT,
+                hs_code TEXT,
+                quantity NUMERIC,
+                value_excl NUMERIC,
+                tax NUMERIC,
+                total NUMERIC,
+                invoice_date DATE NOT NULL,
+                month TEXT NOT NULL,
+                buyer_name TEXT,
+                created_at TIMESTAMP NOT NULL
+            )',
+            invoice_id_type,
+            client_id_type
+        );
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice
+    ON invoice_items (invoice_id);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_items_client_date
+    ON invoice_items (client_id, env, invoice_date);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_items_client_product
+    ON invoice_items (client_id, env, product_description);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_items_client_buyer
+    ON invoice_items (client_id, env, buyer_name);
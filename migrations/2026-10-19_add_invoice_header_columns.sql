@@ -0,0 +1,47 @@
+-- Header fields reports filter, sort and search on, copied out of invoice_data / fbr_response
+-- when an invoice is stored (see invoice_reporting.py) so they can be indexed.
+-- Existing invoices: run `flask backfill-reporting`.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND table_name = 'invoices'
+          AND column_name = 'invoice_date'
+    ) THEN
+        ALTER TABLE invoices
+            ADD COLUMN invoice_date DATE,
+            ADD COLUMN buyer_name TEXT,
+            ADD COLUMN invoice_ref TEXT,
+            ADD COLUMN fbr_invoice_number TEXT,
+            ADD COLUMN total_excl NUMERIC,
+            ADD COLUMN total_tax NUMERIC,
+            ADD COLUMN total_amount NUMERIC;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_invoices_client_status_date
+    ON invoices (client_id, env, status, invoice_date);
+
+CREATE INDEX IF NOT EXISTS idx_invoices_client_status_created
+    ON invoices (client_id, env, status, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_invoices_client_status_buyer
+    ON invoices (client_id, env, status, buyer_name);
+
+-- Substring searches (LIKE '%...%') on buyer / reference need trigram indexes. pg_trgm may
+-- not be installable by the application role; the reports still work without it.
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS idx_invoices_buyer_name_trgm
+        ON invoices USING gin (LOWER(buyer_name) gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_invoices_invoice_ref_trgm
+        ON invoices USING gin (LOWER(invoice_ref) gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_invoices_fbr_invoice_number_trgm
+        ON invoices USING gin (LOWER(fbr_invoice_number) gin_trgm_ops);
+EXCEPTION
+    WHEN insufficient_privilege OR undefined_file THEN
+        RAISE NOTICE 'pg_trgm unavailable, skipping trigram indexes';
+END $$;
@@ -0,0 +1,58 @@
+-- Pre-aggregated report totals, kept current incrementally as invoices are stored and deleted
+-- (see invoice_reporting.py) so time-series and monthly-trend reports do not re-aggregate the
+-- whole history per page view. Existing data: run `flask backfill-reporting`.
+--   report_daily_totals      per invoice_date day
+--   report_monthly_products  per invoice_date month and product
+--   report_monthly_buyers    per created_at month and buyer (buyer analytics filters on created_at)
+DO $$
+DECLARE
+    client_id_type TEXT;
+BEGIN
+    SELECT format_type(a.atttypid, a.atttypmod) INTO client_id_type
+    FROM pg_attribute a
+    WHERE a.attrelid = 'public.invoices'::regclass AND a.attname = 'client_id';
+
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS report_daily_totals (
+            client_id %s NOT NULL,
+            env TEXT NOT NULL,
+            day DATE NOT NULL,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            total_excl NUMERIC NOT NULL DEFAULT 0,
+            total_tax NUMERIC NOT NULL DEFAULT 0,
+            total_amount NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (client_id, env, day)
+        )',
+        client_id_type
+    );
+
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS report_monthly_products (
+            client_id %s NOT NULL,
+            env TEXT NOT NULL,
+            month TEXT NOT NULL,
+            product_description TEXT NOT NULL,
+            line_count INTEGER NOT NULL DEFAULT 0,
+            quantity NUMERIC NOT NULL DEFAULT 0,
+            value_excl NUMERIC NOT NULL DEFAULT 0,
+            tax NUMERIC NOT NULL DEFAULT 0,
+            total NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (client_id, env, month, product_description)
+        )',
+        client_id_type
+    );
+
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS report_monthly_buyers (
+            client_id %s NOT NULL,
+            env TEXT NOT NULL,
+            month TEXT NOT NULL,
+            buyer_name TEXT NOT NULL,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            total_tax NUMERIC NOT NULL DEFAULT 0,
+            total_amount NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (client_id, env, month, buyer_name)
+        )',
+        client_id_type
+    );
+END $$;
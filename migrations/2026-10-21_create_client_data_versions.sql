@@ -0,0 +1,45 @@
+-- Per-client change counters behind the ETags of the invoice / draft listing APIs
+-- (see data_versions.py). Triggers bump a client's counter whenever one of its rows in
+-- invoices or invoice_drafts changes, so a poll only has to read one row to know whether
+-- anything it lists has changed.
+CREATE TABLE IF NOT EXISTS client_data_versions (
+    client_id TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (client_id, scope)
+);
+
+CREATE OR REPLACE FUNCTION bump_client_data_version() RETURNS trigger AS $$
+DECLARE
+    changed_client TEXT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed_client := OLD.client_id::text;
+    ELSE
+        changed_client := NEW.client_id::text;
+    END IF;
+
+    INSERT INTO client_data_versions (client_id, scope, version, updated_at)
+    VALUES (changed_client, TG_ARGV[0], 1, NOW())
+    ON CONFLICT (client_id, scope) DO UPDATE
+        SET version = client_data_versions.version + 1,
+            updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    DROP TRIGGER IF EXISTS invoices_bump_data_version ON invoices;
+    CREATE TRIGGER invoices_bump_data_version
+        AFTER INSERT OR UPDATE OR DELETE ON invoices
+        FOR EACH ROW EXECUTE PROCEDURE bump_client_data_version('invoices');
+
+    IF to_regclass('public.invoice_drafts') IS NOT NULL THEN
+        DROP TRIGGER IF EXISTS invoice_drafts_bump_data_version ON invoice_drafts;
+        CREATE TRIGGER invoice_drafts_bump_data_version
+            AFTER INSERT OR UPDATE OR DELETE ON invoice_drafts
+            FOR EACH ROW EXECUTE PROCEDURE bump_client_data_version('drafts');
+    END IF;
+END $$;
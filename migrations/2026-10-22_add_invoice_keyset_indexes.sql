@@ -0,0 +1,10 @@
+-- Indexes matching the (created_at, id) keyset pagination of /records (all statuses) and
+-- /api/reports/invoices (successful invoices), see pagination.py. The second one supersedes
+-- idx_invoices_client_status_created.
+CREATE INDEX IF NOT EXISTS idx_invoices_client_created_id
+    ON invoices (client_id, env, created_at, id);
+
+CREATE INDEX IF NOT EXISTS idx_invoices_client_status_created_id
+    ON invoices (client_id, env, status, created_at, id);
+
+DROP INDEX IF EXISTS idx_invoices_client_status_created;
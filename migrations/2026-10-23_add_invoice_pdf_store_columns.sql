@@ -0,0 +1,27 @@
+-- Invoice PDFs move out of invoices.pdf_data into the content-addressed store (pdf_store.py):
+-- the row keeps the SHA-256 of the PDF bytes and their size. Rows still holding pdf_data are
+-- served from it until `flask migrate-pdfs-to-store` moves them.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND table_name = 'invoices'
+          AND column_name = 'pdf_sha256'
+    ) THEN
+        ALTER TABLE invoices
+            ADD COLUMN pdf_sha256 TEXT;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND table_name = 'invoices'
+          AND column_name = 'pdf_size'
+    ) THEN
+        ALTER TABLE invoices
+            ADD COLUMN pdf_size BIGINT;
+    END IF;
+END $$;
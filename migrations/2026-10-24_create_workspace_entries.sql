@@ -0,0 +1,15 @@
+-- Per-session invoice workspace (see workspace_store.py): the uploaded workbook, built
+-- invoice JSON and parsed batch of each (client, env, session), shared by all workers.
+CREATE TABLE IF NOT EXISTS workspace_entries (
+    client_id TEXT NOT NULL,
+    env TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    value BYTEA NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (client_id, env, session_id, slot)
+);
+
+CREATE INDEX IF NOT EXISTS idx_workspace_entries_expires
+    ON workspace_entries (expires_at);
@@ -0,0 +1,21 @@
+-- One product per client and description (case-insensitive), the key the form
+-- invoice flow upserts products on (ON CONFLICT (client_id, LOWER(description))).
+-- Duplicates left by concurrent inserts are kept but deactivated and renamed first;
+-- the active (then oldest) row of each group keeps the description.
+WITH ranked AS (
+    SELECT id,
+           ROW_NUMBER() OVER (
+               PARTITION BY client_id, LOWER(description)
+               ORDER BY (is_active IS NOT FALSE) DESC, id
+           ) AS rn
+    FROM products
+    WHERE description IS NOT NULL
+)
+UPDATE products p
+SET description = p.description || ' (duplicate ' || p.id || ')',
+    is_active = FALSE
+FROM ranked r
+WHERE p.id = r.id AND r.rn > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_products_client_lower_description
+    ON products (client_id, LOWER(description));
@@ -0,0 +1,27 @@
+-- pdf_render_jobs retry bookkeeping (see pdf_jobs.py): heartbeat_at is refreshed while a
+-- worker is rendering, so the sweep only re-queues jobs whose worker has stopped; a failed
+-- job is not claimed again before next_attempt_at (exponential backoff).
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND table_name = 'pdf_render_jobs'
+          AND column_name = 'heartbeat_at'
+    ) THEN
+        ALTER TABLE pdf_render_jobs
+            ADD COLUMN heartbeat_at TIMESTAMP;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND table_name = 'pdf_render_jobs'
+          AND column_name = 'next_attempt_at'
+    ) THEN
+        ALTER TABLE pdf_render_jobs
+            ADD COLUMN next_attempt_at TIMESTAMP;
+    END IF;
+END $$;
@@ -0,0 +1,55 @@
+"""
+Keyset (cursor) pagination for the invoice listings.
+
+LIMIT/OFFSET makes Postgres walk and discard every earlier row, so deep pages
+of /records and /api/reports/invoices got slower as a client's history grew,
+and the COUNT(*) beside them scanned everything again. A cursor instead
+encodes the (created_at, id) of the last row served; the next page continues
+with a row-value comparison that an index on (..., created_at, id) answers
+directly. Totals are optional: exact, a planner estimate, or none.
+"""
+import base64
+import json
+from datetime import datetime
+
+COUNT_MODES = ("exact", "approx", "none")
+
+
+def encode_cursor(created_at, row_id, position):
+    """Opaque cursor for the row after (created_at, row_id); *position* rows were served."""
+    payload = json.dumps({"c": created_at.isoformat(), "i": str(row_id), "n": position})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id, position) from encode_cursor(); ValueError if malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(payload["c"]), payload["i"], int(payload.get("n", 0))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def keyset_condition(sort_order):
+    """WHERE fragment continuing a (created_at, id) ordering after the cursor row."""
+    return "(created_at, id) < (%s, %s)" if sort_order == "DESC" else "(created_at, id) > (%s, %s)"
+
+
+def estimate_count(cur, from_where, params):
+    """Planner's row estimate for ``SELECT ... {from_where}``; no rows are read."""
+    cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 {from_where}", params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_rows(cur, from_where, params, mode):
+    """Total for a listing according to *mode* (see COUNT_MODES); None for "none"."""
+    if mode == "none":
+        return None
+    if mode == "approx":
+        return estimate_count(cur, from_where, params)
+    cur.execute(f"SELECT COUNT(*) {from_where}", params)
+    return cur.fetchone()[0]
@@ -0,0 +1,59 @@
+"""
+Status and download endpoints for background PDF render jobs
+"""
+from flask import jsonify, session, url_for
+
+import invoice_pdf
+import pdf_jobs
+
+
+def add_pdf_job_routes(app, get_db_connection):
+    @app.route("/api/pdf-jobs/<job_id>", methods=["GET"])
+    def get_pdf_job_status(job_id):
+        """Poll the state of a render job: queued, running, done or failed."""
+        client_id = session.get("client_id")
+        if not client_id:
+            return jsonify({"error": "No client ID in session"}), 401
+
+        job = pdf_jobs.get_queue().get_job(job_id, client_id)
+        if not job:
+            return jsonify({"error": "PDF job not found"}), 404
+
+        if job["status"] == pdf_jobs.JOB_DONE and job["invoice_id"]:
+            job["download_url"] = url_for("download_pdf_job", job_id=job_id)
+        return jsonify(job)
+
+    @app.route("/api/pdf-jobs/<job_id>/download", methods=["GET"])
+    def download_pdf_job(job_id):
+        client_id = session.get("client_id")
+        if not client_id:
+            return jsonify({"error": "No client ID in session"}), 401
+
+        job = pdf_jobs.get_queue().get_job(job_id, client_id)
+        if not job:
+            return jsonify({"error": "PDF job not found"}), 404
+        if job["status"] == pdf_jobs.JOB_FAILED:
+            # A handled outcome, not a server error: the job carries its error
+            return jsonify(job), 409
+        if job["status"] != pdf_jobs.JOB_DONE:
+            # Not ready yet: tell the caller to keep polling
+            return jsonify(job), 202
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT pdf_sha256, CASE WHEN pdf_sha256 IS NULL THEN pdf_data END
+            FROM invoices
+            WHERE id = %s AND client_id = %s AND {invoice_pdf.HAS_PDF_SQL}
+            """,
+            (job["invoice_id"], client_id),
+        )
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+
+        if not row:
+            return jsonify({"error": "Invoice PDF not found"}), 404
+
+        return invoice_pdf.send_invoice_pdf(row[0], row[1], "invoice.pdf")
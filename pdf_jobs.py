@@ -0,0 +1,361 @@
+"""
+Background PDF rendering queue.
+
+Requests render the invoice HTML (cheap) and enqueue it here; a small pool of
+worker threads passes it to the render processes (pdf_renderer.py) outside the
+request and stores the result with invoice_pdf.store_invoice_pdf(). Job state
+lives in the pdf_render_jobs table so any gunicorn worker can answer status
+polls. While a render runs its worker refreshes heartbeat_at; jobs whose
+heartbeat stopped (the worker died) are picked up again by the periodic sweep.
+Failed attempts are retried after an exponential backoff (next_attempt_at) and
+marked failed after max_attempts.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import invoice_pdf
+import pdf_renderer
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+_MARK_DONE_SQL = """
+    UPDATE pdf_render_jobs
+    SET status = %s, error = NULL, html = NULL, finished_at = NOW()
+    WHERE id = %s
+"""
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class PDFJobQueue:
+    def __init__(
+        self,
+        get_db_connection,
+        workers=2,
+        max_attempts=3,
+        stale_after=300,
+        sweep_interval=60,
+        retry_backoff=30,
+    ):
+        self.get_db_connection = get_db_connection
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.stale_after = stale_after
+        self.sweep_interval = sweep_interval
+        self.retry_backoff = max(0, retry_backoff)
+        # Refresh the heartbeat well within stale_after so a slow render is
+        # never mistaken for one whose worker died
+        self.heartbeat_interval = max(1.0, stale_after / 3)
+
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def _get_executor(self):
+        # Threads do not survive fork(), so each gunicorn worker gets its own pool
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="pdf-job"
+                    )
+                    self._executor_pid = pid
+        return self._executor
+
+    # ---------------- producer side ----------------
+    def enqueue(self, invoice_id, client_id, env, rendered_html):
+        """Persist a render job for *invoice_id* and hand it to a local worker."""
+        job_id = uuid.uuid4().hex
+        conn = self.get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                INSERT INTO pdf_render_jobs (id, invoice_id, client_id, env, status, html, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, NOW())
+                """,
+                (job_id, invoice_id, client_id, env, JOB_QUEUED, rendered_html),
+            )
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+        self._get_executor().submit(self._run_job, job_id)
+        self.sweep()
+        return job_id
+
+    def get_job(self, job_id, client_id):
+        conn = self.get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                SELECT id, invoice_id, env, status, error, attempts, created_at, started_at, finished_at
+                FROM pdf_render_jobs
+                WHERE id = %s AND client_id = %s
+                """,
+                (job_id, client_id),
+            )
+            row = cur.fetchone()
+        finally:
+            cur.close()
+            conn.close()
+
+        if not row:
+            return None
+
+        self.sweep()
+        (job_id, invoice_id, env, status, error, attempts, created_at, started_at, finished_at) = row
+        return {
+            "job_id": job_id,
+            "invoice_id": str(invoice_id) if invoice_id is not None else None,
+            "env": env,
+            "status": status,
+            "error": error,
+            "attempts": attempts,
+            "created_at": created_at.isoformat() if created_at else None,
+            "started_at": started_at.isoformat() if started_at else None,
+            "finished_at": finished_at.isoformat() if finished_at else None,
+        }
+
+    # ---------------- consumer side ----------------
+    def _execute(self, query, params, fetch=False):
+        conn = self.get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(query, params)
+            row = cur.fetchone() if fetch else None
+            conn.commit()
+            return row
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def _already_rendered(self, invoice_id, source_hash):
+        conn = self.get_db_connection()
+        cur = conn.cursor()
+        try:
+            return invoice_pdf.has_cached_pdf(cur, invoice_id, source_hash)
+        finally:
+            cur.close()
+            conn.close()
+
+    def _mark_done(self, job_id):
+        self._execute(_MARK_DONE_SQL, (JOB_DONE, job_id))
+
+    def _retry_delay(self, attempts):
+        """Seconds to wait before attempt number *attempts* + 1."""
+        return self.retry_backoff * (2 ** max(0, attempts - 1))
+
+    def _submit_later(self, job_id, delay):
+        if delay <= 0:
+            self._get_executor().submit(self._run_job, job_id)
+            return
+        timer = threading.Timer(delay, lambda: self._get_executor().submit(self._run_job, job_id))
+        timer.daemon = True
+        timer.start()
+
+    def _heartbeat(self, job_id, stop):
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                self._execute(
+                    "UPDATE pdf_render_jobs SET heartbeat_at = NOW() WHERE id = %s AND status = %s",
+                    (job_id, JOB_RUNNING),
+                )
+            except Exception as e:
+                logger.warning("PDF job %s: heartbeat failed: %s", job_id, e)
+
+    def _run_job(self, job_id):
+        try:
+            # Hold a pooled connection only around the short claim/store
+            # statements, never across the (slow) render itself.
+            claimed = self._execute(
+                """
+                UPDATE pdf_render_jobs
+                SET status = %s, started_at = NOW(), heartbeat_at = NOW(),
+                    next_attempt_at = NULL, attempts = attempts + 1
+                WHERE id = %s AND status = %s
+                  AND (next_attempt_at IS NULL OR next_attempt_at <= NOW())
+                RETURNING invoice_id, html, attempts
+                """,
+                (JOB_RUNNING, job_id, JOB_QUEUED),
+                fetch=True,
+            )
+            if not claimed:
+                # Another worker already took it, it was finished meanwhile,
+                # or its retry backoff has not elapsed yet (the sweep gets it)
+                return
+
+            invoice_id, rendered_html, attempts = claimed
+            source_hash = invoice_pdf.html_content_hash(rendered_html)
+            if invoice_id is not None and self._already_rendered(invoice_id, source_hash):
+                # A download endpoint rendered the same HTML first
+                self._mark_done(job_id)
+                return
+
+            started = time.monotonic()
+            stop_heartbeat = threading.Event()
+            threading.Thread(
+                target=self._heartbeat,
+                args=(job_id, stop_heartbeat),
+                name=f"pdf-job-heartbeat-{job_id[:8]}",
+                daemon=True,
+            ).start()
+            try:
+                pdf_binary = pdf_renderer.render_pdf(rendered_html)
+            except Exception as render_error:
+                logger.exception("PDF job %s failed to render (attempt %s)", job_id, attempts)
+                next_status = JOB_QUEUED if attempts < self.max_attempts else JOB_FAILED
+                delay = self._retry_delay(attempts)
+                self._execute(
+                    """
+                    UPDATE pdf_render_jobs
+                    SET status = %s, error = %s,
+                        next_attempt_at = CASE WHEN %s = 'queued'
+                            THEN NOW() + (%s * INTERVAL '1 second') ELSE NULL END,
+                        finished_at = CASE WHEN %s = 'failed' THEN NOW() ELSE NULL END
+                    WHERE id = %s
+                    """,
+                    (next_status, str(render_error)[:1000], next_status, delay, next_status, job_id),
+                )
+                if next_status == JOB_QUEUED:
+                    self._submit_later(job_id, delay)
+                return
+            finally:
+                stop_heartbeat.set()
+
+            conn = self.get_db_connection()
+            cur = conn.cursor()
+            try:
+                if invoice_id is not None:
+                    invoice_pdf.store_invoice_pdf(cur, invoice_id, pdf_binary, source_hash)
+                cur.execute(_MARK_DONE_SQL, (JOB_DONE, job_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+                conn.close()
+
+            logger.info(
+                "PDF job %s rendered %s bytes for invoice %s",
+                job_id,
+                len(pdf_binary),
+                invoice_id,
+                extra={"duration_ms": round((time.monotonic() - started) * 1000, 1)},
+            )
+        except Exception as e:
+            logger.exception("Error running PDF job %s: %s", job_id, e)
+
+    def sweep(self, force=False):
+        """Re-dispatch jobs left queued or stuck running by a worker that died.
+
+        A running job counts as stuck once its heartbeat is older than
+        stale_after; it is re-queued with the retry backoff, or marked failed
+        when it has used up max_attempts. Dispatching the same job from several
+        workers is harmless: the claim only lets one of them move it from
+        queued to running.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_sweep < self.sweep_interval:
+            return 0
+        self._last_sweep = now
+
+        conn = None
+        cur = None
+        try:
+            conn = self.get_db_connection()
+            cur = conn.cursor()
+            cur.execute(
+                """
+                UPDATE pdf_render_jobs
+                SET status = CASE WHEN attempts >= %(max_attempts)s THEN %(failed)s ELSE %(queued)s END,
+                    error = CASE WHEN attempts >= %(max_attempts)s
+                        THEN 'Render did not finish (worker stopped responding)' ELSE error END,
+                    finished_at = CASE WHEN attempts >= %(max_attempts)s THEN NOW() ELSE NULL END,
+                    next_attempt_at = CASE WHEN attempts >= %(max_attempts)s THEN NULL
+                        ELSE NOW() + (%(backoff)s * POWER(2, GREATEST(attempts - 1, 0)) * INTERVAL '1 second')
+                    END
+                WHERE status = %(running)s
+                  AND COALESCE(heartbeat_at, started_at) < NOW() - (%(stale_after)s * INTERVAL '1 second')
+                """,
+                {
+                    "max_attempts": self.max_attempts,
+                    "failed": JOB_FAILED,
+                    "queued": JOB_QUEUED,
+                    "backoff": self.retry_backoff,
+                    "running": JOB_RUNNING,
+                    "stale_after": self.stale_after,
+                },
+            )
+            cur.execute(
+                """
+                SELECT id FROM pdf_render_jobs
+                WHERE status = %s AND created_at < NOW() - INTERVAL '30 seconds'
+                  AND (next_attempt_at IS NULL OR next_attempt_at <= NOW())
+                ORDER BY created_at
+                LIMIT 50
+                """,
+                (JOB_QUEUED,),
+            )
+            job_ids = [r[0] for r in cur.fetchall()]
+            conn.commit()
+        except Exception as e:
+            logger.error("Error sweeping PDF jobs: %s", e)
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            return 0
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+
+        executor = self._get_executor()
+        for job_id in job_ids:
+            executor.submit(self._run_job, job_id)
+        return len(job_ids)
+
+
+_queue = None
+
+
+def init_queue(get_db_connection):
+    global _queue
+    _queue = PDFJobQueue(
+        get_db_connection,
+        workers=_env_int("PDF_JOB_WORKERS", 2),
+        max_attempts=_env_int("PDF_JOB_MAX_ATTEMPTS", 3),
+        stale_after=_env_int("PDF_JOB_STALE_SECONDS", 300),
+        sweep_interval=_env_int("PDF_JOB_SWEEP_INTERVAL", 60),
+        retry_backoff=_env_int("PDF_JOB_RETRY_BACKOFF", 30),
+    )
+    return _queue
+
+
+def get_queue():
+    return _queue
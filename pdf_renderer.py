@@ -0,0 +1,188 @@
+"""
+Process pool for WeasyPrint renders.
+
+A cold WeasyPrint render pays for font discovery and for parsing the invoice
+templates' <style> blocks, and HTML(string=...) parses that CSS again on every
+call. Render processes here are warmed once at start-up and keep a
+FontConfiguration plus the parsed stylesheets (keyed by a hash of the CSS text)
+for their whole life, so repeat renders of the same template only lay out the
+document. Remote images (client and FBR logos) are served from the local
+logo cache (logo_cache.py). Callers pass rendered HTML (render_pdf) or a
+template name and context (render_template_pdf) and get PDF bytes back.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+import logo_cache
+import metrics
+import request_timing
+
+logger = logging.getLogger(__name__)
+
+# Only bare <style> blocks are split out; ones with media/other attributes stay inline
+_STYLE_BLOCK = re.compile(r"<style>(.*?)</style>", re.IGNORECASE | re.DOTALL)
+
+_WARMUP_HTML = (
+    "<html><head><style>body { font-family: Arial, sans-serif; font-size: 12px; }"
+    "</style></head><body><p>Warm-up <b>bold</b> <i>italic</i> 0123456789</p></body></html>"
+)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# ---------------- per-process render state ----------------
+_font_config = None
+_stylesheets = {}
+_stylesheet_limit = 32
+
+
+def _get_font_config():
+    global _font_config
+    if _font_config is None:
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def _get_stylesheet(css_text):
+    key = hashlib.sha256(css_text.encode("utf-8")).hexdigest()
+    sheet = _stylesheets.get(key)
+    if sheet is None:
+        if len(_stylesheets) >= _stylesheet_limit:
+            _stylesheets.pop(next(iter(_stylesheets)))
+        sheet = CSS(
+            string=css_text,
+            font_config=_get_font_config(),
+            url_fetcher=logo_cache.url_fetcher,
+        )
+        _stylesheets[key] = sheet
+    return sheet
+
+
+def _render_in_process(rendered_html):
+    font_config = _get_font_config()
+    stylesheets = [_get_stylesheet(css) for css in _STYLE_BLOCK.findall(rendered_html)]
+    body_html = _STYLE_BLOCK.sub("", rendered_html) if stylesheets else rendered_html
+
+    pdf_stream = BytesIO()
+    HTML(string=body_html, url_fetcher=logo_cache.url_fetcher).write_pdf(
+        pdf_stream, stylesheets=stylesheets, font_config=font_config
+    )
+    return pdf_stream.getvalue()
+
+
+def _warm_worker(stylesheet_limit):
+    global _stylesheet_limit
+    _stylesheet_limit = stylesheet_limit
+    try:
+        _render_in_process(_WARMUP_HTML)
+    except Exception:
+        # A failed warm-up only costs the first real render its speed-up
+        logger.exception("PDF render process warm-up failed")
+
+
+# ---------------- pool owned by each app process ----------------
+class PDFRenderer:
+    def __init__(self, processes=2, stylesheet_limit=32, start_method="forkserver"):
+        self.processes = max(0, processes)
+        self.stylesheet_limit = max(1, stylesheet_limit)
+        # Never fork() the multi-threaded app process (DB pool, job threads,
+        # open sockets): render processes start from a clean interpreter
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = "spawn"
+        self.start_method = start_method
+
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Pools do not survive fork(), so each gunicorn worker starts its own
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        mp_context=multiprocessing.get_context(self.start_method),
+                        initializer=_warm_worker,
+                        initargs=(self.stylesheet_limit,),
+                    )
+                    self._executor_pid = pid
+        return self._executor
+
+    def _reset_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def warm(self):
+        """Start the render processes now rather than on the first render."""
+        if self.processes:
+            executor = self._get_executor()
+            for _ in range(self.processes):
+                executor.submit(len, "")
+
+    def render(self, rendered_html):
+        if not self.processes:
+            global _stylesheet_limit
+            _stylesheet_limit = self.stylesheet_limit
+            return _render_in_process(rendered_html)
+
+        executor = self._get_executor()
+        try:
+            return executor.submit(_render_in_process, rendered_html).result()
+        except BrokenProcessPool:
+            # A render process died (e.g. OOM-killed); start a fresh pool and retry once
+            logger.warning("PDF render pool broke; restarting it")
+            self._reset_executor(executor)
+            return self._get_executor().submit(_render_in_process, rendered_html).result()
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = PDFRenderer(
+                    processes=_env_int("PDF_RENDER_PROCESSES", 2),
+                    stylesheet_limit=_env_int("PDF_RENDER_STYLESHEET_CACHE", 32),
+                    start_method=os.getenv("PDF_RENDER_START_METHOD", "forkserver"),
+                )
+    return _renderer
+
+
+def render_pdf(rendered_html):
+    """Render an HTML document to PDF bytes in a warm render process."""
+    started = time.perf_counter()
+    with request_timing.phase("pdf"):
+        pdf_binary = get_renderer().render(rendered_html)
+    metrics.observe_pdf_render(time.perf_counter() - started, len(pdf_binary))
+    return pdf_binary
+
+
+def render_template_pdf(template_name, **context):
+    """Render a Jinja template (in the caller's app context) to PDF bytes."""
+    from flask import render_template
+
+    return render_pdf(render_template(template_name, **context))
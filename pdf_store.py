@@ -0,0 +1,132 @@
+"""
+Content-addressed storage for invoice PDFs.
+
+PDF bytes used to live in invoices.pdf_data, bloating the hot invoices table and
+its TOAST, and every download pulled the whole blob through psycopg2. The
+invoices row now only keeps pdf_sha256 / pdf_size; the bytes live in a store
+keyed by their SHA-256, so identical PDFs are stored once and a stored file
+never changes.
+
+The default backend is a local directory (PDF_STORE_DIR, sharded as
+ab/cd/<sha256>.pdf) whose files are served with send_file, i.e. zero-copy
+sendfile under gunicorn plus conditional / Range requests. Other backends can
+be plugged in with register_backend() and selected with PDF_STORE_BACKEND; a
+backend without local paths is served from its open() file object instead.
+
+LocalPDFStore only sees its own filesystem: when the app runs on several
+nodes (or containers), PDF_STORE_DIR must be a volume they all mount, or a PDF
+written by one node is missing on the others.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+from flask import send_file
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdf_store")
+
+
+class LocalPDFStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], f"{sha256}.pdf")
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    def put(self, sha256, data):
+        target = self.path(sha256)
+        if os.path.exists(target):
+            # Same hash, same bytes: nothing to write
+            return
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, target)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def open(self, sha256):
+        return open(self.path(sha256), "rb")
+
+    def delete(self, sha256):
+        try:
+            os.unlink(self.path(sha256))
+        except FileNotFoundError:
+            pass
+
+
+_backends = {
+    "local": lambda: LocalPDFStore(os.getenv("PDF_STORE_DIR", DEFAULT_DIR)),
+}
+_store = None
+_store_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    """Make *factory* (no arguments, returns a store) selectable as PDF_STORE_BACKEND=name.
+
+    A store implements exists(sha256), put(sha256, data), open(sha256) and
+    delete(sha256); path(sha256) is optional and enables sendfile.
+    """
+    _backends[name] = factory
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = os.getenv("PDF_STORE_BACKEND", "local")
+                if backend not in _backends:
+                    raise ValueError(f"Unknown PDF_STORE_BACKEND: {backend}")
+                _store = _backends[backend]()
+    return _store
+
+
+def put_pdf(pdf_binary):
+    """Store *pdf_binary*; returns (sha256, size) for the invoices row."""
+    sha256 = hashlib.sha256(pdf_binary).hexdigest()
+    get_store().put(sha256, pdf_binary)
+    return sha256, len(pdf_binary)
+
+
+def read_pdf(sha256):
+    with get_store().open(sha256) as f:
+        return f.read()
+
+
+def send_pdf(sha256, download_name, as_attachment=True):
+    """Flask response for a stored PDF, honouring If-None-Match and Range headers.
+
+    Raises FileNotFoundError when the store does not have *sha256*.
+    """
+    store = get_store()
+    path = store.path(sha256) if hasattr(store, "path") else None
+    if path and not os.path.exists(path):
+        raise FileNotFoundError(path)
+    source = path if path else store.open(sha256)
+    response = send_file(
+        source,
+        mimetype="application/pdf",
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=True,
+        etag=sha256,
+        max_age=0,
+    )
+    # Stored files never change, so the content hash is a stable validator
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
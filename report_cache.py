@@ -0,0 +1,167 @@
+"""
+Response cache for the /api/reports/* JSON endpoints.
+
+The dashboard and analytics endpoints run heavy aggregate SQL, while users
+mostly refresh reports.html without anything having changed. cached_report()
+keeps recent responses per (client_id, env, path, query args, data version) in
+an LRU bounded by REPORT_CACHE_SIZE entries, each valid for REPORT_CACHE_TTL
+seconds.
+
+The data version is the client's change counter in client_data_versions
+(data_versions.py), bumped by database triggers on every write to invoices,
+including stored PDFs. Each lookup reads that one row, so an entry is never
+served after the data changed, whichever worker (or script) made the change;
+entries of older versions are simply no longer looked up and age out of the LRU.
+"""
+import functools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, make_response, request, session
+
+import data_versions
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class ReportCache:
+    def __init__(self, max_entries=256, ttl=300):
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result["entries"] = len(self._entries)
+        lookups = result["hits"] + result["misses"]
+        result["hit_ratio"] = round(result["hits"] / lookups, 3) if lookups else None
+        result["max_entries"] = self.max_entries
+        result["ttl_seconds"] = self.ttl
+        result["pid"] = os.getpid()
+        return result
+
+
+_cache = ReportCache(
+    max_entries=_env_int("REPORT_CACHE_SIZE", 256),
+    ttl=_env_int("REPORT_CACHE_TTL", 300),
+)
+
+
+def get_cache():
+    return _cache
+
+
+def _request_key(env, data_version):
+    # Query args are normalized so ?a=1&b=2 and ?b=2&a=1 share an entry
+    args = tuple(sorted(request.args.items(multi=True)))
+    return (str(session.get("client_id")), env, request.path, args, data_version)
+
+
+def _data_version(get_db_connection, scope):
+    # Under data_versions.conditional_get the version was read already; reuse
+    # it so the body always matches the ETag sent with it
+    if g.get("data_version") and g.data_version[0] == scope:
+        return g.data_version
+    return (scope, data_versions.get_version(get_db_connection, session.get("client_id"), scope))
+
+
+def cached_report(get_db_connection, scope="invoices", env="production"):
+    """Cache a report view's successful JSON responses for the session's client.
+
+    Entries are keyed by the client's *scope* data version, so any write to
+    the client's data makes the next request miss. *env* is the environment
+    the view reads: a fixed name, or a callable (e.g. get_env) for views that
+    resolve it from the request, headers included. Responses that are not 200
+    JSON, or whose body carries an "error" key, are passed through uncached,
+    as is every request while the version cannot be read.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not session.get("client_id") or not _cache.max_entries:
+                return view(*args, **kwargs)
+
+            try:
+                data_version = _data_version(get_db_connection, scope)
+            except Exception as e:
+                logger.warning("Error reading %s data version, skipping report cache: %s", scope, e)
+                return view(*args, **kwargs)
+
+            key = _request_key(env() if callable(env) else env, data_version)
+            cached = _cache.get(key)
+            metrics.count_report_cache_lookup(cached is not None)
+            if cached is not None:
+                body, mimetype = cached
+                response = make_response(body)
+                response.mimetype = mimetype
+                response.headers["X-Report-Cache"] = "HIT"
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and response.is_json:
+                payload = response.get_json(silent=True)
+                if not (isinstance(payload, dict) and "error" in payload):
+                    _cache.put(key, (response.get_data(), response.mimetype))
+            response.headers["X-Report-Cache"] = "MISS"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def stats():
+    return _cache.stats()
@@ -1,21 +1,58 @@
 """
 Routes for reports and analytics functionality
 """
-from flask import request, jsonify, session, render_template, url_for, redirect, send_file
+from flask import request, jsonify, session, render_template, url_for, redirect, Response
+import io
 import json
+import logging
+import uuid
+import time
 from datetime import datetime, timedelta
 import calendar
 from dateutil.relativedelta import relativedelta
 import pandas as pd  # Add this import
-from io import BytesIO
 import zipfile
+import data_versions
+import invoice_pdf
+import pagination
+import report_cache
+
+logger = logging.getLogger(__name__)
+
+
+# Rows fetched per round trip when streaming bulk ZIP downloads
+BULK_ZIP_FETCH_SIZE = 10
+
+
+class ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink for zipfile.ZipFile; take() drains what was written.
+
+    ZipFile falls back to data descriptors on unseekable output, so entries
+    can be sent on as soon as they are written.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
 
 
 def add_reports_routes(app, get_db_connection, get_env):
     def check_url_format():
         if "?" in request.query_string.decode("utf-8"):
-            print(
-                f"Warning: Found invalid URL parameter format: {request.query_string.decode('utf-8')}"
+            logger.warning(
+                "Found invalid URL parameter format: %s", request.query_string.decode("utf-8")
             )
     
     # Small helper to safely convert values to float (coalesce None/invalid to 0.0)
@@ -26,6 +63,36 @@ def add_reports_routes(app, get_db_connection, get_env):
             return float(v)
         except Exception:
             return 0.0
+
+    def monthly_rollup_condition(start_date, end_date):
+        """Month filter for the report_monthly_* rollups, or None if they cannot answer.
+
+        Monthly rollups only cover whole months: the range must start on the 1st
+        and end on a month's last day, or today for the running month (rollups
+        are updated as invoices are stored, so they are current up to now).
+        Returns (condition, params); other ranges must read the raw rows.
+        """
+        if not (start_date and end_date):
+            return "", []
+        try:
+            start = datetime.strptime(start_date, "%Y-%m-%d").date()
+            end = datetime.strptime(end_date, "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            return None
+        today = datetime.now().date()
+        month_end = end.day == calendar.monthrange(end.year, end.month)[1]
+        running_month = (end.year, end.month) == (today.year, today.month) and end >= today
+        if start.day != 1 or not (month_end or running_month):
+            return None
+        return "AND month BETWEEN %s AND %s", [start.strftime("%Y-%m"), end.strftime("%Y-%m")]
+
+    @app.route("/api/reports/cache-stats", methods=["GET"])
+    def get_report_cache_stats():
+        """Hit/miss counters of this worker's report response cache"""
+        if not session.get("client_id"):
+            return jsonify({"error": "No client ID in session"}), 401
+        return jsonify(report_cache.stats())
+
     @app.route("/reports.html")
     def reports_html():
         if "user_id" not in session:
@@ -33,15 +100,15 @@ def add_reports_routes(app, get_db_connection, get_env):
         return render_template("reports.html")
 
     @app.route("/api/reports/dashboard", methods=["GET"])
+    @report_cache.cached_report(get_db_connection)
     def get_dashboard_data():
         """Get summary data for the dashboard"""
         # Check URL format
         raw_query = request.query_string.decode("utf-8")
         if "?" in raw_query:
-            print(f"Warning: Found invalid URL parameter format: {raw_query}")
             # Fix the query string by replacing ? with &
             fixed_query = raw_query.replace("?", "&")
-            print(f"Fixed to: {fixed_query}")
+            logger.warning("Found invalid URL parameter format: %s (fixed to %s)", raw_query, fixed_query)
         
         client_id = session.get("client_id")
         if not client_id:
@@ -84,18 +151,19 @@ def add_reports_routes(app, get_db_connection, get_env):
                     400,
                 )
 
-        conn = get_db_connection()
-        cur = conn.cursor()
+        # Daily buckets for short ranges, monthly for the year / all-time views
+        if period in ("year", "all"):
+            date_trunc = "month"
+            format_string = "%Y-%m"
+        else:
+            date_trunc = "day"
+            format_string = "%Y-%m-%d"
 
-        # Common date filter condition
-        date_condition = ""
         params = [client_id, env]
-
         if start_date and end_date:
-            date_condition = "AND COALESCE((invoice_data::jsonb->>'invoiceDate')::date, DATE(created_at)) BETWEEN %s AND %s"
             params.extend([start_date, end_date])
 
-        # Initialize defaults so response can be built even if some queries fail
+        # Initialize defaults so response can be built even if the query fails
         total_invoices = 0
         total_sales = 0.0
         total_tax = 0.0
@@ -104,449 +172,192 @@ def add_reports_routes(app, get_db_connection, get_env):
         time_series_data = []
         top_products = []
         top_buyers = []
+        timings = {}
 
-        try:
-            # Get total successful invoices - count invoices
-            cur.execute(
-                f"""
-                SELECT COUNT(*) 
-                FROM invoices 
-                WHERE client_id = %s 
-                AND env = %s 
-                AND status = 'Success'
-                {date_condition}
-                """,
-                params,
-            )
-            total_invoices = cur.fetchone()[0] or 0
-
-            # Get total sales value (sum of all invoice totals)
-            cur.execute(
-                f"""
-                WITH extracted_values AS (
-                    SELECT 
-                        jsonb_array_elements_text(
-                            CASE 
-                                WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                                    CASE 
-                                        WHEN invoice_data::jsonb ? 'items' THEN 
-                                            jsonb_path_query_array(invoice_data::jsonb->'items', '$[*].totalValues')
-                                        ELSE 
-                                            '[]'::jsonb 
-                                    END
-                                ELSE 
-                                    '[]'::jsonb 
-                            END
-                        )::numeric AS val
-                    FROM invoices 
-                    WHERE client_id = %s 
-                    AND env = %s 
-                    AND status = 'Success'
-                    {date_condition}
-                )
-                SELECT COALESCE(SUM(val), 0) FROM extracted_values
-                """,
-                params,
-            )
-            total_sales = safe_float(cur.fetchone()[0] or 0)
-
-            # Get total tax collected
-            cur.execute(
-                f"""
-                WITH extracted_values AS (
-                    SELECT 
-                        jsonb_array_elements_text(
-                            CASE 
-                                WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                                    CASE 
-                                        WHEN invoice_data::jsonb ? 'items' THEN 
-                                            jsonb_path_query_array(invoice_data::jsonb->'items', '$[*].salesTaxApplicable')
-                                        ELSE 
-                                            '[]'::jsonb 
-                                    END
-                                ELSE 
-                                    '[]'::jsonb 
-                            END
-                        )::numeric AS val
-                    FROM invoices 
-                    WHERE client_id = %s 
-                    AND env = %s 
-                    AND status = 'Success'
-                    {date_condition}
-                )
-                SELECT COALESCE(SUM(val), 0) FROM extracted_values
-                """,
-                params,
-            )
-            total_tax = safe_float(cur.fetchone()[0] or 0)
-
-            # Get unique buyers count
-            cur.execute(
-                f"""
-                SELECT COUNT(DISTINCT 
-                    CASE 
-                        WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                            CASE 
-                                WHEN invoice_data::jsonb ? 'buyerBusinessName' THEN 
-                                    invoice_data::jsonb->>'buyerBusinessName'
-                                WHEN invoice_data::jsonb ? 'buyerData' AND 
-                                    jsonb_typeof(invoice_data::jsonb->'buyerData') = 'object' AND
-                                    invoice_data::jsonb->'buyerData' ? 'buyerBusinessName' THEN
-                                    invoice_data::jsonb->'buyerData'->>'buyerBusinessName'
-                                ELSE 
-                                    NULL
-                            END
-                        ELSE 
-                            NULL
-                    END)
-                FROM invoices 
-                WHERE client_id = %s 
-                AND env = %s 
-                AND status = 'Success'
-                {date_condition}
-                """,
-                params,
-            )
-            unique_buyers = cur.fetchone()[0] or 0
+        started = time.perf_counter()
+        conn = get_db_connection()
+        cur = conn.cursor()
+        timings["connect_ms"] = round((time.perf_counter() - started) * 1000, 1)
 
-            # Get unique products count
-            cur.execute(
-                f"""
-                WITH product_descriptions AS (
-                        SELECT DISTINCT COALESCE(elem->>'productDescription', elem->>'description', elem->>'productName', elem->>'name') as product_name
-                        FROM invoices,
-                        LATERAL jsonb_array_elements(
-                            CASE 
-                                WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                                    invoice_data::jsonb ? 'items' AND
-                                    jsonb_typeof(invoice_data::jsonb->'items') = 'array' 
-                                THEN invoice_data::jsonb->'items'
-                                ELSE '[]'::jsonb
-                            END
-                        ) as elem
-                        WHERE client_id = %s 
-                        AND env = %s 
-                        AND status = 'Success'
-                        {date_condition}
+        try:
+            step = time.perf_counter()
+            rows = get_dashboard_rows(cur, date_trunc, start_date, end_date, params)
+            timings["query_ms"] = round((time.perf_counter() - step) * 1000, 1)
+
+            step = time.perf_counter()
+            for kind, label, period_date, invoice_count, quantity, sales, tax, distinct_count in rows:
+                sales = safe_float(sales)
+                tax = safe_float(tax)
+                if kind == "summary":
+                    total_invoices = invoice_count or 0
+                    total_sales = sales
+                    total_tax = tax
+                    unique_buyers = distinct_count or 0
+                elif kind == "product_summary":
+                    unique_products = distinct_count or 0
+                elif kind == "period":
+                    time_series_data.append(
+                        {
+                            "period": period_date.strftime(format_string),
+                            "invoice_count": invoice_count or 0,
+                            "total_sales": sales,
+                            "total_tax": tax,
+                            "sales_excluding_tax": sales - tax,
+                        }
                     )
-                    SELECT COUNT(*) FROM product_descriptions WHERE product_name IS NOT NULL
-                """,
-                params,
-            )
-            unique_products = cur.fetchone()[0] or 0
-
-            # Get time series data for sales over time
-            time_series_data = get_time_series_data(
-                cur, client_id, env, period, start_date, end_date
-            )
-
-            # Get top 5 products by sales
-            top_products = get_top_products(cur, client_id, env, start_date, end_date)
-
-            # Get top 5 buyers by sales
-            top_buyers = get_top_buyers(cur, client_id, env, start_date, end_date)
+                elif kind == "product":
+                    top_products.append(
+                        {
+                            "product_name": label or "",
+                            "quantity": safe_float(quantity),
+                            "total_sales": sales,
+                            "total_tax": tax,
+                            "sales_excluding_tax": sales - tax,
+                        }
+                    )
+                elif kind == "buyer":
+                    ic = invoice_count or 0
+                    top_buyers.append(
+                        {
+                            "buyer_name": label,
+                            "total_purchase": sales,
+                            "invoice_count": ic,
+                            "average_purchase": round(sales / ic, 2) if ic > 0 else 0,
+                        }
+                    )
+            timings["assemble_ms"] = round((time.perf_counter() - step) * 1000, 1)
 
         except Exception as e:
-            print(f"Error in dashboard data: {str(e)}")
+            logger.exception("Error in dashboard data: %s", e)
             # Keep defaults and return partial data instead of crashing
 
         cur.close()
         conn.close()
 
-        return jsonify(
-            {
-                "summary": {
-                    "total_invoices": total_invoices,
-                    "total_sales": round(total_sales, 2),
-                    "unique_buyers": unique_buyers,
-                    "unique_products": unique_products,
-                    "revenue_excluding_tax": round(total_sales - total_tax, 2),
-                    "average_invoice_value": round(
-                        total_sales / total_invoices if total_invoices > 0 else 0, 2
-                    ),
-                },
-                "time_series": time_series_data,
-                "top_products": top_products,
-                "top_buyers": top_buyers,
-            }
-        )
-
-    def get_time_series_data(cur, client_id, env, period, start_date, end_date):
-        """Get time series data for the dashboard charts"""
-        format_string = "%Y-%m-%d"
-        # Prefer invoice date stored inside invoice_data JSON when present,
-        # otherwise fall back to created_at. We'll use DATE_TRUNC on the
-        # COALESCE of invoiceDate (casted to timestamp) and created_at.
-        date_trunc = "day"
-
-        if period == "year":
-            format_string = "%Y-%m"
-            date_trunc = "month"
-        elif period == "all":
-            format_string = "%Y-%m"
-            date_trunc = "month"
-
-        # Common date filter condition
+        response = {
+            "summary": {
+                "total_invoices": total_invoices,
+                "total_sales": round(total_sales, 2),
+                "unique_buyers": unique_buyers,
+                "unique_products": unique_products,
+                "revenue_excluding_tax": round(total_sales - total_tax, 2),
+                "average_invoice_value": round(
+                    total_sales / total_invoices if total_invoices > 0 else 0, 2
+                ),
+            },
+            "time_series": time_series_data,
+            "top_products": top_products,
+            "top_buyers": top_buyers,
+        }
+        if app.debug:
+            timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            response["timings"] = timings
+        return jsonify(response)
+
+    def get_dashboard_rows(cur, date_trunc, start_date, end_date, params):
+        """Compute every dashboard metric from one scan of the client's invoices.
+
+        The matching invoices are read once; GROUPING SETS then produce the
+        summary and one row per buyer, and the same invoices' items give the
+        product rows. The time buckets come from the report_daily_totals
+        rollup rather than the invoices. Rows come back as
+        (kind, label, period, invoice_count, quantity, sales, tax, distinct_count)
+        with kind one of summary, period, buyer, product_summary, product; only
+        the top 5 buyers and products are returned.
+        """
         date_condition = ""
-        params = [client_id, env]
-
+        day_condition = ""
         if start_date and end_date:
-            # Filter using invoice date when available, otherwise use created_at
-            date_condition = "AND COALESCE((invoice_data::jsonb->>'invoiceDate')::date, DATE(created_at)) BETWEEN %s AND %s"
-            params.extend([start_date, end_date])
+            date_condition = "AND invoice_date BETWEEN %s AND %s"
+            day_condition = "AND day BETWEEN %s AND %s"
 
-        # Get daily/monthly sales - FIXED
         cur.execute(
             f"""
-            WITH time_periods AS (
+            WITH scoped AS (
                 SELECT 
-                    DATE_TRUNC('{date_trunc}', COALESCE((invoice_data::jsonb->>'invoiceDate')::timestamp, created_at)) as period,
-                    invoice_data,
-                    id
+                    id,
+                    buyer_name,
+                    total_amount,
+                    total_tax
                 FROM invoices 
                 WHERE client_id = %s 
                 AND env = %s 
                 AND status = 'Success'
                 {date_condition}
             ),
-            invoice_counts AS (
-                SELECT period, COUNT(*) as invoice_count
-                FROM time_periods
-                GROUP BY period
-            ),
-            sales_data AS (
-                SELECT 
-                    period,
-                    SUM(val) as total_sales
-                FROM (
-                    SELECT 
-                        period,
-                        jsonb_array_elements_text(
-                            CASE 
-                                WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                                    CASE 
-                                        WHEN invoice_data::jsonb ? 'items' THEN 
-                                            jsonb_path_query_array(invoice_data::jsonb->'items', '$[*].totalValues')
-                                        ELSE 
-                                            '[]'::jsonb 
-                                    END
-                                ELSE 
-                                    '[]'::jsonb 
-                            END
-                        )::numeric AS val
-                    FROM time_periods
-                ) as extracted_values
-                GROUP BY period
+            invoice_rollup AS (
+                SELECT
+                    CASE WHEN GROUPING(buyer_name) = 0 THEN 'buyer' ELSE 'summary' END as kind,
+                    buyer_name as label,
+                    NULL::timestamp as period,
+                    COUNT(*) as invoice_count,
+                    NULL::numeric as quantity,
+                    COALESCE(SUM(total_amount), 0) as sales,
+                    COALESCE(SUM(total_tax), 0) as tax,
+                    COUNT(DISTINCT buyer_name) as distinct_count
+                FROM scoped
+                GROUP BY GROUPING SETS ((), (buyer_name))
             ),
-            tax_data AS (
-                SELECT 
-                    period,
-                    SUM(val) as total_tax
-                FROM (
-                    SELECT 
-                        period,
-                        jsonb_array_elements_text(
-                            CASE 
-                                WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                                    CASE 
-                                        WHEN invoice_data::jsonb ? 'items' THEN 
-                                            jsonb_path_query_array(invoice_data::jsonb->'items', '$[*].salesTaxApplicable')
-                                        ELSE 
-                                            '[]'::jsonb 
-                                    END
-                                ELSE 
-                                    '[]'::jsonb 
-                            END
-                        )::numeric AS val
-                    FROM time_periods
-                ) as extracted_values
-                GROUP BY period
-            )
-            SELECT 
-                ic.period,
-                ic.invoice_count,
-                COALESCE(sd.total_sales, 0) as total_sales,
-                COALESCE(td.total_tax, 0) as total_tax
-            FROM invoice_counts ic
-            LEFT JOIN sales_data sd ON ic.period = sd.period
-            LEFT JOIN tax_data td ON ic.period = td.period
-            ORDER BY ic.period
-            """,
-            params,
-        )
-
-        time_series = []
-        for row in cur.fetchall():
-            period_date, invoice_count, total_sales, total_tax = row
-            ts_total_sales = safe_float(total_sales)
-            ts_total_tax = safe_float(total_tax)
-            time_series.append(
-                {
-                    "period": period_date.strftime(format_string),
-                    "invoice_count": invoice_count or 0,
-                    "total_sales": ts_total_sales,
-                    "total_tax": ts_total_tax,
-                    "sales_excluding_tax": ts_total_sales - ts_total_tax,
-                }
-            )
-
-        return time_series
-
-    def get_top_products(cur, client_id, env, start_date, end_date):
-        """Get top 5 products by sales volume"""
-        # Common date filter condition
-        date_condition = ""
-        params = [client_id, env]
-
-        if start_date and end_date:
-            date_condition = "AND COALESCE((invoice_data::jsonb->>'invoiceDate')::date, DATE(created_at)) BETWEEN %s AND %s"
-            params.extend([start_date, end_date])
-
-        cur.execute(
-            f"""
-            WITH product_items AS (
-                SELECT 
-                    COALESCE(i.productDescription, i.description, i.productName, i.name) as productDescription,
-                    i.quantity::numeric,
-                    i.totalValues::numeric,
-                    i.salesTaxApplicable::numeric
-                FROM invoices, 
-                jsonb_to_recordset(
-                    CASE 
-                        WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                             invoice_data::jsonb ? 'items' AND
-                             jsonb_typeof(invoice_data::jsonb->'items') = 'array' 
-                        THEN invoice_data::jsonb->'items'
-                        ELSE '[]'::jsonb
-                    END
-                ) AS i(productDescription text, description text, productName text, name text, quantity text, totalValues text, salesTaxApplicable text)
-                WHERE client_id = %s 
-                AND env = %s 
-                AND status = 'Success'
-                {date_condition}
-                AND COALESCE(i.productDescription, i.description, i.productName, i.name) IS NOT NULL
-            )
-            SELECT 
-                productDescription,
-                SUM(quantity) as total_quantity,
-                SUM(totalValues) as total_sales,
-                SUM(salesTaxApplicable) as total_tax
-            FROM product_items
-            GROUP BY productDescription
-            ORDER BY total_sales DESC
-            LIMIT 5
-            """,
-            params,
-        )
-
-        top_products = []
-        for row in cur.fetchall():
-            product_name, quantity, total_sales, total_tax = row
-            q = safe_float(quantity)
-            ts = safe_float(total_sales)
-            tt = safe_float(total_tax)
-            top_products.append(
-                {
-                    "product_name": product_name or "",
-                    "quantity": q,
-                    "total_sales": ts,
-                    "total_tax": tt,
-                    "sales_excluding_tax": ts - tt,
-                }
-            )
-
-        return top_products
-
-    def get_top_buyers(cur, client_id, env, start_date, end_date):
-        """Get top 5 buyers by purchase amount"""
-        # Common date filter condition
-        date_condition = ""
-        params = [client_id, env]
-
-        if start_date and end_date:
-            date_condition = "AND COALESCE((invoice_data::jsonb->>'invoiceDate')::date, DATE(created_at)) BETWEEN %s AND %s"
-            params.extend([start_date, end_date])
-
-        # FIXED buyer query
-        cur.execute(
-            f"""
-            WITH buyers AS (
+            period_rollup AS (
                 SELECT
-                    CASE 
-                        WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                            CASE 
-                                WHEN invoice_data::jsonb ? 'buyerBusinessName' THEN 
-                                    invoice_data::jsonb->>'buyerBusinessName'
-                                WHEN invoice_data::jsonb ? 'buyerData' AND 
-                                     jsonb_typeof(invoice_data::jsonb->'buyerData') = 'object' AND
-                                     invoice_data::jsonb->'buyerData' ? 'buyerBusinessName' THEN
-                                    invoice_data::jsonb->'buyerData'->>'buyerBusinessName'
-                                ELSE 'Unknown Buyer'
-                            END
-                        ELSE 'Unknown Buyer'
-                    END as buyer_name,
-                    invoice_data,
-                    id
-                FROM invoices 
-                WHERE client_id = %s 
-                AND env = %s 
-                AND status = 'Success'
-                {date_condition}
+                    'period' as kind,
+                    NULL::text as label,
+                    DATE_TRUNC('{date_trunc}', day::timestamp) as period,
+                    SUM(invoice_count)::bigint as invoice_count,
+                    NULL::numeric as quantity,
+                    SUM(total_amount) as sales,
+                    SUM(total_tax) as tax,
+                    NULL::bigint as distinct_count
+                FROM report_daily_totals
+                WHERE client_id = %s
+                AND env = %s
+                {day_condition}
+                GROUP BY 3
+                HAVING SUM(invoice_count) > 0
             ),
-            buyer_totals AS (
+            item_rollup AS (
                 SELECT
-                    buyer_name,
-                    COUNT(*) as invoice_count,
-                    SUM(val) as total_purchase
+                    CASE
+                        WHEN GROUPING(ii.product_description) = 0 THEN 'product'
+                        ELSE 'product_summary'
+                    END as kind,
+                    ii.product_description as label,
+                    NULL::timestamp as period,
+                    COUNT(DISTINCT ii.invoice_id) as invoice_count,
+                    SUM(ii.quantity) as quantity,
+                    SUM(ii.total) as sales,
+                    SUM(ii.tax) as tax,
+                    COUNT(DISTINCT ii.product_description) as distinct_count
+                FROM scoped
+                JOIN invoice_items ii ON ii.invoice_id = scoped.id
+                WHERE ii.product_description IS NOT NULL
+                GROUP BY GROUPING SETS ((), (ii.product_description))
+            ),
+            ranked AS (
+                SELECT 
+                    all_rows.*,
+                    ROW_NUMBER() OVER (PARTITION BY kind ORDER BY sales DESC NULLS LAST) as row_rank
                 FROM (
-                    SELECT 
-                        buyer_name,
-                        jsonb_array_elements_text(
-                            CASE 
-                                WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                                    CASE 
-                                        WHEN invoice_data::jsonb ? 'items' THEN 
-                                            jsonb_path_query_array(invoice_data::jsonb->'items', '$[*].totalValues')
-                                        ELSE 
-                                            '[]'::jsonb 
-                                    END
-                                ELSE 
-                                    '[]'::jsonb 
-                            END
-                        )::numeric AS val
-                    FROM buyers
-                ) as extracted_values
-                GROUP BY buyer_name
+                    SELECT * FROM invoice_rollup
+                    UNION ALL
+                    SELECT * FROM period_rollup
+                    UNION ALL
+                    SELECT * FROM item_rollup
+                ) all_rows
+                WHERE NOT (kind = 'buyer' AND (label IS NULL OR label = 'Unknown Buyer'))
             )
-            SELECT 
-                buyer_name,
-                total_purchase,
-                invoice_count
-            FROM buyer_totals
-            WHERE buyer_name != 'Unknown Buyer'
-            ORDER BY total_purchase DESC
-            LIMIT 5
+            SELECT kind, label, period, invoice_count, quantity, sales, tax, distinct_count
+            FROM ranked
+            WHERE kind NOT IN ('buyer', 'product') OR row_rank <= 5
+            ORDER BY kind, period, row_rank
             """,
-            params,
+            params + params,
         )
-
-        top_buyers = []
-        for row in cur.fetchall():
-            buyer_name, total_purchase, invoice_count = row
-            tp = safe_float(total_purchase)
-            ic = invoice_count or 0
-            top_buyers.append(
-                {
-                    "buyer_name": buyer_name,
-                    "total_purchase": tp,
-                    "invoice_count": ic,
-                    "average_purchase": round(tp / ic, 2) if ic > 0 else 0,
-                }
-            )
-
-        return top_buyers
+        return cur.fetchall()
 
     @app.route("/api/reports/invoices", methods=["GET"])
+    @data_versions.conditional_get(get_db_connection, "invoices")
+    @report_cache.cached_report(get_db_connection)
     def get_invoice_list():
         """Get list of invoices with filtering options"""
         client_id = session.get("client_id")
@@ -556,10 +367,15 @@ def add_reports_routes(app, get_db_connection, get_env):
         # Always pull production data for reports, regardless of current environment
         env = "production"
 
-        # Pagination parameters
+        # Pagination parameters: page/per_page (offset), or cursor for keyset paging
         page = int(request.args.get("page", 1))
         per_page = int(request.args.get("per_page", 10))
         offset = (page - 1) * per_page
+        use_cursor = "cursor" in request.args
+        cursor = request.args.get("cursor", "")
+        count_mode = request.args.get("count", "none" if use_cursor else "exact")
+        if count_mode not in pagination.COUNT_MODES:
+            count_mode = "exact"
 
         # Filtering parameters
         start_date = request.args.get("start_date")
@@ -580,6 +396,16 @@ def add_reports_routes(app, get_db_connection, get_env):
         if sort_order not in ["ASC", "DESC"]:
             sort_order = "DESC"
 
+        cursor_row = None
+        if use_cursor:
+            if sort_field != "created_at":
+                return jsonify({"error": "Cursor pagination requires sort_field=created_at"}), 400
+            if cursor:
+                try:
+                    cursor_row = pagination.decode_cursor(cursor)
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+
         conn = get_db_connection()
         cur = conn.cursor()
 
@@ -588,43 +414,18 @@ def add_reports_routes(app, get_db_connection, get_env):
         params = [client_id, env]
 
         if start_date and end_date:
-            where_conditions.append("COALESCE((invoice_data::jsonb->>'invoiceDate')::date, DATE(created_at)) BETWEEN %s AND %s")
+            where_conditions.append("invoice_date BETWEEN %s AND %s")
             params.extend([start_date, end_date])
 
         # Add buyer name filter if provided
         if buyer_name:
-            where_conditions.append(
-                """
-                (
-                    (jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                     invoice_data::jsonb ? 'buyerBusinessName' AND
-                     LOWER(invoice_data::jsonb->>'buyerBusinessName') LIKE LOWER(%s))
-                    OR
-                    (jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                     invoice_data::jsonb ? 'buyerData' AND
-                     jsonb_typeof(invoice_data::jsonb->'buyerData') = 'object' AND
-                     invoice_data::jsonb->'buyerData' ? 'buyerBusinessName' AND
-                     LOWER(invoice_data::jsonb->'buyerData'->>'buyerBusinessName') LIKE LOWER(%s))
-                )
-            """
-            )
-            search_term = f"%{buyer_name}%"
-            params.extend([search_term, search_term])
+            where_conditions.append("LOWER(buyer_name) LIKE LOWER(%s)")
+            params.append(f"%{buyer_name}%")
 
-        # Add invoice reference filter if provided - prefer invoiceRefNo, fall back to fbr_response.invoiceNumber
+        # Add invoice reference filter if provided - invoiceRefNo or the FBR invoice number
         if invoice_ref:
             where_conditions.append(
-                """
-                (
-                    (jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                     invoice_data::jsonb ? 'invoiceRefNo' AND
-                     LOWER(invoice_data::jsonb->>'invoiceRefNo') LIKE LOWER(%s))
-                    OR
-                    (jsonb_typeof(fbr_response::jsonb) = 'object' AND
-                     fbr_response::jsonb ? 'invoiceNumber' AND
-                     LOWER(fbr_response::jsonb->>'invoiceNumber') LIKE LOWER(%s))
-                )
-            """
+                "(LOWER(invoice_ref) LIKE LOWER(%s) OR LOWER(fbr_invoice_number) LIKE LOWER(%s))"
             )
             search_term = f"%{invoice_ref}%"
             params.extend([search_term, search_term])
@@ -635,16 +436,9 @@ def add_reports_routes(app, get_db_connection, get_env):
                 """
                 EXISTS (
                     SELECT 1
-                    FROM jsonb_array_elements(
-                        CASE 
-                            WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                                 invoice_data::jsonb ? 'items' AND
-                                 jsonb_typeof(invoice_data::jsonb->'items') = 'array' 
-                            THEN invoice_data::jsonb->'items'
-                            ELSE '[]'::jsonb
-                        END
-                    ) as item
-                    WHERE LOWER(item->>'productDescription') LIKE LOWER(%s)
+                    FROM invoice_items ii
+                    WHERE ii.invoice_id = invoices.id
+                    AND LOWER(ii.product_description) LIKE LOWER(%s)
                 )
             """
             )
@@ -656,62 +450,26 @@ def add_reports_routes(app, get_db_connection, get_env):
         # Build sorting
         order_by = ""
         if sort_field == "created_at":
-            order_by = f"created_at {sort_order}"
+            order_by = f"created_at {sort_order}, id {sort_order}"
         elif sort_field == "invoice_ref":
-            order_by = f"""
-                COALESCE(
-                CASE WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND invoice_data::jsonb ? 'invoiceRefNo'
-                    THEN invoice_data::jsonb->>'invoiceRefNo'
-                    ELSE NULL
-                END,
-                    CASE WHEN jsonb_typeof(fbr_response::jsonb) = 'object' AND fbr_response::jsonb ? 'invoiceNumber'
-                         THEN fbr_response::jsonb->>'invoiceNumber'
-                         ELSE NULL
-                    END
-                ) {sort_order} NULLS LAST
-            """
+            order_by = f"COALESCE(invoice_ref, fbr_invoice_number) {sort_order} NULLS LAST"
         elif sort_field == "buyer_name":
-            order_by = f"""
-                COALESCE(
-                    CASE WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND invoice_data::jsonb ? 'buyerBusinessName'
-                         THEN invoice_data::jsonb->>'buyerBusinessName'
-                         ELSE NULL
-                    END,
-                    CASE WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND invoice_data::jsonb ? 'buyerData'
-                         AND jsonb_typeof(invoice_data::jsonb->'buyerData') = 'object'
-                         AND invoice_data::jsonb->'buyerData' ? 'buyerBusinessName'
-                         THEN invoice_data::jsonb->'buyerData'->>'buyerBusinessName'
-                         ELSE NULL
-                    END
-                ) {sort_order} NULLS LAST
-            """
+            order_by = f"buyer_name {sort_order} NULLS LAST"
         elif sort_field == "total_amount":
-            # Fixed the total_amount sorting - use more direct approach
-            order_by = f"""
-                (
-                    SELECT COALESCE(SUM(
-                        jsonb_array_elements_text(
-                            CASE 
-                                WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                                     invoice_data::jsonb ? 'items' 
-                                THEN jsonb_path_query_array(invoice_data::jsonb->'items', '$[*].totalValues')
-                                ELSE '[]'::jsonb
-                            END
-                        )::numeric
-                    ), 0)
-                ) {sort_order}
-            """
+            order_by = f"COALESCE(total_amount, 0) {sort_order}"
 
-        # Count total results for pagination
-        count_query = f"""
-            SELECT COUNT(*)
-            FROM invoices
-            WHERE {where_clause}
-        """
-        cur.execute(count_query, params)
-        total_count = cur.fetchone()[0]
+        # Count total results for pagination (the filters only, not the cursor position)
+        total_count = pagination.count_rows(
+            cur, f"FROM invoices WHERE {where_clause}", params, count_mode
+        )
+
+        page_conditions = list(where_conditions)
+        page_params = list(params)
+        if cursor_row:
+            page_conditions.append(pagination.keyset_condition(sort_order))
+            page_params.extend(cursor_row[:2])
 
-        # Main query with pagination
+        # Main query with pagination; keyset pages read one extra row to know if more follow
         main_query = f"""
             SELECT 
                 id,
@@ -719,18 +477,24 @@ def add_reports_routes(app, get_db_connection, get_env):
                 invoice_data,
                 fbr_response
             FROM invoices
-            WHERE {where_clause}
+            WHERE {" AND ".join(page_conditions)}
             ORDER BY {order_by}
-            LIMIT %s OFFSET %s
+            LIMIT %s {"" if use_cursor else "OFFSET %s"}
         """
 
         # Add pagination parameters
-        params.extend([per_page, offset])
+        if use_cursor:
+            page_params.append(per_page + 1)
+        else:
+            page_params.extend([per_page, offset])
 
-        cur.execute(main_query, params)
+        cur.execute(main_query, page_params)
+        rows = cur.fetchall()
+        has_more = use_cursor and len(rows) > per_page
+        rows = rows[:per_page]
 
         invoices = []
-        for row in cur.fetchall():
+        for row in rows:
             id, created_at, invoice_data_raw, fbr_response_raw = row
 
             # Parse JSON data
@@ -848,8 +612,28 @@ def add_reports_routes(app, get_db_connection, get_env):
         cur.close()
         conn.close()
 
+        if use_cursor:
+            served = (cursor_row[2] if cursor_row else 0) + len(rows)
+            next_cursor = None
+            if has_more:
+                next_cursor = pagination.encode_cursor(rows[-1][1], rows[-1][0], served)
+            return jsonify(
+                {
+                    "invoices": invoices,
+                    "pagination": {
+                        "per_page": per_page,
+                        "next_cursor": next_cursor,
+                        "has_more": has_more,
+                        "total_items": total_count,
+                        "count_mode": count_mode,
+                    },
+                }
+            )
+
         # Calculate pagination info
-        total_pages = (total_count + per_page - 1) // per_page  # Ceiling division
+        total_pages = (
+            (total_count + per_page - 1) // per_page if total_count is not None else None
+        )  # Ceiling division
 
         return jsonify(
             {
@@ -859,11 +643,13 @@ def add_reports_routes(app, get_db_connection, get_env):
                     "per_page": per_page,
                     "total_items": total_count,
                     "total_pages": total_pages,
+                    "count_mode": count_mode,
                 },
             }
         )
 
     @app.route("/api/reports/invoice/<invoice_id>", methods=["GET"])
+    @report_cache.cached_report(get_db_connection, env=lambda: request.args.get("env") or get_env())
     def get_invoice_detail(invoice_id):
         """Get detailed information about a specific invoice (accepts UUID/text id).
         Ensures the invoice belongs to the logged-in client's requested env.
@@ -1074,6 +860,7 @@ def add_reports_routes(app, get_db_connection, get_env):
         )
 
     @app.route("/api/reports/product-analytics", methods=["GET"])
+    @report_cache.cached_report(get_db_connection)
     def get_product_analytics():
         """Get product-specific analytics"""
         client_id = session.get("client_id")
@@ -1094,15 +881,14 @@ def add_reports_routes(app, get_db_connection, get_env):
         try:
             # First attempt with current environment
             products = get_products_for_env(cur, client_id, env, start_date, end_date, product_name)
-            
-            # Debug output
-            print(f"Products API: Found {len(products)} products (env={env})")
+            logger.debug("Products API: found %s products", len(products), extra={"env": env})
             
             # If no products found and not in production, try with production environment
             if len(products) == 0 and env != 'production':
-                print("Products API: no products found for session env, retrying with env='production'")
                 products = get_products_for_env(cur, client_id, 'production', start_date, end_date, product_name)
-                print(f"Products API (production retry): Found {len(products)} products (env=production)")
+                logger.debug(
+                    "Products API: no products for env %s, production retry found %s", env, len(products)
+                )
                 
                 # If we found products in production, use that environment for the rest of the queries
                 if len(products) > 0:
@@ -1115,13 +901,11 @@ def add_reports_routes(app, get_db_connection, get_env):
             monthly_trends = []
             if top_products:
                 monthly_trends = get_product_monthly_trends(cur, client_id, env, top_products, start_date, end_date)
-                print(f"Products API: Monthly trends has {len(monthly_trends)} entries")
             
             # Get buyer distribution data
             buyer_distribution = {}
             if products:
                 buyer_distribution = get_product_buyer_distribution(cur, client_id, env, product_name, start_date, end_date)
-                print(f"Products API: Buyer distribution has {len(buyer_distribution)} entries")
             
             return jsonify({
                 "products": products,
@@ -1131,9 +915,7 @@ def add_reports_routes(app, get_db_connection, get_env):
             })
 
         except Exception as e:
-            print(f"Error in product analytics: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error in product analytics: %s", e)
             return jsonify({
                 "products": [],
                 "monthly_trends": [],
@@ -1153,80 +935,39 @@ def add_reports_routes(app, get_db_connection, get_env):
         # Date condition
         date_condition = ""
         if start_date and end_date:
-            date_condition = "AND COALESCE((invoice_data::jsonb->>'invoiceDate')::date, DATE(created_at)) BETWEEN %s AND %s"
+            date_condition = "AND invoice_date BETWEEN %s AND %s"
             params.extend([start_date, end_date])
         
         # Product name filter
         product_filter = ""
         if product_name:
-            product_filter = """
-            AND (
-                jsonb_array_elements(
-                    CASE 
-                        WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                            invoice_data::jsonb ? 'items' AND
-                            jsonb_typeof(invoice_data::jsonb->'items') = 'array' 
-                        THEN invoice_data::jsonb->'items'
-                        ELSE '[]'::jsonb
-                    END
-                )->>'productDescription' ILIKE %s
-            )
-            """
+            product_filter = "AND LOWER(product_description) LIKE LOWER(%s)"
             params.append(f"%{product_name}%")
         
         # Execute the main product query
         query = f"""
-        WITH invoice_items AS (
-                SELECT 
-                    inv.id,
-                    inv.created_at,
-                    item->>'productDescription' as product_description,
-                    (item->>'quantity')::numeric as quantity,
-                    (item->>'valueSalesExcludingST')::numeric as value_excl,
-                    (item->>'salesTaxApplicable')::numeric as tax,
-                    (item->>'totalValues')::numeric as total_value,
-                    TO_CHAR(COALESCE((inv.invoice_data::jsonb->>'invoiceDate')::timestamp, inv.created_at), 'YYYY-MM') as month
-            FROM 
-                invoices inv,
-                jsonb_array_elements(
-                    CASE 
-                        WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                            invoice_data::jsonb ? 'items' AND
-                            jsonb_typeof(invoice_data::jsonb->'items') = 'array' 
-                        THEN invoice_data::jsonb->'items'
-                        ELSE '[]'::jsonb
-                    END
-                ) as item
-            WHERE 
-                inv.client_id = %s 
-                AND inv.env = %s 
-                AND inv.status = 'Success'
-                {date_condition}
-                AND item->>'productDescription' IS NOT NULL
-        )
         SELECT 
             product_description,
             SUM(quantity) as total_quantity,
             SUM(value_excl) as total_value,
             SUM(tax) as total_tax,
-            SUM(total_value) as total_sales,
+            SUM(total) as total_sales,
             COUNT(DISTINCT month) as months_active
         FROM 
             invoice_items
         WHERE 
-            product_description IS NOT NULL
-            {f"AND LOWER(product_description) LIKE LOWER(%s)" if product_name else ""}
+            client_id = %s 
+            AND env = %s 
+            {date_condition}
+            AND product_description IS NOT NULL
+            {product_filter}
         GROUP BY 
             product_description
         ORDER BY 
-            total_sales DESC
+            total_sales DESC NULLS LAST
         LIMIT 50
         """
         
-        # If product_name filter is used twice, add it again to params
-        if product_name and product_filter:
-            params.append(f"%{product_name}%")
-        
         cur.execute(query, params)
         
         products = []
@@ -1248,50 +989,40 @@ def add_reports_routes(app, get_db_connection, get_env):
         if not top_products:
             return []
         
-        # Base query parameters
+        # Whole months come from the monthly rollup, other ranges from the raw items
         params = [client_id, env]
-        
-        # Date condition
-        date_condition = ""
-        if start_date and end_date:
-            date_condition = "AND COALESCE((invoice_data::jsonb->>'invoiceDate')::date, DATE(created_at)) BETWEEN %s AND %s"
-            params.extend([start_date, end_date])
+        rollup = monthly_rollup_condition(start_date, end_date)
+        if rollup is not None:
+            source = "report_monthly_products"
+            date_condition, date_params = rollup
+        else:
+            source = "invoice_items"
+            date_condition = "AND invoice_date BETWEEN %s AND %s"
+            date_params = [start_date, end_date]
+        params.extend(date_params)
         
         # Add top products as parameters
         placeholders = ", ".join(["%s"] * len(top_products))
         params.extend(top_products)
         
         query = f"""
-        WITH product_months AS (
-            SELECT 
-                item->>'productDescription' as product_description,
-                TO_CHAR(COALESCE((inv.invoice_data::jsonb->>'invoiceDate')::timestamp, inv.created_at), 'YYYY-MM') as month,
-                SUM((item->>'quantity')::numeric) as quantity,
-                SUM((item->>'totalValues')::numeric) as total_sales
-            FROM 
-                invoices inv,
-                jsonb_array_elements(
-                    CASE 
-                        WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                            invoice_data::jsonb ? 'items' AND
-                            jsonb_typeof(invoice_data::jsonb->'items') = 'array' 
-                        THEN invoice_data::jsonb->'items'
-                        ELSE '[]'::jsonb
-                    END
-                ) as item
-            WHERE 
-                inv.client_id = %s 
-                AND inv.env = %s 
-                AND inv.status = 'Success'
-                {date_condition}
-                AND item->>'productDescription' IN ({placeholders})
-            GROUP BY 
-                item->>'productDescription',
-                month
-            ORDER BY 
-                month, product_description
-        )
-        SELECT * FROM product_months
+        SELECT 
+            product_description,
+            month,
+            SUM(quantity) as quantity,
+            SUM(total) as total_sales
+        FROM 
+            {source}
+        WHERE 
+            client_id = %s 
+            AND env = %s 
+            {date_condition}
+            AND product_description IN ({placeholders})
+        GROUP BY 
+            product_description,
+            month
+        ORDER BY 
+            month, product_description
         """
         
         cur.execute(query, params)
@@ -1319,53 +1050,39 @@ def add_reports_routes(app, get_db_connection, get_env):
         # Date condition
         date_condition = ""
         if start_date and end_date:
-            date_condition = "AND COALESCE((invoice_data::jsonb->>'invoiceDate')::date, DATE(created_at)) BETWEEN %s AND %s"
+            date_condition = "AND invoice_date BETWEEN %s AND %s"
             params.extend([start_date, end_date])
         
         # Product filter
         product_filter = ""
         if product_name:
-            product_filter = "AND item->>'productDescription' ILIKE %s"
+            product_filter = "AND product_description ILIKE %s"
             params.append(f"%{product_name}%")
         
         query = f"""
         WITH product_buyers AS (
             SELECT 
-                item->>'productDescription' as product_description,
-                COALESCE(
-                    invoice_data::jsonb->>'buyerBusinessName',
-                    invoice_data::jsonb->'buyerData'->>'buyerBusinessName',
-                    'Unknown Buyer'
-                ) as buyer_name,
-                SUM((item->>'totalValues')::numeric) as total_sales
+                product_description,
+                COALESCE(buyer_name, 'Unknown Buyer') as buyer_name,
+                SUM(total) as total_sales
             FROM 
-                invoices inv,
-                jsonb_array_elements(
-                    CASE 
-                        WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                            invoice_data::jsonb ? 'items' AND
-                            jsonb_typeof(invoice_data::jsonb->'items') = 'array' 
-                        THEN invoice_data::jsonb->'items'
-                        ELSE '[]'::jsonb
-                    END
-                ) as item
+                invoice_items
             WHERE 
-                inv.client_id = %s 
-                AND inv.env = %s 
-                AND inv.status = 'Success'
+                client_id = %s 
+                AND env = %s 
                 {date_condition}
-                AND item->>'productDescription' IS NOT NULL
+                AND product_description IS NOT NULL
                 {product_filter}
             GROUP BY 
-                item->>'productDescription',
-                buyer_name
+                product_description,
+                COALESCE(buyer_name, 'Unknown Buyer')
         ),
         ranked_buyers AS (
             SELECT 
                 product_description,
                 buyer_name,
                 total_sales,
-                RANK() OVER (PARTITION BY product_description ORDER BY total_sales DESC) as buyer_rank
+                RANK() OVER (PARTITION BY product_description ORDER BY total_sales DESC NULLS LAST) as buyer_rank
             FROM 
                 product_buyers
             WHERE 
@@ -1393,6 +1110,7 @@ def add_reports_routes(app, get_db_connection, get_env):
         return buyer_distribution
 
     @app.route("/api/reports/buyer-analytics", methods=["GET"])
+    @report_cache.cached_report(get_db_connection)
     def get_buyer_analytics():
         """Get buyer-specific analytics"""
         client_id = session.get("client_id")
@@ -1410,8 +1128,8 @@ def add_reports_routes(app, get_db_connection, get_env):
         conn = get_db_connection()
         cur = conn.cursor()
 
-        # Build WHERE clause and parameters
-        where_conditions = ["client_id = %s", "env = %s", "status = 'Success'"]
+        # Build WHERE clause and parameters (over invoice_items, see invoice_reporting.py)
+        where_conditions = ["client_id = %s", "env = %s", "buyer_name IS NOT NULL", "buyer_name != 'Unknown Buyer'"]
         params = [client_id, env]
 
         if start_date and end_date:
@@ -1421,118 +1139,26 @@ def add_reports_routes(app, get_db_connection, get_env):
         buyer_filter = ""
         buyer_params = []
         if buyer_name:
-            buyer_filter = """
-                AND (
-                    (jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                     invoice_data::jsonb ? 'buyerBusinessName' AND
-                     LOWER(invoice_data::jsonb->>'buyerBusinessName') LIKE LOWER(%s))
-                    OR
-                    (jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                     invoice_data::jsonb ? 'buyerData' AND
-                     jsonb_typeof(invoice_data::jsonb->'buyerData') = 'object' AND
-                     invoice_data::jsonb->'buyerData' ? 'buyerBusinessName' AND
-                     LOWER(invoice_data::jsonb->'buyerData'->>'buyerBusinessName') LIKE LOWER(%s))
-                )
-            """
-            search_term = f"%{buyer_name}%"
-            buyer_params = [search_term, search_term]
+            buyer_filter = "AND LOWER(buyer_name) LIKE LOWER(%s)"
+            buyer_params = [f"%{buyer_name}%"]
 
         full_params = params + buyer_params
 
-        # Get buyer sales data - FIXED - use jsonb_array_elements_text
+        # Get buyer sales data
         cur.execute(
             f"""
-            WITH buyers AS (
-                SELECT
-                    CASE 
-                        WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                            CASE 
-                                WHEN invoice_data::jsonb ? 'buyerBusinessName' THEN 
-                                    invoice_data::jsonb->>'buyerBusinessName'
-                                WHEN invoice_data::jsonb ? 'buyerData' AND 
-                                     jsonb_typeof(invoice_data::jsonb->'buyerData') = 'object' AND
-                                     invoice_data::jsonb->'buyerData' ? 'buyerBusinessName' THEN
-                                    invoice_data::jsonb->'buyerData'->>'buyerBusinessName'
-                                ELSE 'Unknown Buyer'
-                            END
-                        ELSE 'Unknown Buyer'
-                    END as buyer_name,
-                    invoice_data,
-                    id,
-                    created_at
-                FROM invoices
-                WHERE {" AND ".join(where_conditions)}
-                {buyer_filter}
-            ),
-            buyer_totals AS (
-                SELECT
-                    buyer_name,
-                    SUM(val) as total_purchase
-                FROM (
-                    SELECT 
-                        buyer_name,
-                        jsonb_array_elements_text(
-                            CASE 
-                                WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                                    CASE 
-                                        WHEN invoice_data::jsonb ? 'items' THEN 
-                                            jsonb_path_query_array(invoice_data::jsonb->'items', '$[*].totalValues')
-                                        ELSE 
-                                            '[]'::jsonb 
-                                    END
-                                ELSE 
-                                    '[]'::jsonb 
-                            END
-                        )::numeric AS val
-                    FROM buyers
-                ) as purchase_values
-                GROUP BY buyer_name
-            ),
-            buyer_tax AS (
-                SELECT
-                    buyer_name,
-                    SUM(val) as total_tax
-                FROM (
-                    SELECT 
-                        buyer_name,
-                        jsonb_array_elements_text(
-                            CASE 
-                                WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                                    CASE 
-                                        WHEN invoice_data::jsonb ? 'items' THEN 
-                                            jsonb_path_query_array(invoice_data::jsonb->'items', '$[*].salesTaxApplicable')
-                                        ELSE 
-                                            '[]'::jsonb 
-                                    END
-                                ELSE 
-                                    '[]'::jsonb 
-                            END
-                        )::numeric AS val
-                    FROM buyers
-                ) as tax_values
-                GROUP BY buyer_name
-            ),
-            buyer_counts AS (
-                SELECT 
-                    buyer_name,
-                    COUNT(*) as invoice_count,
-                    MIN(created_at) as first_purchase,
-                    MAX(created_at) as last_purchase
-                FROM buyers
-                GROUP BY buyer_name
-            )
             SELECT 
-                bt.buyer_name,
-                bt.total_purchase,
-                COALESCE(btx.total_tax, 0) as total_tax,
-                bc.invoice_count,
-                bc.first_purchase,
-                bc.last_purchase
-            FROM buyer_totals bt
-            JOIN buyer_counts bc ON bt.buyer_name = bc.buyer_name
-            LEFT JOIN buyer_tax btx ON bt.buyer_name = btx.buyer_name
-            WHERE bt.buyer_name != 'Unknown Buyer'
-            ORDER BY bt.total_purchase DESC
+                buyer_name,
+                SUM(total) as total_purchase,
+                COALESCE(SUM(tax), 0) as total_tax,
+                COUNT(DISTINCT invoice_id) as invoice_count,
+                MIN(created_at) as first_purchase,
+                MAX(created_at) as last_purchase
+            FROM invoice_items
+            WHERE {" AND ".join(where_conditions)}
+            {buyer_filter}
+            GROUP BY buyer_name
+            ORDER BY total_purchase DESC NULLS LAST
             LIMIT 50
             """,
             full_params,
@@ -1561,7 +1187,7 @@ def add_reports_routes(app, get_db_connection, get_env):
                 else:
                     days_since_last = 0
             except Exception as e:
-                print(f"Error calculating days since last purchase: {e}")
+                logger.warning("Error calculating days since last purchase: %s", e)
                 days_since_last = 0
 
             buyers.append(
@@ -1585,100 +1211,45 @@ def add_reports_routes(app, get_db_connection, get_env):
         monthly_trends = []
 
         if top_buyers:
-            monthly_params = []
-            buyer_conditions = []
-
-            for buyer in top_buyers:
-                buyer_conditions.append(
-                    """
-                    (
-                        (jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                         invoice_data::jsonb ? 'buyerBusinessName' AND
-                         invoice_data::jsonb->>'buyerBusinessName' = %s)
-                        OR
-                        (jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                         invoice_data::jsonb ? 'buyerData' AND
-                         jsonb_typeof(invoice_data::jsonb->'buyerData') = 'object' AND
-                         invoice_data::jsonb->'buyerData' ? 'buyerBusinessName' AND
-                         invoice_data::jsonb->'buyerData'->>'buyerBusinessName' = %s)
-                    )
-                """
-                )
-                monthly_params.extend([buyer, buyer])
-
-            buyer_where = " OR ".join(buyer_conditions)
-            monthly_full_params = params + monthly_params
+            placeholders = ", ".join(["%s"] * len(top_buyers))
+            rollup = monthly_rollup_condition(start_date, end_date)
 
-            # FIXED monthly trends query - use jsonb_array_elements_text
-            cur.execute(
-                f"""
-                WITH buyer_months AS (
-                    SELECT
-                        CASE 
-                            WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                                CASE 
-                                    WHEN invoice_data::jsonb ? 'buyerBusinessName' THEN 
-                                        invoice_data::jsonb->>'buyerBusinessName'
-                                    WHEN invoice_data::jsonb ? 'buyerData' AND 
-                                         jsonb_typeof(invoice_data::jsonb->'buyerData') = 'object' AND
-                                         invoice_data::jsonb->'buyerData' ? 'buyerBusinessName' THEN
-                                        invoice_data::jsonb->'buyerData'->>'buyerBusinessName'
-                                    ELSE 'Unknown Buyer'
-                                END
-                            ELSE 'Unknown Buyer'
-                        END as buyer_name,
-                        TO_CHAR(created_at, 'YYYY-MM') as month,
-                        invoice_data,
-                        id
-                    FROM invoices
-                    WHERE {" AND ".join(where_conditions)}
-                    AND ({buyer_where})
-                ),
-                invoice_counts AS (
+            if rollup is not None:
+                month_condition, month_params = rollup
+                cur.execute(
+                    f"""
                     SELECT 
                         buyer_name,
                         month,
-                        COUNT(*) as invoice_count
-                    FROM buyer_months
+                        SUM(total_amount) as total_purchase,
+                        SUM(invoice_count) as invoice_count
+                    FROM report_monthly_buyers
+                    WHERE client_id = %s
+                    AND env = %s
+                    {month_condition}
+                    AND buyer_name IN ({placeholders})
                     GROUP BY buyer_name, month
-                ),
-                purchase_totals AS (
+                    HAVING SUM(invoice_count) > 0
+                    ORDER BY month, buyer_name
+                    """,
+                    [client_id, env] + month_params + top_buyers,
+                )
+            else:
+                cur.execute(
+                    f"""
                     SELECT 
                         buyer_name,
-                        month,
-                        SUM(val) as total_purchase
-                    FROM (
-                        SELECT 
-                            buyer_name,
-                            month,
-                            jsonb_array_elements_text(
-                                CASE 
-                                    WHEN jsonb_typeof(invoice_data::jsonb) = 'object' THEN 
-                                        CASE 
-                                            WHEN invoice_data::jsonb ? 'items' THEN 
-                                                jsonb_path_query_array(invoice_data::jsonb->'items', '$[*].totalValues')
-                                            ELSE 
-                                                '[]'::jsonb 
-                                        END
-                                    ELSE 
-                                        '[]'::jsonb 
-                                END
-                            )::numeric AS val
-                        FROM buyer_months
-                    ) as extracted_values
+                        TO_CHAR(created_at, 'YYYY-MM') as month,
+                        SUM(total) as total_purchase,
+                        COUNT(DISTINCT invoice_id) as invoice_count
+                    FROM invoice_items
+                    WHERE {" AND ".join(where_conditions)}
+                    AND buyer_name IN ({placeholders})
                     GROUP BY buyer_name, month
+                    ORDER BY month, buyer_name
+                    """,
+                    params + top_buyers,
                 )
-                SELECT 
-                    ic.buyer_name,
-                    ic.month,
-                    pt.total_purchase,
-                    ic.invoice_count
-                FROM invoice_counts ic
-                JOIN purchase_totals pt ON ic.buyer_name = pt.buyer_name AND ic.month = pt.month
-                ORDER BY ic.month, ic.buyer_name
-                """,
-                monthly_full_params,
-            )
 
             monthly_data = {}
             for row in cur.fetchall():
@@ -1694,69 +1265,50 @@ def add_reports_routes(app, get_db_connection, get_env):
             monthly_trends = list(monthly_data.values())
             monthly_trends.sort(key=lambda x: x["month"])
 
-        # Get product distribution for each buyer
+        # Get product distribution for the top 10 buyers in one query
         product_distribution = {}
 
         if buyers:
-            for buyer in buyers[:10]:  # Process top 10 buyers
-                buyer_name = buyer["buyer_name"]
-                product_params = params + [buyer_name, buyer_name]
+            distribution_buyers = [b["buyer_name"] for b in buyers[:10]]
+            placeholders = ", ".join(["%s"] * len(distribution_buyers))
 
-                cur.execute(
-                    f"""
-                    WITH buyer_products AS (
-                        SELECT 
-                            COALESCE(i.productDescription, i.description, i.productName, i.name) as productDescription,
-                            SUM(i.totalValues::numeric) as total_sales,
-                            SUM(i.quantity::numeric) as total_quantity
-                        FROM invoices inv, 
-                        jsonb_to_recordset(
-                            CASE 
-                                WHEN jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                                     invoice_data::jsonb ? 'items' AND
-                                     jsonb_typeof(invoice_data::jsonb->'items') = 'array' 
-                                THEN invoice_data::jsonb->'items'
-                                ELSE '[]'::jsonb
-                            END
-                        ) AS i(productDescription text, description text, productName text, name text, totalValues text, quantity text)
-                        WHERE client_id = %s 
-                        AND env = %s 
-                        AND status = 'Success'
-                        {" AND DATE(created_at) BETWEEN %s AND %s" if start_date and end_date else ""}
-                        AND COALESCE(i.productDescription, i.description, i.productName, i.name) IS NOT NULL
-                        AND (
-                            (jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                             invoice_data::jsonb ? 'buyerBusinessName' AND
-                             invoice_data::jsonb->>'buyerBusinessName' = %s)
-                            OR
-                            (jsonb_typeof(invoice_data::jsonb) = 'object' AND
-                             invoice_data::jsonb ? 'buyerData' AND
-                             jsonb_typeof(invoice_data::jsonb->'buyerData') = 'object' AND
-                             invoice_data::jsonb->'buyerData' ? 'buyerBusinessName' AND
-                             invoice_data::jsonb->'buyerData'->>'buyerBusinessName' = %s)
-                        )
-                        GROUP BY COALESCE(i.productDescription, i.description, i.productName, i.name)
-                        ORDER BY total_sales DESC
-                        LIMIT 10
-                    )
-                    SELECT * FROM buyer_products
-                    """,
-                    product_params,
+            cur.execute(
+                f"""
+                WITH buyer_products AS (
+                    SELECT 
+                        buyer_name,
+                        product_description,
+                        SUM(total) as total_sales,
+                        SUM(quantity) as total_quantity
+                    FROM invoice_items
+                    WHERE {" AND ".join(where_conditions)}
+                    AND buyer_name IN ({placeholders})
+                    AND product_description IS NOT NULL
+                    GROUP BY buyer_name, product_description
+                ),
+                ranked_products AS (
+                    SELECT 
+                        buyer_products.*,
+                        ROW_NUMBER() OVER (PARTITION BY buyer_name ORDER BY total_sales DESC NULLS LAST) as product_rank
+                    FROM buyer_products
                 )
+                SELECT buyer_name, product_description, total_sales, total_quantity
+                FROM ranked_products
+                WHERE product_rank <= 10
+                ORDER BY buyer_name, product_rank
+                """,
+                params + distribution_buyers,
+            )
 
-                products = []
-                for row in cur.fetchall():
-                    product_name, total_sales, total_quantity = row
-                    products.append(
-                        {
-                            "product_name": product_name,
-                            "total_sales": safe_float(total_sales),
-                            "total_quantity": safe_float(total_quantity),
-                        }
-                    )
-
-                if products:
-                    product_distribution[buyer_name] = products
+            for row in cur.fetchall():
+                buyer, product_name, total_sales, total_quantity = row
+                product_distribution.setdefault(buyer, []).append(
+                    {
+                        "product_name": product_name,
+                        "total_sales": safe_float(total_sales),
+                        "total_quantity": safe_float(total_quantity),
+                    }
+                )
 
         cur.close()
         conn.close()
@@ -1771,6 +1323,8 @@ def add_reports_routes(app, get_db_connection, get_env):
         )
 
     @app.route("/api/reports/downloadable-invoices", methods=["GET"])
+    @data_versions.conditional_get(get_db_connection, "invoices")
+    @report_cache.cached_report(get_db_connection)
     def get_downloadable_invoices():
         """Get list of invoices with stored PDFs"""
         client_id = session.get("client_id")
@@ -1787,7 +1341,7 @@ def add_reports_routes(app, get_db_connection, get_env):
         cur = conn.cursor()
 
         # Build query
-        where_conditions = ["client_id = %s", "pdf_data IS NOT NULL", "status = 'Success'"]
+        where_conditions = ["client_id = %s", invoice_pdf.HAS_PDF_SQL, "status = 'Success'"]
         params = [client_id]
 
         # Environment filter
@@ -1810,7 +1364,7 @@ def add_reports_routes(app, get_db_connection, get_env):
                 created_at,
                 invoice_data,
                 env,
-                LENGTH(pdf_data) as pdf_size
+                COALESCE(pdf_size, LENGTH(pdf_data)) as pdf_size
             FROM invoices
             WHERE {where_clause}
             ORDER BY created_at DESC
@@ -1880,11 +1434,12 @@ def add_reports_routes(app, get_db_connection, get_env):
         conn = get_db_connection()
         cur = conn.cursor()
 
+        # The legacy blob is only selected for rows not yet moved to the PDF store
         cur.execute(
-            """
-            SELECT pdf_data, invoice_data 
+            f"""
+            SELECT pdf_sha256, CASE WHEN pdf_sha256 IS NULL THEN pdf_data END, invoice_data
             FROM invoices 
-            WHERE id = %s AND client_id = %s AND pdf_data IS NOT NULL
+            WHERE id = %s AND client_id = %s AND {invoice_pdf.HAS_PDF_SQL}
             """,
             (invoice_id, client_id),
         )
@@ -1896,7 +1451,7 @@ def add_reports_routes(app, get_db_connection, get_env):
         if not row:
             return jsonify({"error": "Invoice PDF not found"}), 404
 
-        pdf_data, invoice_data_raw = row
+        pdf_sha256, pdf_data, invoice_data_raw = row
 
         # Get invoice reference for filename
         try:
@@ -1913,20 +1468,18 @@ def add_reports_routes(app, get_db_connection, get_env):
         except:
             invoice_ref = "invoice"
 
-        # Send PDF
-        pdf_stream = BytesIO(pdf_data)
-        pdf_stream.seek(0)
-
-        return send_file(
-            pdf_stream,
-            mimetype="application/pdf",
-            as_attachment=True,
-            download_name=f"{invoice_ref}.pdf",
-        )
+        # Send PDF (straight from the store's file, with Range support)
+        return invoice_pdf.send_invoice_pdf(pdf_sha256, pdf_data, f"{invoice_ref}.pdf")
 
     @app.route("/api/reports/download-invoices-bulk", methods=["POST"])
     def download_bulk_invoices():
-        """Download multiple invoices as a ZIP file"""
+        """Download multiple invoices as a ZIP file
+
+        The archive is streamed: invoices come from one server-side cursor a
+        few rows at a time, each PDF is read from the PDF store (or the legacy
+        pdf_data blob) and written to the response as soon as it is added,
+        stored without recompression (PDFs are already compressed).
+        """
         client_id = session.get("client_id")
         if not client_id:
             return jsonify({"error": "Unauthorized"}), 401
@@ -1937,58 +1490,72 @@ def add_reports_routes(app, get_db_connection, get_env):
         if not invoice_ids:
             return jsonify({"error": "No invoices selected"}), 400
 
-        import zipfile
-
-        conn = get_db_connection()
-        cur = conn.cursor()
+        invoice_ids = [str(invoice_id) for invoice_id in invoice_ids]
 
-        # Create ZIP in memory
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for invoice_id in invoice_ids:
+        def generate():
+            conn = get_db_connection()
+            # Named (server-side) cursor: rows are fetched itersize at a time
+            cur = conn.cursor(name=f"bulk_zip_{uuid.uuid4().hex}")
+            cur.itersize = BULK_ZIP_FETCH_SIZE
+            try:
                 cur.execute(
-                    """
-                    SELECT pdf_data, invoice_data 
-                    FROM invoices 
-                    WHERE id = %s AND client_id = %s AND pdf_data IS NOT NULL
+                    f"""
+                    SELECT id, pdf_sha256, CASE WHEN pdf_sha256 IS NULL THEN pdf_data END, invoice_data
+                    FROM invoices
+                    WHERE client_id = %s AND id IN %s AND {invoice_pdf.HAS_PDF_SQL}
+                    ORDER BY array_position(%s::text[], id::text)
                     """,
-                    (invoice_id, client_id),
+                    (client_id, tuple(invoice_ids), invoice_ids),
                 )
 
-                row = cur.fetchone()
-                if not row:
-                    continue
-
-                pdf_data, invoice_data_raw = row
-
-                # Get invoice reference for filename
-                try:
-                    invoice_data = (
-                        json.loads(invoice_data_raw)
-                        if isinstance(invoice_data_raw, str)
-                        else invoice_data_raw
-                    )
-                    invoice_ref = (
-                        invoice_data.get("invoiceRefNo")
-                        or invoice_data.get("fbrInvoiceNumber")
-                        or f"invoice_{invoice_id}"
-                    )
-                except:
-                    invoice_ref = f"invoice_{invoice_id}"
-
-                # Add PDF to ZIP
-                zip_file.writestr(f"{invoice_ref}.pdf", pdf_data)
-
-        cur.close()
-        conn.close()
-
-        zip_buffer.seek(0)
-
-        return send_file(
-            zip_buffer,
+                stream = ZipStream()
+                used_names = set()
+                with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as zip_file:
+                    for invoice_id, pdf_sha256, pdf_data, invoice_data_raw in cur:
+                        # Get invoice reference for filename
+                        try:
+                            invoice_data = (
+                                json.loads(invoice_data_raw)
+                                if isinstance(invoice_data_raw, str)
+                                else invoice_data_raw
+                            )
+                            invoice_ref = (
+                                invoice_data.get("invoiceRefNo")
+                                or invoice_data.get("fbrInvoiceNumber")
+                                or f"invoice_{invoice_id}"
+                            )
+                        except Exception:
+                            invoice_ref = f"invoice_{invoice_id}"
+
+                        try:
+                            pdf_binary = invoice_pdf.read_invoice_pdf(pdf_sha256, pdf_data)
+                        except FileNotFoundError:
+                            # Leave it out rather than break the archive mid-stream
+                            logger.warning(
+                                "Stored PDF %s of invoice %s is missing; left out of the ZIP",
+                                pdf_sha256,
+                                invoice_id,
+                            )
+                            continue
+
+                        filename = f"{invoice_ref}.pdf"
+                        if filename in used_names:
+                            filename = f"{invoice_ref}_{invoice_id}.pdf"
+                        used_names.add(filename)
+
+                        # Add PDF to ZIP and send what has been written so far
+                        zip_file.writestr(filename, pdf_binary)
+                        yield stream.take()
+                yield stream.take()
+            finally:
+                cur.close()
+                conn.close()
+
+        download_name = f"invoices_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        return Response(
+            generate(),
             mimetype="application/zip",
-            as_attachment=True,
-            download_name=f"invoices_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            headers={"Content-Disposition": f"attachment; filename={download_name}"},
         )
 
     @app.route('/api/reports/summarize', methods=['POST'])
@@ -2139,7 +1706,7 @@ def add_reports_routes(app, get_db_connection, get_env):
             return jsonify({'invoices': invoices, 'products': products, 'buyers': buyers, 'overall': {'total_value_excl': round(overall['total_value_excl'],2), 'total_tax': round(overall['total_tax'],2), 'total_amount': round(overall['total_amount'],2)}})
 
         except Exception as e:
-            print(f"Error in summarize_invoices: {e}")
+            logger.exception("Error in summarize_invoices: %s", e)
             cur.close()
             conn.close()
             return jsonify({'error': 'Internal server error'}), 500
@@ -0,0 +1,155 @@
+"""
+Per-request phase timings.
+
+Each request gets a RequestTimer that the instrumented layers add to: DB
+queries (db_pool's TimedCursor), FBR API calls (fbr_client), Jinja template
+rendering (Flask's template signals) and WeasyPrint renders (pdf_renderer).
+The totals go out in a Server-Timing header, so the browser's network panel
+shows where a slow /submit-fbr or report spent its time, and requests slower
+than SLOW_REQUEST_MS are logged with their full breakdown.
+
+The timer is kept in the WSGI environ rather than flask.g, so work done in
+threads running under copy_current_request_context (the FBR batch submit) is
+counted for the request that started it. Outside a request, record() and
+phase() do nothing.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import before_render_template, has_request_context, request, template_rendered
+
+logger = logging.getLogger(__name__)
+
+_ENVIRON_KEY = "erp.request_timer"
+
+# Server-Timing metric names and descriptions, in header order
+PHASES = (
+    ("db", "Database"),
+    ("fbr", "FBR API"),
+    ("template", "Templates"),
+    ("pdf", "WeasyPrint"),
+)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class RequestTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, count=1):
+        with self._lock:
+            entry = self.phases.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += count
+
+    def breakdown(self):
+        """{"total_ms": ..., "<phase>_ms": ..., "<phase>_count": ...} for logging."""
+        result = {"total_ms": round((time.perf_counter() - self.started) * 1000, 1)}
+        with self._lock:
+            for name, (seconds, count) in self.phases.items():
+                result[f"{name}_ms"] = round(seconds * 1000, 1)
+                result[f"{name}_count"] = count
+        return result
+
+    def server_timing(self):
+        metrics = []
+        with self._lock:
+            phases = dict(self.phases)
+        for name, description in PHASES:
+            if name in phases:
+                seconds, count = phases[name]
+                metrics.append(f'{name};dur={seconds * 1000:.1f};desc="{description} x{count}"')
+        metrics.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+def current_timer():
+    if not has_request_context():
+        return None
+    return request.environ.get(_ENVIRON_KEY)
+
+
+def record(name, seconds, count=1):
+    timer = current_timer()
+    if timer is not None:
+        timer.add(name, seconds, count)
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the with-block to the current request's *name* phase."""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+# Templates can include/render others, so starts are stacked per thread
+_template_starts = threading.local()
+
+
+def _template_started(sender, template, context, **extra):
+    stack = getattr(_template_starts, "stack", None)
+    if stack is None:
+        stack = _template_starts.stack = []
+    stack.append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    stack = getattr(_template_starts, "stack", None)
+    if stack:
+        record("template", time.perf_counter() - stack.pop())
+
+
+def init_app(app):
+    """Time every request; add Server-Timing and log the ones over SLOW_REQUEST_MS."""
+    slow_request_ms = _env_int("SLOW_REQUEST_MS", 1000)
+    send_header = os.getenv("SERVER_TIMING_HEADER", "true").lower() == "true"
+
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def _start_request_timer():
+        request.environ[_ENVIRON_KEY] = RequestTimer()
+
+    @app.after_request
+    def _finish_request_timer(response):
+        timer = request.environ.get(_ENVIRON_KEY)
+        if timer is None:
+            return response
+        if send_header:
+            response.headers["Server-Timing"] = timer.server_timing()
+        breakdown = timer.breakdown()
+        if slow_request_ms > 0 and breakdown["total_ms"] >= slow_request_ms:
+            logger.warning(
+                "Slow request: %s %s took %.0f ms",
+                request.method,
+                request.path,
+                breakdown["total_ms"],
+                extra={
+                    "method": request.method,
+                    "path": request.path,
+                    "endpoint": request.endpoint,
+                    "status": response.status_code,
+                    **breakdown,
+                },
+            )
+        return response
@@ -0,0 +1,76 @@
+"""
+invoice_date extraction of invoice_reporting (needs PostgreSQL).
+
+Runs against the database configured by DB_HOST / DB_NAME / DB_USER /
+DB_PASSWORD / DB_PORT and is skipped when DB_NAME is not set; no tables are
+read or written.
+
+    DB_NAME=erp_test python -m unittest tests.test_invoice_reporting
+"""
+import datetime
+import json
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import invoice_reporting  # noqa: E402
+
+CREATED_AT = datetime.datetime(2024, 5, 17, 10, 30)
+
+
+@unittest.skipUnless(os.getenv("DB_NAME"), "DB_NAME not set")
+class InvoiceDateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import psycopg2
+
+        cls.conn = psycopg2.connect(
+            host=os.getenv("DB_HOST"),
+            database=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            port=os.getenv("DB_PORT"),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def invoice_date(self, invoice_data):
+        cur = self.conn.cursor()
+        try:
+            cur.execute(
+                f"""
+                SELECT {invoice_reporting._INVOICE_DATE_SQL}
+                FROM (VALUES (%s::text, %s::timestamp)) AS inv(invoice_data, created_at)
+                """,
+                (json.dumps(invoice_data), CREATED_AT),
+            )
+            return cur.fetchone()[0]
+        finally:
+            cur.close()
+            self.conn.rollback()
+
+    def test_valid_dates(self):
+        self.assertEqual(self.invoice_date({"invoiceDate": "2024-03-09"}), datetime.date(2024, 3, 9))
+        self.assertEqual(self.invoice_date({"invoiceDate": "2024-02-29"}), datetime.date(2024, 2, 29))
+        self.assertEqual(
+            self.invoice_date({"invoiceDate": "2024-12-31T00:00:00"}), datetime.date(2024, 12, 31)
+        )
+
+    def test_invalid_dates_fall_back_to_created_at(self):
+        for value in ("2024-02-30", "2023-02-29", "2024-13-01", "2024-04-31", "2024-00-10", "0000-01-01"):
+            with self.subTest(invoiceDate=value):
+                self.assertEqual(self.invoice_date({"invoiceDate": value}), CREATED_AT.date())
+
+    def test_missing_or_malformed_dates_fall_back_to_created_at(self):
+        for invoice_data in ({}, {"invoiceDate": ""}, {"invoiceDate": "17/05/2024"}, ["not", "an", "object"]):
+            with self.subTest(invoice_data=invoice_data):
+                self.assertEqual(self.invoice_date(invoice_data), CREATED_AT.date())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,264 @@
+"""
+Per-session invoice workspace.
+
+The Excel and form flows are multi-step: /upload-excel, then /get-json, then
+/submit-fbr (or the -batch variants) and the PDF download. The intermediate
+state (uploaded workbook, built invoice JSON, parsed batch) used to sit in
+process-global dicts keyed only by env, so consecutive steps had to hit the
+same gunicorn worker and users overwrote each other's state. It now lives in
+a workspace keyed by (client_id, env, session id), where the session id is a
+random token kept in the signed session cookie, and every entry expires after
+WORKSPACE_TTL seconds.
+
+The default "postgres" backend keeps entries in workspace_entries, so any
+worker on any node can continue a flow; "local" keeps them in WORKSPACE_DIR,
+which is enough for several workers sharing one host. Other backends can be
+added with register_backend() and selected with WORKSPACE_BACKEND.
+
+Uploaded workbooks are stored in the workspace as bytes and written to the
+upload folder as <sha256><ext> on first use in a process, so excel_parser
+keeps reading (and caching) a local file.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import session
+
+logger = logging.getLogger(__name__)
+
+INVOICE_SLOT = "invoice"
+BATCH_SLOT = "batch"
+UPLOAD_SLOT = "upload"
+UPLOAD_META_SLOT = "upload_meta"
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class PostgresWorkspaceBackend:
+    def __init__(self, get_db_connection, purge_interval=600):
+        self.get_db_connection = get_db_connection
+        self.purge_interval = purge_interval
+
+        self._last_purge = time.monotonic()
+        self._lock = threading.Lock()
+
+    def get(self, key, slot):
+        conn = self.get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                SELECT value FROM workspace_entries
+                WHERE client_id = %s AND env = %s AND session_id = %s AND slot = %s
+                  AND expires_at > NOW()
+                """,
+                key + (slot,),
+            )
+            row = cur.fetchone()
+        finally:
+            cur.close()
+            conn.close()
+        return bytes(row[0]) if row else None
+
+    def put(self, key, slot, value, ttl):
+        conn = self.get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                INSERT INTO workspace_entries (client_id, env, session_id, slot, value, expires_at)
+                VALUES (%s, %s, %s, %s, %s, NOW() + %s * INTERVAL '1 second')
+                ON CONFLICT (client_id, env, session_id, slot) DO UPDATE
+                SET value = EXCLUDED.value,
+                    expires_at = EXCLUDED.expires_at,
+                    updated_at = NOW()
+                """,
+                key + (slot, value, ttl),
+            )
+            if self._purge_due():
+                cur.execute("DELETE FROM workspace_entries WHERE expires_at <= NOW()")
+                if cur.rowcount:
+                    logger.info("Purged %s expired workspace entries", cur.rowcount)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def delete(self, key, slot):
+        conn = self.get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                DELETE FROM workspace_entries
+                WHERE client_id = %s AND env = %s AND session_id = %s AND slot = %s
+                """,
+                key + (slot,),
+            )
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _purge_due(self):
+        # Expired rows are swept by whichever write comes along every purge_interval
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_purge < self.purge_interval:
+                return False
+            self._last_purge = now
+            return True
+
+
+class LocalWorkspaceBackend:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key, slot):
+        digest = hashlib.sha256("\0".join(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest, slot)
+
+    def get(self, key, slot):
+        path = self._path(key, slot)
+        try:
+            with open(path, "rb") as f:
+                expires_at = float(f.readline())
+                if expires_at <= time.time():
+                    return None
+                return f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, key, slot, value, ttl):
+        header = f"{time.time() + ttl}\n".encode("ascii")
+        _write_atomic(self._path(key, slot), header + value)
+
+    def delete(self, key, slot):
+        try:
+            os.unlink(self._path(key, slot))
+        except FileNotFoundError:
+            pass
+
+
+_backends = {
+    "postgres": lambda get_db_connection: PostgresWorkspaceBackend(
+        get_db_connection,
+        purge_interval=_env_int("WORKSPACE_PURGE_INTERVAL", 600),
+    ),
+    "local": lambda get_db_connection: LocalWorkspaceBackend(
+        os.getenv("WORKSPACE_DIR", os.path.join(tempfile.gettempdir(), "erp_workspaces"))
+    ),
+}
+_backend = None
+_ttl = _env_int("WORKSPACE_TTL", 86400)
+_upload_dir = "uploads"
+
+
+def register_backend(name, factory):
+    """Make *factory* (called with get_db_connection) selectable as WORKSPACE_BACKEND=name.
+
+    A backend implements get(key, slot) -> bytes or None, put(key, slot,
+    value, ttl) and delete(key, slot); key is (client_id, env, session id).
+    """
+    _backends[name] = factory
+
+
+def init_store(get_db_connection, upload_dir="uploads"):
+    global _backend, _upload_dir
+    name = os.getenv("WORKSPACE_BACKEND", "postgres")
+    if name not in _backends:
+        raise ValueError(f"Unknown WORKSPACE_BACKEND: {name}")
+    _backend = _backends[name](get_db_connection)
+    _upload_dir = upload_dir
+    return _backend
+
+
+def _key(env):
+    workspace_id = session.get("workspace_id")
+    if not workspace_id:
+        workspace_id = uuid.uuid4().hex
+        session["workspace_id"] = workspace_id
+    return (str(session.get("client_id") or ""), env, workspace_id)
+
+
+def load(env, slot):
+    """JSON value of *slot* in this session's *env* workspace (objects as OrderedDict), or None."""
+    value = _backend.get(_key(env), slot)
+    if value is None:
+        return None
+    return json.loads(value.decode("utf-8"), object_pairs_hook=OrderedDict)
+
+
+def save(env, slot, value):
+    data = json.dumps(value, allow_nan=False).encode("utf-8")
+    _backend.put(_key(env), slot, data, _ttl)
+
+
+def discard(env, slot):
+    _backend.delete(_key(env), slot)
+
+
+def _local_upload_path(meta):
+    return os.path.join(_upload_dir, f"{meta['sha256']}{meta['ext']}")
+
+
+def save_upload(env, filename, content):
+    """Keep an uploaded workbook in the workspace; returns its local path."""
+    ext = os.path.splitext(filename)[1].lower()
+    meta = {"filename": filename, "sha256": hashlib.sha256(content).hexdigest(), "ext": ext}
+    key = _key(env)
+    _backend.put(key, UPLOAD_SLOT, content, _ttl)
+    save(env, UPLOAD_META_SLOT, meta)
+
+    path = _local_upload_path(meta)
+    if not os.path.exists(path):
+        _write_atomic(path, content)
+    return path
+
+
+def load_upload(env):
+    """(local path, sha256) of the workbook last uploaded in this workspace, or (None, None).
+
+    The file is fetched from the workspace when this process has not seen it yet.
+    """
+    meta = load(env, UPLOAD_META_SLOT)
+    if not meta:
+        return None, None
+    path = _local_upload_path(meta)
+    if not os.path.exists(path):
+        content = _backend.get(_key(env), UPLOAD_SLOT)
+        if content is None:
+            return None, None
+        _write_atomic(path, content)
+    return path, meta["sha256"]